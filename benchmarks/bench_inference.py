@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+BACKENDS = ('torch', 'onnx_fp32', 'onnx_int8')
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+WORDS = ('the climate is changing warming global temperature carbon dioxide co2 emissions fossil fuels sea level ice '
+         'arctic antarctic glacier melting record hottest year science scientists consensus models data evidence '
+         'natural cycle sun solar activity volcanoes ocean heat extreme weather hurricanes droughts floods wildfires '
+         'renewable energy wind power electricity cost jobs economy policy tax government regulation hoax alarmists '
+         'fraud grant money warmists always changed medieval warm period little ice age pause since 1998 not no '
+         'never because but and or of to in on for with that this it was were will would could should has have '
+         'been more less than higher lower rising falling century decades years million billion tons percent '
+         'plants food crops greening benefit harm humans human activity caused cause effect impact risk future').split()
+DEFAULT_SETTINGS = {
+    'num_texts': 2000,
+    'median_words': 30,
+    'length_sigma': 0.6,
+    'max_length': 256,
+    'batch_sizes': [1, 8, 32],
+    'threads': None,
+    'iterations': 30,
+    'warmup': 3,
+    'seed': 0,
+    'model': {'dim': 256, 'hidden_dim': 1024, 'n_layers': 4, 'n_heads': 4, 'num_labels': 8}
+}
+
+
+def synthetic_corpus(num_texts, median_words=30, sigma=0.6, max_words=250, seed=0):
+    """
+    Generates quote-like texts whose word counts follow a log-normal distribution, like the quotes of the
+    training data: most quotes have a few dozen words and a long tail is much longer.
+
+    Args:
+        num_texts (int): Number of texts.
+        median_words (int): Median number of words.
+        sigma (float): Standard deviation of the log of the word count.
+        max_words (int): Maximum number of words.
+        seed (int): Random seed.
+
+    Returns:
+        list of str: The texts.
+    """
+    rng = np.random.default_rng(seed)
+    lengths = np.clip(rng.lognormal(np.log(median_words), sigma, num_texts).astype(int), 3, max_words)
+    return [' '.join(rng.choice(WORDS, length)) for length in lengths]
+
+
+def read_corpus(path, text_column='quote', limit=None):
+    """
+    Reads the quotes of a Parquet, JSONL or CSV file, e.g. the validation data, for a benchmark on real lengths.
+    """
+    from bulk_classify import iter_input_chunks
+
+    texts = []
+    for chunk in iter_input_chunks(path, [text_column]):
+        texts.extend(chunk[text_column].fillna('').astype(str))
+        if limit is not None and len(texts) >= limit:
+            return texts[:limit]
+    return texts
+
+
+def build_models(work_dir, model_settings, max_length, seed=0):
+    """
+    Builds the benchmarked models offline from a randomly initialized DistilBERT: a model artifact for
+    `load_model_for_inference`, its fp32 ONNX export and the dynamically quantized ONNX model.
+
+    Args:
+        work_dir (str): Directory for the models.
+        model_settings (dict): DistilBertConfig arguments, e.g. 'dim', 'n_layers' and 'num_labels'.
+        max_length (int): Maximum sequence length.
+        seed (int): Random seed of the weights.
+
+    Returns:
+        dict: The model configuration for `load_model_for_inference` and `load_predictor`, with 'onnx_fp32' and
+        'onnx_int8' the paths of the ONNX models.
+    """
+    import torch
+    from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+    from artifact import save_model_artifact
+    from quantize import convert_to_onnx, dynamic_quantize
+
+    vocab_path = os.path.join(work_dir, 'vocab.txt')
+    with open(vocab_path, 'w') as file:
+        file.write('\n'.join(SPECIAL_TOKENS + sorted(set(WORDS))))
+    tokenizer = DistilBertTokenizer(vocab_path, do_lower_case=True)
+
+    torch.manual_seed(seed)
+    model_config = DistilBertConfig(vocab_size=len(tokenizer), max_position_embeddings=max(512, max_length),
+                                    **model_settings)
+    model = DistilBertForSequenceClassification(model_config).eval()
+    artifact_dir = os.path.join(work_dir, 'artifact')
+    save_model_artifact(model, tokenizer, artifact_dir)
+
+    quantize_config = {'onnx_path': os.path.join(work_dir, 'model.onnx'),
+                       'quantized_onnx_path': os.path.join(work_dir, 'model_int8.onnx')}
+    convert_to_onnx(model, {'max_length': max_length}, quantize_config, tokenizer=tokenizer)
+    dynamic_quantize(quantize_config)
+    return {'model_artifact_path': artifact_dir, 'tokenizer_model': artifact_dir, 'max_length': max_length,
+            'onnx_fp32': quantize_config['onnx_path'], 'onnx_int8': quantize_config['quantized_onnx_path']}
+
+
+def _load_predictor(backend, model_config, threads):
+    from predict import load_predictor
+
+    if backend == 'torch':
+        import torch
+        torch.set_num_threads(threads)
+        return load_predictor(model_config, backend='torch', device='cpu')
+    from onnx_session import load_session
+    session = load_session(model_config[backend], {'session_intra_op_threads': threads,
+                                                   'session_inter_op_threads': 1})
+    return load_predictor(model_config, backend='onnx', session=session)
+
+
+def benchmark_backend(backend, model_config, texts, batch_sizes, threads, iterations=30, warmup=3, seed=0):
+    """
+    Measures one backend end to end, from raw texts to probabilities, at each thread count and batch size.
+    Every timed call classifies a different random batch of the corpus.
+
+    Args:
+        backend (str): 'torch', 'onnx_fp32' or 'onnx_int8'.
+        model_config (dict): The result of `build_models`.
+        texts (list of str): The corpus.
+        batch_sizes (list of int): Texts per call.
+        threads (list of int): Intra-op thread counts.
+        iterations (int): Timed calls per setting.
+        warmup (int): Untimed calls per setting.
+        seed (int): Random seed of the batches.
+
+    Returns:
+        dict: 'load_s' (time to load the first predictor), 'peak_rss_mb' (peak resident memory of this process)
+        and 'runs', one dict per setting with 'threads', 'batch_size', 'p50_ms', 'p95_ms', 'p99_ms' and
+        'texts_per_second'.
+    """
+    rng = np.random.default_rng(seed)
+    runs = []
+    load_s = None
+    for num_threads in threads:
+        start = time.perf_counter()
+        predictor = _load_predictor(backend, model_config, num_threads)
+        load_s = load_s if load_s is not None else time.perf_counter() - start
+        for batch_size in batch_sizes:
+            for _ in range(warmup):
+                predictor.predict_proba([texts[i] for i in rng.integers(0, len(texts), batch_size)])
+            timings = []
+            for _ in range(iterations):
+                batch = [texts[i] for i in rng.integers(0, len(texts), batch_size)]
+                start = time.perf_counter()
+                predictor.predict_proba(batch)
+                timings.append(time.perf_counter() - start)
+            timings = np.array(timings) * 1000
+            runs.append({'threads': num_threads, 'batch_size': batch_size,
+                         'p50_ms': float(np.percentile(timings, 50)),
+                         'p95_ms': float(np.percentile(timings, 95)),
+                         'p99_ms': float(np.percentile(timings, 99)),
+                         'texts_per_second': float(batch_size * iterations / (timings.sum() / 1000))})
+    return {'load_s': load_s, 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'runs': runs}
+
+
+def machine_info():
+    import torch
+    import onnxruntime
+
+    return {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'python': platform.python_version(), 'torch': torch.__version__, 'onnxruntime': onnxruntime.__version__}
+
+
+def run_suite(settings=None, corpus_path=None, backends=BACKENDS, work_dir=None):
+    """
+    Runs the benchmark suite. Each backend runs in a fresh process, so that its peak memory is measured alone.
+
+    Args:
+        settings (dict, optional): Overrides of DEFAULT_SETTINGS.
+        corpus_path (str, optional): A file of real quotes, see `read_corpus`. A synthetic corpus is used if None.
+        backends (list of str): The backends to benchmark.
+        work_dir (str, optional): Directory for the models and corpus, a temporary directory if None.
+
+    Returns:
+        dict: 'machine', 'settings' and 'backends', the result of `benchmark_backend` per backend.
+    """
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    settings['threads'] = settings['threads'] or sorted({1, os.cpu_count() or 1})
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        work_dir = work_dir or temporary_dir
+        if corpus_path is not None:
+            texts = read_corpus(corpus_path, limit=settings['num_texts'])
+        else:
+            texts = synthetic_corpus(settings['num_texts'], settings['median_words'], settings['length_sigma'],
+                                     seed=settings['seed'])
+        model_config = build_models(work_dir, settings['model'], settings['max_length'], settings['seed'])
+        with open(os.path.join(work_dir, 'job.json'), 'w') as file:
+            json.dump({'settings': settings, 'model_config': model_config, 'texts': texts}, file)
+
+        results = {'machine': machine_info(), 'settings': {**settings, 'corpus': corpus_path or 'synthetic'},
+                   'backends': {}}
+        for backend in backends:
+            print(f"Benchmarking {backend}...")
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', backend,
+                                        '--work-dir', work_dir], capture_output=True, text=True)
+            if completed.returncode != 0:
+                raise RuntimeError(f"The {backend} benchmark failed:\n{completed.stderr}")
+            results['backends'][backend] = json.loads(completed.stdout.strip().splitlines()[-1])
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25):
+    """
+    Compares benchmark results to a baseline. A setting regresses if its p95 latency or peak memory grew, or its
+    throughput dropped, by more than `tolerance`. Only settings present in both are compared.
+
+    Args:
+        results (dict): The result of `run_suite`.
+        baseline (dict): A stored result of `run_suite`.
+        tolerance (float): Allowed relative change.
+
+    Returns:
+        list of dict: The regressions, with 'backend', 'setting', 'metric', 'baseline', 'current' and 'change'.
+    """
+    regressions = []
+
+    def check(backend, setting, metric, old, new, higher_is_better=False):
+        change = (new - old) / old if old else 0.0
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append({'backend': backend, 'setting': setting, 'metric': metric, 'baseline': old,
+                                'current': new, 'change': change})
+
+    for backend, result in results['backends'].items():
+        old_result = baseline.get('backends', {}).get(backend)
+        if old_result is None:
+            continue
+        check(backend, 'process', 'peak_rss_mb', old_result['peak_rss_mb'], result['peak_rss_mb'])
+        old_runs = {(run['threads'], run['batch_size']): run for run in old_result['runs']}
+        for run in result['runs']:
+            old_run = old_runs.get((run['threads'], run['batch_size']))
+            if old_run is None:
+                continue
+            setting = f"threads={run['threads']} batch_size={run['batch_size']}"
+            check(backend, setting, 'p95_ms', old_run['p95_ms'], run['p95_ms'])
+            check(backend, setting, 'texts_per_second', old_run['texts_per_second'], run['texts_per_second'],
+                  higher_is_better=True)
+    return regressions
+
+
+def format_results(results):
+    lines = ['| backend | threads | batch size | p50 ms | p95 ms | p99 ms | texts/s |', '|---|---|---|---|---|---|---|']
+    for backend, result in results['backends'].items():
+        for run in result['runs']:
+            lines.append(f"| {backend} | {run['threads']} | {run['batch_size']} | {run['p50_ms']:.1f} | "
+                         f"{run['p95_ms']:.1f} | {run['p99_ms']:.1f} | {run['texts_per_second']:.0f} |")
+    lines.append('')
+    for backend, result in results['backends'].items():
+        lines.append(f"{backend}: load {result['load_s']:.2f} s, peak RSS {result['peak_rss_mb']:.0f} MB")
+    return '\n'.join(lines)
+
+
+def main():
+    """
+    Command line entry point: `python benchmarks/bench_inference.py [--output results.json] [--corpus quotes.parquet]
+    [--update-baseline]`. Exits with status 1 if a setting regressed against the stored baseline.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark inference latency, throughput and memory.")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help="Store the results as the new baseline.")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--corpus', help="Parquet, JSONL or CSV file of real quotes.")
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--batch-sizes', type=int, nargs='+')
+    parser.add_argument('--threads', type=int, nargs='+')
+    parser.add_argument('--iterations', type=int)
+    parser.add_argument('--worker', choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(os.path.join(args.work_dir, 'job.json'), 'r') as file:
+            job = json.load(file)
+        settings = job['settings']
+        print(json.dumps(benchmark_backend(args.worker, job['model_config'], job['texts'], settings['batch_sizes'],
+                                           settings['threads'], settings['iterations'], settings['warmup'],
+                                           settings['seed'])))
+        return
+
+    overrides = {key: value for key, value in [('batch_sizes', args.batch_sizes), ('threads', args.threads),
+                                               ('iterations', args.iterations)] if value is not None}
+    results = run_suite(overrides, corpus_path=args.corpus, backends=args.backends)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(format_results(results))
+    print(f"Results saved at {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved at {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare to, store one with --update-baseline.")
+        return
+    with open(args.baseline, 'r') as file:
+        baseline = json.load(file)
+    if baseline.get('machine', {}).get('cpu_count') != results['machine']['cpu_count']:
+        print("Warning: the baseline was measured on a machine with another number of cores.")
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression['backend']} {regression['setting']} {regression['metric']}: "
+              f"{regression['baseline']:.1f} -> {regression['current']:.1f} ({regression['change']:+.0%})")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
+
+
+if __name__ == '__main__':
+    main()
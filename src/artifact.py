@@ -0,0 +1,128 @@
+import os
+import argparse
+import torch
+from safetensors.torch import load_file, save_file
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+
+ARTIFACT_WEIGHTS = 'model.safetensors'
+
+
+def save_model_artifact(model, tokenizer, artifact_dir, fp16=False):
+    """
+    Saves a self-contained model artifact: the model config, the tokenizer vocabulary and the weights in
+    safetensors format. Loading it needs neither the Hugging Face cache nor network access.
+
+    Args:
+        model (DistilBertForSequenceClassification): The trained model.
+        tokenizer (DistilBertTokenizer or PrunedTokenizer): The tokenizer of the model.
+        artifact_dir (str): Directory where the artifact is saved.
+        fp16 (bool): Store the floating point weights in half precision, which halves the artifact size.
+
+    Returns:
+        str: The file path of the weights.
+    """
+    os.makedirs(artifact_dir, exist_ok=True)
+    model.config.save_pretrained(artifact_dir)
+    tokenizer.save_pretrained(artifact_dir)
+
+    state_dict = {}
+    for name, tensor in model.state_dict().items():
+        tensor = tensor.detach().cpu()
+        if fp16 and tensor.is_floating_point():
+            tensor = tensor.half()
+        state_dict[name] = tensor.contiguous()
+    weights_path = os.path.join(artifact_dir, ARTIFACT_WEIGHTS)
+    save_file(state_dict, weights_path, metadata={'format': 'pt'})
+    return weights_path
+
+
+def load_model_artifact(artifact_dir, device='cpu', dtype=None):
+    """
+    Loads a model artifact saved with `save_model_artifact` in a single pass over the weights.
+
+    The model is created on the meta device, so no memory is allocated or initialized for the weights, and the
+    tensors memory-mapped from the safetensors file are then assigned to it as they are.
+
+    Args:
+        artifact_dir (str): Directory of the artifact.
+        device (str or torch.device): The device to load the weights onto.
+        dtype (torch.dtype, optional): Cast the floating point weights to this type, e.g. torch.float32 for an
+            fp16 artifact. The weights keep their stored type if None.
+
+    Returns:
+        DistilBertForSequenceClassification: The model with the artifact weights, in evaluation mode.
+    """
+    device = torch.device(device)
+    model_config = DistilBertConfig.from_pretrained(artifact_dir)
+    with torch.device('meta'):
+        model = DistilBertForSequenceClassification(model_config)
+
+    state_dict = load_file(os.path.join(artifact_dir, ARTIFACT_WEIGHTS), device=str(device))
+    model.load_state_dict(state_dict, assign=True)
+    # Non-persistent buffers are not part of the state dict and are still on the meta device
+    model.distilbert.embeddings.register_buffer(
+        'position_ids', torch.arange(model_config.max_position_embeddings, device=device).expand((1, -1)),
+        persistent=False)
+
+    if dtype is not None:
+        model.to(dtype)
+    model.eval()
+    return model
+
+
+def load_artifact_tokenizer(artifact_dir):
+    """
+    Loads the tokenizer of a model artifact, a PrunedTokenizer if the model has a pruned vocabulary.
+
+    Args:
+        artifact_dir (str): Directory of the artifact.
+
+    Returns:
+        DistilBertTokenizer or PrunedTokenizer: The tokenizer.
+    """
+    if os.path.exists(os.path.join(artifact_dir, 'kept_ids.json')):
+        from vocab_prune import PrunedTokenizer
+        return PrunedTokenizer.from_pretrained(artifact_dir)
+    return DistilBertTokenizer.from_pretrained(artifact_dir, do_lower_case=True)
+
+
+def export_model_artifact(config, artifact_dir, fp16=False):
+    """
+    Exports the trained model and its tokenizer as a model artifact.
+
+    Args:
+        config (dict): Configuration dictionary with the keys used by `load_model_for_inference` and
+            'tokenizer_model', the name or path of the tokenizer. A directory holding a pruned tokenizer is
+            exported as a PrunedTokenizer.
+        artifact_dir (str): Directory where the artifact is saved.
+        fp16 (bool): Store the weights in half precision.
+
+    Returns:
+        str: The file path of the weights.
+    """
+    from model import load_model_for_inference
+
+    model = load_model_for_inference({**config, 'model_artifact_path': None, 'inference_quantization': None}, 'cpu')
+    tokenizer = load_artifact_tokenizer(config['tokenizer_model'])
+    weights_path = save_model_artifact(model, tokenizer, artifact_dir, fp16=fp16)
+    print(f"Model artifact saved at {artifact_dir} ({os.path.getsize(weights_path) / 1e6:.1f} MB of weights)")
+    return weights_path
+
+
+def main():
+    """
+    Command line entry point: `python src/artifact.py --config configs/config.yaml --output models/artifact`.
+    """
+    from config import load_config
+
+    parser = argparse.ArgumentParser(description="Export the trained model as a self-contained safetensors artifact.")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--output', default=None, help="Defaults to model_artifact_path of the config.")
+    parser.add_argument('--fp16', action='store_true', help="Store the weights in half precision.")
+    args = parser.parse_args()
+    config = load_config(args.config)
+    export_model_artifact(config, args.output or config['model_artifact_path'], fp16=args.fp16)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+import os
+import time
+import argparse
+import datetime
+import itertools
+import threading
+import numpy as np
+
+DEFAULT_TOKEN_BUDGETS = (1024, 2048, 4096, 8192, 16384)
+
+
+def _powers_of_two(limit):
+    values = [1]
+    while values[-1] * 2 <= limit:
+        values.append(values[-1] * 2)
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+def candidate_settings(token_budgets=DEFAULT_TOKEN_BUDGETS, threads=None, workers=None, cores=None):
+    """
+    Lists the settings to search: every combination of token budget, intra-op threads per worker and number of
+    workers that does not oversubscribe the cores.
+
+    Args:
+        token_budgets (list of int): Maximum tokens per inference batch.
+        threads (list of int, optional): Intra-op thread counts, defaults to powers of two up to the core count.
+        workers (list of int, optional): Worker counts, defaults to powers of two up to the core count.
+        cores (int, optional): Number of usable cores, defaults to the cores this process may run on.
+
+    Returns:
+        list of dict: The settings, with 'token_budget', 'threads' and 'workers'.
+    """
+    if cores is None:
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    threads = threads or _powers_of_two(cores)
+    workers = workers or _powers_of_two(cores)
+    return [{'token_budget': token_budget, 'threads': num_threads, 'workers': num_workers}
+            for num_workers in workers for num_threads in threads for token_budget in token_budgets
+            if num_workers * num_threads <= cores]
+
+
+def settings_to_config(backend, setting):
+    """
+    Translates a setting into the configuration keys the inference path reads. With the PyTorch backend, several
+    workers run in an InferencePool (see `load_inference_pool`). With the ONNX backend, they share a session
+    pool (see `load_session_pool`). The server runs one batch per worker concurrently.
+
+    Args:
+        backend (str): 'torch' or 'onnx'.
+        setting (dict): 'token_budget', 'threads' and 'workers'.
+
+    Returns:
+        dict: The configuration keys.
+    """
+    tuned = {'token_budget': setting['token_budget'], 'serve_workers': setting['workers']}
+    if backend == 'torch':
+        multi_process = setting['workers'] > 1
+        tuned.update(inference_threads=None if multi_process else setting['threads'],
+                     pool_workers=setting['workers'] if multi_process else None,
+                     pool_threads_per_worker=setting['threads'] if multi_process else None)
+    else:
+        tuned.update(session_intra_op_threads=setting['threads'], session_inter_op_threads=1,
+                     session_pool_size=setting['workers'])
+    return tuned
+
+
+def measure_throughput(predictor, texts, concurrency=1, request_size=32, num_requests=None):
+    """
+    Measures a predictor under load: `concurrency` clients send requests of `request_size` texts back to back,
+    like the workers of the server.
+
+    Args:
+        predictor (BatchPredictor or InferencePool): The predictor, safe for concurrent calls if concurrency > 1.
+        texts (list of str): The texts, split into requests in order.
+        concurrency (int): Number of concurrent clients.
+        request_size (int): Texts per request.
+        num_requests (int, optional): Number of requests, defaults to one pass over the texts.
+
+    Returns:
+        dict: 'p50_ms', 'p95_ms' and 'p99_ms' (request latency) and 'texts_per_second'.
+    """
+    requests = [texts[start:start + request_size] for start in range(0, len(texts), request_size)]
+    num_requests = num_requests or len(requests)
+    for request in requests[:concurrency]:
+        predictor.predict_proba(request)
+
+    counter = itertools.count()
+    latencies = []
+
+    def client():
+        while True:
+            index = next(counter)
+            if index >= num_requests:
+                return
+            start = time.perf_counter()
+            predictor.predict_proba(requests[index % len(requests)])
+            latencies.append(time.perf_counter() - start)
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    num_texts = sum(len(requests[index % len(requests)]) for index in range(num_requests))
+    return {'p50_ms': float(np.percentile(latencies, 50)), 'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)), 'texts_per_second': num_texts / seconds}
+
+
+def _run_setting(config, backend, setting, texts, request_size, num_requests, base_predictor, onnx_path):
+    if backend == 'torch':
+        import torch
+        from worker_pool import InferencePool
+
+        base_predictor.token_budget = setting['token_budget']
+        if setting['workers'] == 1:
+            torch.set_num_threads(setting['threads'])
+            return measure_throughput(base_predictor, texts, 1, request_size, num_requests)
+        with InferencePool(base_predictor, num_workers=setting['workers'], threads_per_worker=setting['threads'],
+                           pin_cores=config.get('pool_pin_cores', True),
+                           start_method=config.get('pool_start_method', 'fork'),
+                           chunk_size=config.get('pool_chunk_size', 256)) as pool:
+            return measure_throughput(pool, texts, setting['workers'], request_size, num_requests)
+
+    from onnx_session import load_session_pool
+    from predict import load_predictor
+    tuned_config = {**config, **settings_to_config(backend, setting)}
+    predictor = load_predictor(tuned_config, backend='onnx', session=load_session_pool(onnx_path, tuned_config))
+    return measure_throughput(predictor, texts, setting['workers'], request_size, num_requests)
+
+
+def autotune(config, texts, backend='torch', onnx_path=None, latency_slo_ms=100.0, settings=None, request_size=None,
+             num_requests=None, verbose=1):
+    """
+    Searches the inference settings of this host: token budget, intra-op threads and number of workers. Each
+    setting is measured with `measure_throughput` on a sample of real quotes, and the setting with the highest
+    throughput whose p95 request latency meets the SLO is chosen.
+
+    Args:
+        config (dict): Configuration dictionary for `load_predictor`. 'serve_max_batch_size' is the default request
+            size, and the 'pool_*' keys other than the worker and thread counts are used for the PyTorch backend.
+        texts (list of str): The sample of quotes.
+        backend (str): 'torch' (on the CPU) or 'onnx'.
+        onnx_path (str, optional): The ONNX model, required for the ONNX backend.
+        latency_slo_ms (float): Maximum p95 request latency in milliseconds.
+        settings (list of dict, optional): The settings to search, defaults to `candidate_settings()`.
+        request_size (int, optional): Texts per request, defaults to 'serve_max_batch_size' or 32.
+        num_requests (int, optional): Requests per setting, defaults to one pass over the texts.
+        verbose (int): Print each measurement if 1.
+
+    Returns:
+        dict: 'best', the chosen setting with its measurements and 'meets_slo' (False if no setting met the SLO,
+        in which case the one with the lowest p95 latency is chosen), and 'results', all measured settings.
+
+    Raises:
+        ValueError: If the backend is not supported or the ONNX backend has no model path.
+    """
+    if backend not in ('torch', 'onnx'):
+        raise ValueError(f"Unsupported backend {backend}. Choose 'torch' or 'onnx'.")
+    if backend == 'onnx' and onnx_path is None:
+        raise ValueError("The ONNX backend needs the path of an ONNX model.")
+    settings = settings or candidate_settings()
+    request_size = request_size or config.get('serve_max_batch_size', 32)
+
+    base_predictor = None
+    if backend == 'torch':
+        from predict import load_predictor
+        base_predictor = load_predictor(config, backend='torch', device='cpu')
+
+    results = []
+    for setting in settings:
+        measurement = _run_setting(config, backend, setting, texts, request_size, num_requests, base_predictor,
+                                   onnx_path)
+        results.append({**setting, **measurement, 'meets_slo': measurement['p95_ms'] <= latency_slo_ms})
+        if verbose:
+            print(f"token_budget={setting['token_budget']} threads={setting['threads']} "
+                  f"workers={setting['workers']}: {measurement['texts_per_second']:.1f} texts/s, "
+                  f"p95 {measurement['p95_ms']:.1f} ms")
+
+    meeting = [result for result in results if result['meets_slo']]
+    best = max(meeting, key=lambda r: r['texts_per_second']) if meeting else min(results, key=lambda r: r['p95_ms'])
+    return {'best': best, 'results': results}
+
+
+def write_autotuned_config(path, backend, best, latency_slo_ms):
+    """
+    Writes the configuration keys of a setting to a YAML file. The inference path merges them into the
+    configuration when 'autotuned_config_path' points to the file, see `inference.apply_autotuned_config`.
+
+    Args:
+        path (str): The output file.
+        backend (str): The backend the setting was tuned for, only applied to that backend.
+        best (dict): The setting chosen by `autotune`.
+        latency_slo_ms (float): The latency SLO of the search.
+    """
+    import yaml
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    header = (f"# Written by src/autotune.py on {datetime.date.today()} for {cores} cores, "
+              f"p95 latency SLO {latency_slo_ms:g} ms\n"
+              f"# Measured {best['texts_per_second']:.1f} texts/s, p50 {best['p50_ms']:.1f} ms, "
+              f"p95 {best['p95_ms']:.1f} ms{'' if best['meets_slo'] else ' (SLO not met)'}\n")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(header)
+        yaml.safe_dump({'autotune_backend': backend, **settings_to_config(backend, best)}, file, sort_keys=False)
+
+
+def load_sample(path, text_column='quote', sample_size=512, seed=0):
+    """
+    Draws a random sample of quotes from a Parquet, JSONL or CSV file, see `bulk_classify.input_format`.
+    """
+    from bulk_classify import iter_input_chunks
+
+    texts = []
+    for chunk in iter_input_chunks(path, [text_column]):
+        texts.extend(chunk[text_column].fillna('').astype(str))
+    if len(texts) > sample_size:
+        indices = np.random.default_rng(seed).choice(len(texts), sample_size, replace=False)
+        texts = [texts[index] for index in indices]
+    return texts
+
+
+def main():
+    """
+    Command line entry point: `python src/autotune.py --config configs/config.yaml [--backend onnx --onnx-path
+    model.onnx] --slo-ms 100`. Writes the chosen setting to config['autotuned_config_path'] unless --output is given.
+    """
+    from config import load_config
+
+    parser = argparse.ArgumentParser(description="Tune the inference settings of this host under a latency SLO.")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch')
+    parser.add_argument('--onnx-path', help="ONNX model for the onnx backend.")
+    parser.add_argument('--slo-ms', type=float, default=100.0, help="Maximum p95 request latency.")
+    parser.add_argument('--data', help="Quotes to sample, defaults to config['valpath'].")
+    parser.add_argument('--sample-size', type=int, default=512)
+    parser.add_argument('--request-size', type=int, help="Texts per request, defaults to serve_max_batch_size.")
+    parser.add_argument('--token-budgets', type=int, nargs='+', default=list(DEFAULT_TOKEN_BUDGETS))
+    parser.add_argument('--threads', type=int, nargs='+')
+    parser.add_argument('--workers', type=int, nargs='+')
+    parser.add_argument('--output', help="Output file, defaults to config['autotuned_config_path'].")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    texts = load_sample(args.data or config['valpath'], sample_size=args.sample_size)
+    report = autotune(config, texts, backend=args.backend, onnx_path=args.onnx_path, latency_slo_ms=args.slo_ms,
+                      settings=candidate_settings(args.token_budgets, args.threads, args.workers),
+                      request_size=args.request_size)
+    best = report['best']
+    if not best['meets_slo']:
+        print(f"No setting meets the SLO of {args.slo_ms:g} ms, choosing the lowest latency.")
+    output = args.output or config.get('autotuned_config_path') or 'configs/autotuned.yaml'
+    write_autotuned_config(output, args.backend, best, args.slo_ms)
+    print(f"Best: token_budget={best['token_budget']} threads={best['threads']} workers={best['workers']} "
+          f"({best['texts_per_second']:.1f} texts/s, p95 {best['p95_ms']:.1f} ms), saved at {output}")
+    if os.path.abspath(output) != os.path.abspath(config.get('autotuned_config_path') or ''):
+        print(f"Set autotuned_config_path to {output} in {args.config} to use it.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+
+CHECKPOINT_FILE = '_checkpoint.json'
+
+
+class _Stopped(Exception):
+    pass
+
+
+def input_format(path):
+    """
+    Returns the format of an input file from its extension: 'parquet', 'jsonl' or 'csv'. JSONL and CSV files may
+    be compressed, e.g. 'quotes.jsonl.gz'.
+
+    Raises:
+        ValueError: If the file type is not supported.
+    """
+    name = path.lower()
+    for suffix in ('.gz', '.bz2', '.zst', '.xz'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    if name.endswith('.parquet'):
+        return 'parquet'
+    if name.endswith('.jsonl') or name.endswith('.ndjson'):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    raise ValueError("Unsupported file type. Only Parquet, JSONL and CSV are supported.")
+
+
+def iter_input_chunks(path, columns, chunk_size=4096):
+    """
+    Streams an input file in chunks of at most `chunk_size` rows, so the file is never fully loaded into memory.
+    Parquet files are read batch by batch from their row groups, JSONL and CSV files with chunked pandas readers.
+
+    Args:
+        path (str): The input file, see `input_format`.
+        columns (list of str): The columns to read.
+        chunk_size (int): Maximum number of rows per chunk.
+
+    Yields:
+        pd.DataFrame: The next chunk with the requested columns.
+
+    Raises:
+        ValueError: If the file type is not supported or a column is missing.
+    """
+    import pandas as pd
+
+    file_format = input_format(path)
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        missing = set(columns) - set(parquet_file.schema_arrow.names)
+        if missing:
+            raise ValueError(f"Columns {sorted(missing)} not found in {path}.")
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=list(columns)):
+            yield batch.to_pandas()
+        return
+
+    if file_format == 'jsonl':
+        reader = pd.read_json(path, lines=True, chunksize=chunk_size, dtype=False)
+    else:
+        reader = pd.read_csv(path, chunksize=chunk_size)
+    with reader:
+        for chunk in reader:
+            missing = set(columns) - set(chunk.columns)
+            if missing:
+                raise ValueError(f"Columns {sorted(missing)} not found in {path}.")
+            yield chunk[list(columns)]
+
+
+def _put(target, item, stop):
+    while True:
+        if stop.is_set():
+            raise _Stopped()
+        try:
+            target.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _get(source, stop):
+    while True:
+        if stop.is_set():
+            raise _Stopped()
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+
+def load_checkpoint(output_dir, job):
+    """
+    Loads the checkpoint of a bulk classification job.
+
+    Args:
+        output_dir (str): The output directory of the job.
+        job (dict): The settings that determine the shards, i.e. the input file and its size and modification
+            time, the text column and the chunk size.
+
+    Returns:
+        dict: The checkpoint with 'job', 'next_chunk' (the first chunk without a shard), 'rows' (rows written)
+        and 'finished'. A new checkpoint if there is none.
+
+    Raises:
+        ValueError: If the output directory holds a checkpoint of another job.
+    """
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return {'job': job, 'next_chunk': 0, 'rows': 0, 'finished': False}
+    with open(path, 'r') as file:
+        checkpoint = json.load(file)
+    if checkpoint['job'] != job:
+        raise ValueError(f"{output_dir} holds the output of another job: {checkpoint['job']}. "
+                         f"Use another output directory or delete it.")
+    return checkpoint
+
+
+def save_checkpoint(output_dir, checkpoint):
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(path + '.tmp', path)
+
+
+def write_shard(path, frame, probabilities, first_row):
+    """
+    Writes the predictions of one chunk as a Parquet file, under a temporary name first so that an interrupted
+    write never leaves a partial shard.
+
+    The shard has the columns 'row' (position in the input file), the kept input columns, 'label' (the
+    predicted class id), 'confidence' (its probability) and 'probabilities' (a fixed-size list per row).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    num_labels = probabilities.shape[1]
+    columns = {'row': pa.array(np.arange(first_row, first_row + len(frame), dtype=np.int64))}
+    for name in frame.columns:
+        columns[name] = pa.array(frame[name].to_numpy(), from_pandas=True)
+    columns['label'] = pa.array(probabilities.argmax(axis=1).astype(np.int32))
+    columns['confidence'] = pa.array(probabilities.max(axis=1))
+    columns['probabilities'] = pa.FixedSizeListArray.from_arrays(pa.array(probabilities.ravel()), num_labels)
+    pq.write_table(pa.table(columns), path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def classify_file(predictor, input_path, output_dir, text_column='quote', keep_columns=(), chunk_size=4096,
+                  queue_size=2, verbose=1):
+    """
+    Classifies a large file of quotes into Parquet shards with a three-stage pipeline. A reader thread streams
+    and tokenizes chunks, the calling thread runs the model, and a writer thread writes one shard per chunk and
+    advances the checkpoint. The stages run concurrently, and the bounded queues between them cap the number of
+    chunks in memory.
+
+    An interrupted job resumes from the checkpoint: chunks that already have a shard are read but not tokenized
+    or classified again.
+
+    Args:
+        predictor (BatchPredictor): The predictor, e.g. from `load_predictor`.
+        input_path (str): A Parquet, JSONL or CSV file, see `input_format`.
+        output_dir (str): Directory of the shards 'part-000000.parquet', ... and of the checkpoint.
+        text_column (str): The column holding the quotes. Missing quotes are classified as empty strings.
+        keep_columns (list of str): Input columns copied to the shards, e.g. an id column.
+        chunk_size (int): Rows per chunk and shard.
+        queue_size (int): Maximum number of chunks waiting between two stages.
+        verbose (int): Print the progress if 1.
+
+    Returns:
+        dict: The final checkpoint, with 'rows' the number of rows classified and 'shards' the number of shards.
+
+    Raises:
+        ValueError: If the file type is not supported, a column is missing or the output directory holds another
+            job.
+    """
+    stat = os.stat(input_path)
+    job = {'input': os.path.abspath(input_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+           'text_column': text_column, 'keep_columns': list(keep_columns), 'chunk_size': chunk_size}
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint = load_checkpoint(output_dir, job)
+    if checkpoint['finished']:
+        if verbose:
+            print(f"{input_path} is already classified in {output_dir} ({checkpoint['rows']} rows).")
+        return checkpoint
+
+    columns = list(dict.fromkeys([text_column, *keep_columns]))
+    tokenized = queue.Queue(maxsize=queue_size)
+    predicted = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    start = time.perf_counter()
+    resumed_rows = checkpoint['rows']
+
+    def run_stage(stage):
+        try:
+            stage()
+        except _Stopped:
+            pass
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+
+    def read_and_tokenize():
+        first_row = 0
+        for index, frame in enumerate(iter_input_chunks(input_path, columns, chunk_size)):
+            if stop.is_set():
+                raise _Stopped()
+            if index >= checkpoint['next_chunk']:
+                texts = frame[text_column].fillna('').astype(str).tolist()
+                _put(tokenized, (index, first_row, frame[list(keep_columns)], predictor.encode(texts)), stop)
+            first_row += len(frame)
+        _put(tokenized, None, stop)
+
+    def write():
+        while True:
+            item = _get(predicted, stop)
+            if item is None:
+                break
+            index, first_row, frame, probabilities = item
+            write_shard(os.path.join(output_dir, f"part-{index:06d}.parquet"), frame, probabilities, first_row)
+            checkpoint.update(next_chunk=index + 1, rows=first_row + len(frame))
+            save_checkpoint(output_dir, checkpoint)
+            if verbose:
+                rate = (checkpoint['rows'] - resumed_rows) / (time.perf_counter() - start)
+                print(f"Chunk {index}: {checkpoint['rows']} rows classified ({rate:.0f} rows/s)")
+
+    reader = threading.Thread(target=run_stage, args=(read_and_tokenize,), daemon=True)
+    writer = threading.Thread(target=run_stage, args=(write,), daemon=True)
+    reader.start()
+    writer.start()
+
+    def infer():
+        while True:
+            item = _get(tokenized, stop)
+            if item is None:
+                break
+            index, first_row, frame, input_ids = item
+            _put(predicted, (index, first_row, frame, predictor.predict_proba_encoded(input_ids)), stop)
+        _put(predicted, None, stop)
+
+    # An interruption also stops the other stages. The checkpoint only covers shards that were completely
+    # written, so the job can be resumed.
+    run_stage(infer)
+    reader.join()
+    writer.join()
+    if errors:
+        raise errors[0]
+
+    checkpoint['finished'] = True
+    checkpoint['shards'] = checkpoint['next_chunk']
+    save_checkpoint(output_dir, checkpoint)
+    if verbose:
+        print(f"Classified {checkpoint['rows']} rows into {checkpoint['shards']} shards in {output_dir} "
+              f"({time.perf_counter() - start:.1f} s)")
+    return checkpoint
+
+
+def main():
+    """
+    Command line entry point: `python src/bulk_classify.py quotes.parquet output/predictions --config
+    configs/config.yaml [--backend onnx --onnx-path model.onnx] [--keep-columns id]`. Run the same command again to
+    resume an interrupted job.
+    """
+    from config import load_config
+    from predict import load_predictor
+
+    parser = argparse.ArgumentParser(description="Classify a large Parquet, JSONL or CSV file of quotes.")
+    parser.add_argument('input')
+    parser.add_argument('output_dir')
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch')
+    parser.add_argument('--onnx-path', help="ONNX model for the onnx backend.")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--text-column', default='quote')
+    parser.add_argument('--keep-columns', nargs='*', default=[], help="Input columns copied to the output.")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    session = None
+    if args.backend == 'onnx':
+        from onnx_session import load_session
+        session = load_session(args.onnx_path, config)
+    predictor = load_predictor(config, backend=args.backend, device=args.device, session=session)
+    classify_file(predictor, args.input, args.output_dir, text_column=args.text_column,
+                  keep_columns=args.keep_columns,
+                  chunk_size=config.get('bulk_chunk_size', 4096),
+                  queue_size=config.get('bulk_queue_size', 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from predict import load_predictor
+
+RETWEET_PREFIX = re.compile(r'^rt @\w+:\s*')
+
+
+def normalize_text(text):
+    """
+    Normalizes a quote so that trivially different copies share a cache entry.
+
+    Applies Unicode NFKC normalization, lowercases (the tokenizer is uncased), collapses whitespace and strips
+    a leading retweet marker such as "RT @user:".
+
+    Args:
+        text (str): The raw quote.
+
+    Returns:
+        str: The normalized quote.
+    """
+    text = ' '.join(unicodedata.normalize('NFKC', text).lower().split())
+    return RETWEET_PREFIX.sub('', text)
+
+
+def model_fingerprint(model_path, **settings):
+    """
+    Computes a fingerprint of the model version, so that cached predictions are never served for another model.
+
+    Args:
+        model_path (str): Path to the weights file (state dict or ONNX model). Its content is hashed.
+        **settings: Other settings that change the predictions, e.g. the tokenizer and max_length.
+
+    Returns:
+        str: A 16 character hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    for name in sorted(settings):
+        digest.update(f"{name}={settings[name]}".encode())
+    return digest.hexdigest()[:16]
+
+
+class PredictionCache:
+    """
+    Two-tier cache of class probabilities keyed on a hash of the normalized text and the model fingerprint.
+
+    The first tier is an in-process LRU bounded by `max_size`. The optional second tier is a SQLite file in WAL
+    mode, so several worker processes can share it. Both tiers expire entries after `ttl` seconds.
+
+    Args:
+        fingerprint (str): The model fingerprint, see `model_fingerprint`.
+        max_size (int): Maximum number of entries in the in-process tier.
+        ttl (float, optional): Time to live of an entry in seconds. Entries never expire if None.
+        db_path (str, optional): Path to the SQLite file of the persistent tier. No persistent tier if None.
+
+    Attributes:
+        hits (int): Lookups served from the in-process tier.
+        disk_hits (int): Lookups served from the persistent tier.
+        misses (int): Lookups that were not cached.
+
+    Methods:
+        key(text):
+            Returns the cache key of a text.
+
+        get_many(keys):
+            Returns a dict of the cached probabilities for the keys found.
+
+        put_many(items):
+            Stores a dict of key to probabilities in both tiers.
+
+        stats():
+            Returns the hit/miss counters and the hit rate.
+    """
+    def __init__(self, fingerprint, max_size=100000, ttl=None, db_path=None):
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path is not None:
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions "
+                             "(key TEXT PRIMARY KEY, probabilities BLOB, expires_at REAL)")
+            self._db.commit()
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.fingerprint}\0{normalize_text(text)}".encode()).hexdigest()
+
+    def _expires_at(self):
+        return time.time() + self.ttl if self.ttl is not None else None
+
+    def _remember(self, key, probabilities, expires_at):
+        self._entries[key] = (probabilities, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_many(self, keys):
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] is not None and entry[1] <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[0]
+            self.hits += len(found)
+
+            missing = [key for key in keys if key not in found]
+            if self._db is not None and missing:
+                placeholders = ','.join('?' * len(missing))
+                rows = self._db.execute(f"SELECT key, probabilities, expires_at FROM predictions "
+                                        f"WHERE key IN ({placeholders})", missing).fetchall()
+                for key, blob, expires_at in rows:
+                    if expires_at is not None and expires_at <= now:
+                        continue
+                    probabilities = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = probabilities
+                    self._remember(key, probabilities, expires_at)
+                    self.disk_hits += 1
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        expires_at = self._expires_at()
+        with self._lock:
+            for key, probabilities in items.items():
+                self._remember(key, np.asarray(probabilities, dtype=np.float32), expires_at)
+            if self._db is not None:
+                self._db.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)",
+                                     [(key, np.asarray(probabilities, dtype=np.float32).tobytes(), expires_at)
+                                      for key, probabilities in items.items()])
+                self._db.commit()
+
+    def clear_expired(self):
+        now = time.time()
+        with self._lock:
+            for key in [key for key, (_, expires_at) in self._entries.items()
+                        if expires_at is not None and expires_at <= now]:
+                del self._entries[key]
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions WHERE expires_at <= ?", (now,))
+                self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            'size': len(self._entries)
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class CachedPredictor:
+    """
+    Puts a PredictionCache in front of a predictor. Only texts that are not cached are tokenized and classified,
+    and duplicates within a call are classified once.
+
+    Args:
+        predictor (BatchPredictor): The predictor to cache.
+        cache (PredictionCache): The cache.
+
+    Methods:
+        predict_proba(texts):
+            Returns the class probabilities, a NumPy array of shape (len(texts), num_labels).
+
+        predict(texts):
+            Returns the predicted class ids, a NumPy array of shape (len(texts),).
+    """
+    def __init__(self, predictor, cache):
+        self.predictor = predictor
+        self.cache = cache
+
+    def predict_proba(self, texts):
+        texts = list(texts)
+        if not texts:
+            return self.predictor.predict_proba([])
+        keys = [self.cache.key(text) for text in texts]
+        cached = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            probabilities = self.predictor.predict_proba(list(missing.values()))
+            computed = dict(zip(missing, probabilities))
+            self.cache.put_many(computed)
+            cached.update(computed)
+
+        return np.stack([cached[key] for key in keys]).astype(np.float32, copy=False)
+
+    def predict(self, texts):
+        return np.argmax(self.predict_proba(texts), axis=1)
+
+
+def load_cached_predictor(config, backend='torch', device='cpu', session=None, model_path=None):
+    """
+    Creates a BatchPredictor with `load_predictor` and wraps it in a CachedPredictor.
+
+    Args:
+        config (dict): Configuration dictionary. In addition to the keys used by `load_predictor`:
+            - 'cache_max_size' (int, optional): Entries in the in-process tier, defaults to 100000.
+            - 'cache_ttl_seconds' (float, optional): Time to live of an entry, no expiry if absent.
+            - 'cache_db_path' (str, optional): SQLite file of the persistent tier, none if absent.
+        backend (str): 'torch' or 'onnx'.
+        device (str or torch.device): The device for the PyTorch backend.
+        session (onnxruntime.InferenceSession, optional): The session for the ONNX backend.
+        model_path (str, optional): Weights file used for the model fingerprint. Defaults to
+            the weights of config['model_artifact_path'] if set, else config['trained_model_path']; pass the ONNX
+            file when serving an ONNX session.
+
+    Returns:
+        CachedPredictor: The cached predictor.
+    """
+    predictor = load_predictor(config, backend=backend, device=device, session=session)
+    if model_path is None:
+        from artifact import ARTIFACT_WEIGHTS
+        model_path = os.path.join(config['model_artifact_path'], ARTIFACT_WEIGHTS) \
+            if config.get('model_artifact_path') else config['trained_model_path']
+    fingerprint = model_fingerprint(model_path,
+                                    tokenizer_model=config['tokenizer_model'],
+                                    max_length=config['max_length'],
+                                    quantization=config.get('inference_quantization') if backend == 'torch' else None)
+    cache = PredictionCache(fingerprint,
+                            max_size=config.get('cache_max_size', 100000),
+                            ttl=config.get('cache_ttl_seconds'),
+                            db_path=config.get('cache_db_path'))
+    return CachedPredictor(predictor, cache)
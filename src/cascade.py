@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+DEFAULT_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 0.99)
+
+
+def train_fast_model(texts, labels, n_features=2 ** 20, ngram_range=(1, 2), C=0.5, calibration_folds=3):
+    """
+    Trains the cheap first stage of the cascade: TF-IDF weighted word n-grams hashed into a fixed number of
+    features, so there is no vocabulary to store, and a linear SVM whose scores are calibrated into probabilities
+    with Platt scaling on held-out folds. The calibration is what makes the confidence comparable to a threshold.
+
+    Args:
+        texts (list of str): The training quotes.
+        labels (array-like): The class ids.
+        n_features (int): Number of hashed features.
+        ngram_range (tuple of int): Smallest and largest n-gram length.
+        C (float): Inverse regularization strength of the SVM.
+        calibration_folds (int): Folds of the calibration.
+
+    Returns:
+        sklearn.pipeline.Pipeline: The fitted model, with `predict_proba` and `classes_`.
+    """
+    from sklearn.calibration import CalibratedClassifierCV
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+    from sklearn.pipeline import make_pipeline
+    from sklearn.svm import LinearSVC
+
+    model = make_pipeline(HashingVectorizer(n_features=n_features, ngram_range=ngram_range, alternate_sign=False,
+                                            norm=None),
+                          TfidfTransformer(sublinear_tf=True),
+                          CalibratedClassifierCV(LinearSVC(C=C), method='sigmoid', cv=calibration_folds))
+    return model.fit(list(texts), np.asarray(labels))
+
+
+def save_fast_model(model, path):
+    import joblib
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    joblib.dump(model, path)
+
+
+def load_fast_model(path):
+    import joblib
+
+    return joblib.load(path)
+
+
+def fast_proba(fast_model, texts, num_labels):
+    """
+    Returns the probabilities of the fast model with one column per class id, so that they line up with the
+    DistilBERT probabilities even if a class was missing from its training data.
+    """
+    probabilities = np.zeros((len(texts), num_labels), dtype=np.float32)
+    if len(texts):
+        probabilities[:, fast_model.classes_] = fast_model.predict_proba(list(texts))
+    return probabilities
+
+
+class CascadePredictor:
+    """
+    Classifies quotes with a cheap model first and only escalates the uncertain ones to DistilBERT.
+
+    Every text of a call is scored by the fast model in one vectorized pass. Texts whose highest calibrated
+    probability is below the threshold are sent to the model predictor together, as one call, so it still sees
+    large batches. Their probabilities replace those of the fast model.
+
+    Args:
+        fast_model (sklearn.pipeline.Pipeline): The fast model, see `train_fast_model`.
+        predictor (BatchPredictor, InferencePool or CachedPredictor): The DistilBERT predictor.
+        threshold (float): Confidence needed to answer with the fast model. 0 never escalates, values above 1
+            always escalate.
+        num_labels (int, optional): Number of classes, defaults to the number of labels of the predictor's model.
+
+    Attributes:
+        texts (int): Texts classified so far.
+        escalated (int): Texts escalated to the model so far.
+
+    Methods:
+        route(texts):
+            Returns the probabilities and a boolean mask of the escalated texts.
+
+        predict_proba(texts):
+            Returns the class probabilities, a NumPy array of shape (len(texts), num_labels).
+
+        predict(texts):
+            Returns the predicted class ids, a NumPy array of shape (len(texts),).
+
+        escalation_rate():
+            Returns the fraction of texts escalated so far.
+    """
+    def __init__(self, fast_model, predictor, threshold=0.9, num_labels=None):
+        self.fast_model = fast_model
+        self.predictor = predictor
+        self.threshold = threshold
+        if num_labels is None:
+            backend = getattr(predictor, 'backend', None)
+            num_labels = getattr(backend, 'num_labels', None) or int(np.max(fast_model.classes_)) + 1
+        self.num_labels = num_labels
+        self.texts = 0
+        self.escalated = 0
+
+    def route(self, texts):
+        texts = list(texts)
+        probabilities = fast_proba(self.fast_model, texts, self.num_labels)
+        escalate = probabilities.max(axis=1) < self.threshold
+        if escalate.any():
+            indices = np.flatnonzero(escalate)
+            probabilities[indices] = self.predictor.predict_proba([texts[i] for i in indices])
+        self.texts += len(texts)
+        self.escalated += int(escalate.sum())
+        return probabilities, escalate
+
+    def predict_proba(self, texts):
+        return self.route(texts)[0]
+
+    def predict(self, texts):
+        return np.argmax(self.predict_proba(texts), axis=1)
+
+    def escalation_rate(self):
+        return self.escalated / self.texts if self.texts else 0.0
+
+    def close(self):
+        if hasattr(self.predictor, 'close'):
+            self.predictor.close()
+
+
+def load_cascade_predictor(config, predictor):
+    """
+    Puts the fast model of config['cascade_model_path'] in front of a predictor, with the confidence threshold
+    config['cascade_threshold'] (defaults to 0.9) and config['num_labels'] classes.
+    """
+    return CascadePredictor(load_fast_model(config['cascade_model_path']), predictor,
+                            threshold=config.get('cascade_threshold', 0.9), num_labels=config.get('num_labels'))
+
+
+def _timed_proba(predict_proba, texts):
+    start = time.perf_counter()
+    probabilities = predict_proba(texts)
+    return probabilities, time.perf_counter() - start
+
+
+def evaluate_cascade(fast_model, predictor, texts, labels, thresholds=DEFAULT_THRESHOLDS, num_labels=None):
+    """
+    Evaluates the cascade at several thresholds on labeled data. Both models score every text once. Each
+    threshold then combines their predictions and estimates the end-to-end throughput from the measured cost per
+    text: every text pays for the fast model, and escalated texts also pay for DistilBERT.
+
+    Args:
+        fast_model (sklearn.pipeline.Pipeline): The fast model.
+        predictor (BatchPredictor): The DistilBERT predictor.
+        texts (list of str): The validation quotes.
+        labels (array-like): Their class ids.
+        thresholds (list of float): The thresholds to evaluate.
+        num_labels (int, optional): Number of classes, see `CascadePredictor`.
+
+    Returns:
+        list of dict: 'name', 'threshold', 'escalation_rate', 'f1', 'accuracy' and 'texts_per_second', for the
+        fast model alone ('fast'), DistilBERT alone ('model') and each threshold ('cascade@<threshold>').
+    """
+    from sklearn.metrics import accuracy_score, f1_score
+
+    texts, labels = list(texts), np.asarray(labels)
+    num_labels = CascadePredictor(fast_model, predictor, num_labels=num_labels).num_labels
+    fast_probabilities, fast_seconds = _timed_proba(lambda t: fast_proba(fast_model, t, num_labels), texts)
+    model_probabilities, model_seconds = _timed_proba(predictor.predict_proba, texts)
+    fast_cost, model_cost = fast_seconds / len(texts), model_seconds / len(texts)
+    confidence = fast_probabilities.max(axis=1)
+
+    def result(name, threshold, escalate, cost):
+        predictions = np.where(escalate, model_probabilities.argmax(axis=1), fast_probabilities.argmax(axis=1))
+        return {'name': name, 'threshold': threshold, 'escalation_rate': float(escalate.mean()),
+                'f1': float(f1_score(labels, predictions, average='weighted')),
+                'accuracy': float(accuracy_score(labels, predictions)), 'texts_per_second': 1.0 / cost}
+
+    results = [result('fast', 0.0, np.zeros(len(texts), dtype=bool), fast_cost),
+               result('model', None, np.ones(len(texts), dtype=bool), model_cost)]
+    for threshold in thresholds:
+        escalate = confidence < threshold
+        results.append(result(f"cascade@{threshold:g}", threshold, escalate,
+                              fast_cost + escalate.mean() * model_cost))
+    return results
+
+
+def choose_threshold(results, max_f1_drop=0.01):
+    """
+    Chooses the cascade threshold with the lowest escalation rate, i.e. the highest throughput, whose F1 is at
+    most `max_f1_drop` below DistilBERT alone.
+
+    Args:
+        results (list of dict): The results of `evaluate_cascade`.
+        max_f1_drop (float): Allowed absolute drop of the weighted F1.
+
+    Returns:
+        dict: The chosen result, or None if no threshold is within the allowed drop.
+    """
+    model_f1 = next(result['f1'] for result in results if result['name'] == 'model')
+    candidates = [result for result in results
+                  if result['name'].startswith('cascade') and result['f1'] >= model_f1 - max_f1_drop]
+    return min(candidates, key=lambda r: (r['escalation_rate'], -r['f1'])) if candidates else None
+
+
+def write_report(results, output_dir, chosen=None):
+    """
+    Writes the cascade evaluation as JSON and as a Markdown table of escalation rate, throughput and F1, the
+    chosen threshold marked with '*'.
+
+    Args:
+        results (list of dict): The results of `evaluate_cascade`.
+        output_dir (str): Directory where 'cascade_report.json' and 'cascade_report.md' are written.
+        chosen (dict, optional): The result chosen by `choose_threshold`.
+
+    Returns:
+        str: The Markdown report.
+    """
+    header = ['', 'predictor', 'escalated', 'texts/s', 'F1', 'accuracy']
+    lines = ['| ' + ' | '.join(header) + ' |', '|' + '---|' * len(header)]
+    for result in results:
+        row = ['*' if chosen is not None and result['name'] == chosen['name'] else '', result['name'],
+               f"{result['escalation_rate']:.1%}", f"{result['texts_per_second']:.1f}", f"{result['f1']:.4f}",
+               f"{result['accuracy']:.4f}"]
+        lines.append('| ' + ' | '.join(row) + ' |')
+    report = '\n'.join(lines) + '\n'
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'cascade_report.json'), 'w') as file:
+        json.dump({'results': results, 'chosen': chosen}, file, indent=2)
+    with open(os.path.join(output_dir, 'cascade_report.md'), 'w') as file:
+        file.write(report)
+    return report
+
+
+def main():
+    """
+    Command line entry point: `python src/cascade.py --config configs/config.yaml [--backend onnx --onnx-path
+    model.onnx]`. Trains the fast model on config['trainpath'], saves it at config['cascade_model_path'], evaluates
+    the cascade on config['valpath'] and writes the report to config['output_dir'].
+    """
+    from config import load_config
+    from data_prep import read_data
+    from predict import load_predictor
+
+    parser = argparse.ArgumentParser(description="Train the fast model of the cascade and choose its threshold.")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch')
+    parser.add_argument('--onnx-path', help="ONNX model for the onnx backend.")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--max-f1-drop', type=float, default=0.01, help="Allowed F1 drop versus DistilBERT alone.")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    train_data = read_data(config['trainpath'], config['train_label_col'])
+    val_data = read_data(config['valpath'], config['val_label_col'])
+    fast_model = train_fast_model(train_data['quote'].tolist(), train_data['numeric_label'])
+    save_fast_model(fast_model, config['cascade_model_path'])
+    print(f"Fast model saved at {config['cascade_model_path']}")
+
+    session = None
+    if args.backend == 'onnx':
+        from onnx_session import load_session
+        session = load_session(args.onnx_path, config)
+    predictor = load_predictor(config, backend=args.backend, device=args.device, session=session)
+    results = evaluate_cascade(fast_model, predictor, val_data['quote'].tolist(), val_data['numeric_label'],
+                               num_labels=config.get('num_labels'))
+    chosen = choose_threshold(results, args.max_f1_drop)
+    print(write_report(results, config.get('output_dir', 'output'), chosen))
+    if chosen is None:
+        print(f"No threshold keeps the F1 within {args.max_f1_drop} of DistilBERT alone.")
+    else:
+        print(f"Set cascade_threshold : {chosen['threshold']:g} ({chosen['escalation_rate']:.1%} escalated)")
+
+
+if __name__ == '__main__':
+    main()
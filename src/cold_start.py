@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+PHASES = ('import_s', 'load_s', 'first_prediction_s', 'total_s')
+
+
+def _measure_in_process(config_path, backend, device, onnx_path, text):
+    start = time.perf_counter()
+    import inference
+    from config import load_config
+    imported = time.perf_counter()
+    modules_after_import = inference.loaded_heavy_modules()
+
+    predictor = inference.load_inference_predictor(load_config(config_path), backend=backend, device=device,
+                                                   onnx_path=onnx_path)
+    loaded = time.perf_counter()
+    predictor.predict([text])
+    predicted = time.perf_counter()
+    if hasattr(predictor, 'close'):
+        predictor.close()
+    return {
+        'import_s': imported - start,
+        'load_s': loaded - imported,
+        'first_prediction_s': predicted - loaded,
+        'modules_after_import': modules_after_import,
+        'modules_after_load': inference.loaded_heavy_modules()
+    }
+
+
+def measure_cold_start(config_path, backend='torch', device='cpu', onnx_path=None, runs=3,
+                       text="The climate has always changed."):
+    """
+    Measures the cold start of the inference path in fresh Python processes: the time to import the inference
+    entry module, to load the model and tokenizer, and to return the first prediction. The first run also pays
+    for reading the files from disk if they are not in the page cache.
+
+    Args:
+        config_path (str): Path to the YAML configuration.
+        backend (str): 'torch' or 'onnx'.
+        device (str): The device for the PyTorch backend.
+        onnx_path (str, optional): The ONNX model for the ONNX backend.
+        runs (int): Number of fresh processes.
+        text (str): The quote of the first prediction.
+
+    Returns:
+        dict: 'runs', one dict per process with the phases in seconds, 'total_s' (process start to exit, including
+        interpreter startup) and the heavy modules loaded after import and after load, and 'median', the median of
+        each phase.
+
+    Raises:
+        RuntimeError: If a measurement process fails.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--config', config_path, '--backend', backend,
+               '--device', device, '--text', text]
+    if onnx_path is not None:
+        command += ['--onnx-path', onnx_path]
+
+    results = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        completed = subprocess.run(command, capture_output=True, text=True)
+        total = time.perf_counter() - start
+        if completed.returncode != 0:
+            raise RuntimeError(f"Cold start measurement failed:\n{completed.stderr}")
+        # The last line holds the measurement, anything before it was printed while loading
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result['total_s'] = total
+        results.append(result)
+    return {'runs': results, 'median': {phase: statistics.median(r[phase] for r in results) for phase in PHASES}}
+
+
+def main():
+    """
+    Command line entry point: `python src/cold_start.py --config configs/config.yaml [--backend onnx --onnx-path
+    model.onnx] [--runs 5]`.
+    """
+    parser = argparse.ArgumentParser(description="Measure import, model load and first prediction times.")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch')
+    parser.add_argument('--onnx-path', help="ONNX model for the onnx backend.")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--text', default="The climate has always changed.")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_measure_in_process(args.config, args.backend, args.device, args.onnx_path, args.text)))
+        return
+
+    report = measure_cold_start(args.config, backend=args.backend, device=args.device, onnx_path=args.onnx_path,
+                                runs=args.runs, text=args.text)
+    for run, result in enumerate(report['runs'], 1):
+        print(f"run {run}: " + ', '.join(f"{phase} {result[phase]:.3f}" for phase in PHASES) +
+              f" (loaded: {', '.join(result['modules_after_load']) or 'none'})")
+    print("median: " + ', '.join(f"{phase} {value:.3f}" for phase, value in report['median'].items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import torch
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, Subset
 import pandas as pd
 from transformers import DistilBertTokenizer
 
@@ -118,8 +118,74 @@ def encode_data(tokenizer, texts, labels, max_length):
         print(f"Error during tokenization: {e}")
         return None
 
-def create_data_loader(filepath, label_column, tokenizer_model, max_length, batch_size, shuffle : bool):
-    def create_data_loader(filepath, label_column, tokenizer_model, max_length, batch_size, shuffle: bool):
+def truncate_dataset(dataset, max_length, sep_token_id):
+    """
+    Truncates the sequences of a QuotesDataset to a shorter maximum length.
+
+    Args:
+        dataset (QuotesDataset): The tokenized dataset.
+        max_length (int): The new maximum length.
+        sep_token_id (int): Id of the separator token, written at the end of every sequence that was cut.
+
+    Returns:
+        QuotesDataset: A dataset with the truncated encodings and the same labels.
+    """
+    encodings = {key: val[:, :max_length].clone() for key, val in dataset.encodings.items()}
+    original_mask = dataset.encodings['attention_mask']
+    if original_mask.size(1) > max_length:
+        was_cut = original_mask[:, max_length] == 1
+        encodings['input_ids'][was_cut, max_length - 1] = sep_token_id
+    return QuotesDataset(encodings, dataset.labels)
+
+def stratified_subset(dataset, fraction, seed=42):
+    """
+    Samples a stratified fraction of a QuotesDataset, keeping the class proportions.
+
+    Args:
+        dataset (QuotesDataset): The tokenized dataset.
+        fraction (float): Fraction of the samples of every class to keep.
+        seed (int): Random seed, so that every caller gets the same subset.
+
+    Returns:
+        torch.utils.data.Subset: The sampled subset.
+    """
+    labels = pd.Series(list(dataset.labels))
+    indices = labels.groupby(labels).sample(frac=fraction, random_state=seed).index
+    return Subset(dataset, sorted(indices))
+
+def create_dataset(filepath, label_column, tokenizer_model, max_length, tokenizer=None):
+    """
+    Reads and tokenizes a data file into a QuotesDataset.
+
+    Args:
+        filepath (str): Path to the data file.
+        label_column (str): Name of the column containing the labels.
+        tokenizer_model (str): Name or path of the tokenizer model to use.
+        max_length (int): Maximum length of the tokenized sequences.
+        tokenizer (callable, optional): Tokenizer to use instead of loading `tokenizer_model`,
+            e.g. a `PrunedTokenizer`.
+
+    Returns:
+        QuotesDataset: The tokenized dataset.
+
+    Raises:
+        ValueError: If the data is empty or not loaded correctly.
+        ValueError: If the dataset is empty or not created correctly.
+    """
+    data = read_data(filepath, label_column)
+    if data is None or data.empty:
+        raise ValueError(f"Data is empty or not loaded correctly from {filepath}")
+    print(f"Data loaded successfully from {filepath}")
+    if tokenizer is None:
+        tokenizer = DistilBertTokenizer.from_pretrained(tokenizer_model, do_lower_case=True)
+    dataset = encode_data(tokenizer, data['quote'], data['numeric_label'], max_length)
+    if dataset is None or len(dataset) == 0:
+        raise ValueError("Dataset is empty or not created correctly.")
+    print(f"Dataset created successfully with {len(dataset)} samples")
+    return dataset
+
+def create_data_loader(filepath, label_column, tokenizer_model, max_length, batch_size, shuffle : bool, tokenizer=None):
+    def create_data_loader(filepath, label_column, tokenizer_model, max_length, batch_size, shuffle: bool, tokenizer=None):
         """
         Creates a DataLoader for the given dataset.
         Args:
@@ -129,21 +195,15 @@ def create_data_loader(filepath, label_column, tokenizer_model, max_length, batc
             max_length (int): Maximum length of the tokenized sequences.
             batch_size (int): Number of samples per batch.
             shuffle (bool): Whether to shuffle the data.
+            tokenizer (callable, optional): Tokenizer to use instead of loading `tokenizer_model`,
+                e.g. a `PrunedTokenizer`.
         Returns:
             DataLoader: A DataLoader object for the dataset.
         Raises:
             ValueError: If the data is empty or not loaded correctly.
             ValueError: If the dataset is empty or not created correctly.
         """
-    data = read_data(filepath, label_column)
-    if data is None or data.empty:
-        raise ValueError(f"Data is empty or not loaded correctly from {filepath}")
-    print(f"Data loaded successfully from {filepath}")
-    tokenizer = DistilBertTokenizer.from_pretrained(tokenizer_model, do_lower_case=True)
-    dataset = encode_data(tokenizer, data['quote'], data['numeric_label'], max_length)
-    if dataset is None or len(dataset) == 0:
-        raise ValueError("Dataset is empty or not created correctly.")
-    print(f"Dataset created successfully with {len(dataset)} samples")
+    dataset = create_dataset(filepath, label_column, tokenizer_model, max_length, tokenizer=tokenizer)
     
     dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=shuffle)
     return dataloader
@@ -0,0 +1,299 @@
+import os
+import time
+import argparse
+import warnings
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from sklearn.metrics import accuracy_score
+from data_prep import create_data_loader
+from model import load_model_for_inference
+from utils import calculate_f1_score
+
+
+def transformer_block_forward(layer, hidden_states, attention_mask):
+    """
+    Runs a single DistilBERT transformer block using scaled dot product attention.
+
+    The block is driven through its sub-modules (q/k/v/out projections, layer norms and FFN) so that the
+    behaviour does not depend on the attention-mask format expected by the installed transformers version.
+
+    Args:
+        layer (TransformerBlock): A layer from `model.distilbert.transformer.layer`.
+        hidden_states (torch.Tensor): Hidden states of shape (batch_size, seq_len, dim).
+        attention_mask (torch.Tensor): Boolean mask of shape (batch_size, seq_len), True for real tokens.
+
+    Returns:
+        torch.Tensor: The block output of shape (batch_size, seq_len, dim).
+    """
+    attention = layer.attention
+    batch_size, seq_len, dim = hidden_states.shape
+    head_dim = dim // attention.n_heads
+
+    def split_heads(x):
+        return x.view(batch_size, seq_len, attention.n_heads, head_dim).transpose(1, 2)
+
+    query = split_heads(attention.q_lin(hidden_states))
+    key = split_heads(attention.k_lin(hidden_states))
+    value = split_heads(attention.v_lin(hidden_states))
+
+    context = F.scaled_dot_product_attention(
+        query, key, value,
+        attn_mask=attention_mask[:, None, None, :],
+        dropout_p=attention.dropout.p if layer.training else 0.0
+    )
+    context = context.transpose(1, 2).reshape(batch_size, seq_len, dim)
+    attention_output = layer.sa_layer_norm(attention.out_lin(context) + hidden_states)
+
+    ffn = layer.ffn
+    ffn_output = ffn.dropout(ffn.lin2(ffn.activation(ffn.lin1(attention_output))))
+    return layer.output_layer_norm(ffn_output + attention_output)
+
+
+class EarlyExitDistilBert(nn.Module):
+    """
+    Wraps a DistilBertForSequenceClassification model with lightweight classifier heads on intermediate
+    transformer layers. At inference time each sample stops at the first exit whose softmax confidence
+    reaches the threshold; exited samples are removed from the batch before the next layer runs.
+
+    Args:
+        model (DistilBertForSequenceClassification): The trained base model.
+        exit_layers (list of int, optional): Layers (1-based, counted from the embeddings) after which an exit
+            head is attached. Defaults to every layer except the last one, which uses the model's own classifier.
+        threshold (float): Default confidence threshold used by `forward`.
+
+    Methods:
+        forward(input_ids, attention_mask, threshold=None):
+            Runs early-exit inference.
+            Returns:
+                tuple: logits (torch.Tensor) of shape (batch_size, num_labels) and the number of layers
+                executed for each sample (torch.Tensor of shape (batch_size,)).
+
+        forward_all_exits(input_ids, attention_mask):
+            Runs every layer and returns the logits of every exit, the final classifier last. Used for training.
+    """
+    def __init__(self, model, exit_layers=None, threshold=0.9):
+        super().__init__()
+        self.model = model
+        self.num_layers = len(model.distilbert.transformer.layer)
+        if exit_layers is None:
+            exit_layers = range(1, self.num_layers)
+        self.exit_layers = sorted(layer for layer in exit_layers if 0 < layer < self.num_layers)
+        self.threshold = threshold
+
+        dim = model.config.dim
+        self.exit_heads = nn.ModuleDict({
+            str(layer): nn.Linear(dim, model.config.num_labels) for layer in self.exit_layers
+        })
+        self.exit_heads.to(model.classifier.weight.device)
+
+    def final_head(self, hidden_states):
+        pooled_output = F.relu(self.model.pre_classifier(hidden_states[:, 0]))
+        pooled_output = self.model.dropout(pooled_output)
+        return self.model.classifier(pooled_output)
+
+    def forward_all_exits(self, input_ids, attention_mask):
+        hidden_states = self.model.distilbert.embeddings(input_ids)
+        mask = attention_mask.bool()
+        all_logits = []
+        for layer_idx, layer in enumerate(self.model.distilbert.transformer.layer, start=1):
+            hidden_states = transformer_block_forward(layer, hidden_states, mask)
+            if str(layer_idx) in self.exit_heads:
+                all_logits.append(self.exit_heads[str(layer_idx)](hidden_states[:, 0]))
+        all_logits.append(self.final_head(hidden_states))
+        return all_logits
+
+    def forward(self, input_ids, attention_mask, threshold=None):
+        threshold = self.threshold if threshold is None else threshold
+        batch_size = input_ids.size(0)
+        device = input_ids.device
+
+        hidden_states = self.model.distilbert.embeddings(input_ids)
+        mask = attention_mask.bool()
+        active = torch.arange(batch_size, device=device)
+        logits = torch.empty(batch_size, self.model.config.num_labels, device=device)
+        layers_executed = torch.full((batch_size,), self.num_layers, dtype=torch.long, device=device)
+
+        for layer_idx, layer in enumerate(self.model.distilbert.transformer.layer, start=1):
+            hidden_states = transformer_block_forward(layer, hidden_states, mask)
+            if layer_idx == self.num_layers:
+                logits[active] = self.final_head(hidden_states)
+                break
+            if str(layer_idx) not in self.exit_heads:
+                continue
+
+            exit_logits = self.exit_heads[str(layer_idx)](hidden_states[:, 0])
+            confidence = torch.softmax(exit_logits, dim=-1).max(dim=-1).values
+            done = confidence >= threshold
+            if done.any():
+                logits[active[done]] = exit_logits[done]
+                layers_executed[active[done]] = layer_idx
+                # Drop exited samples so the remaining layers only run on the hard ones
+                keep = ~done
+                hidden_states, mask, active = hidden_states[keep], mask[keep], active[keep]
+            if active.numel() == 0:
+                break
+
+        return logits, layers_executed
+
+
+def load_early_exit_model(config, device):
+    """
+    Loads the trained model with `load_model_for_inference` and wraps it with early-exit heads.
+
+    Args:
+        config (dict): Model configuration. In addition to the keys required by `load_model_for_inference`:
+            - 'exit_layers' (list of int, optional): Layers after which exit heads are attached.
+            - 'exit_threshold' (float, optional): Confidence threshold, defaults to 0.9.
+            - 'exit_heads_path' (str, optional): Path to trained exit head weights, see `save_exit_heads`. If the
+              file does not exist, the heads are untrained: a warning is issued and the default threshold is set
+              to infinity, so `forward` only exits early with an explicit threshold, e.g. while training.
+        device (str or torch.device): The device to load the model onto.
+
+    Returns:
+        EarlyExitDistilBert: The early-exit model in evaluation mode.
+    """
+    model = load_model_for_inference(config, device)
+    early_exit_model = EarlyExitDistilBert(model,
+                                           exit_layers=config.get('exit_layers'),
+                                           threshold=config.get('exit_threshold', 0.9))
+    heads_path = config.get('exit_heads_path')
+    if heads_path and os.path.exists(heads_path):
+        early_exit_model.exit_heads.load_state_dict(torch.load(heads_path, map_location=torch.device(device)))
+    elif heads_path:
+        warnings.warn(f"Exit heads not found at {heads_path}. Early exits are disabled until the heads are trained "
+                      f"and saved with save_exit_heads.")
+        early_exit_model.threshold = float('inf')
+    early_exit_model.to(device)
+    early_exit_model.eval()
+    return early_exit_model
+
+
+def save_exit_heads(early_exit_model, path):
+    """
+    Saves the weights of the exit heads, to be loaded by `load_early_exit_model` from config['exit_heads_path'].
+    After joint training the backbone changed as well and must be saved separately.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    torch.save(early_exit_model.exit_heads.state_dict(), path)
+
+
+def train_exit_heads(early_exit_model, train_loader, optimizer, device, joint=False):
+    """
+    Trains the exit heads for one epoch.
+
+    With `joint=False` (post hoc) the backbone stays frozen in evaluation mode and only the exit heads learn
+    from the existing checkpoint's hidden states. With `joint=True` the backbone is unfrozen, the loss of every
+    exit, including the final classifier, is summed and the backbone learns together with the heads; the
+    optimizer must then hold all parameters of `early_exit_model`.
+
+    Args:
+        early_exit_model (EarlyExitDistilBert): The early-exit model.
+        train_loader (torch.utils.data.DataLoader): The data loader providing training batches.
+        optimizer (torch.optim.Optimizer): Optimizer over the parameters to train.
+        device (torch.device or str): The device to use for training.
+        joint (bool): Train the backbone together with the exit heads.
+
+    Returns:
+        float: The average training loss for the epoch.
+    """
+    # load_model_for_inference freezes the backbone
+    early_exit_model.model.requires_grad_(joint)
+    if joint:
+        early_exit_model.train()
+    else:
+        early_exit_model.eval()
+        early_exit_model.exit_heads.train()
+
+    train_loss = 0
+    for batch in train_loader:
+        optimizer.zero_grad()
+        batch = {k: v.to(device) for k, v in batch.items()}
+        all_logits = early_exit_model.forward_all_exits(batch['input_ids'], batch['attention_mask'])
+        if not joint:
+            all_logits = all_logits[:-1]
+        loss = sum(F.cross_entropy(logits, batch['labels']) for logits in all_logits)
+        loss.backward()
+        optimizer.step()
+        train_loss += loss.item()
+
+    early_exit_model.eval()
+    return train_loss / len(train_loader)
+
+
+def evaluate_early_exit(early_exit_model, data_loader, device, thresholds):
+    """
+    Evaluates the early-exit model at several confidence thresholds.
+
+    Args:
+        early_exit_model (EarlyExitDistilBert): The early-exit model.
+        data_loader (torch.utils.data.DataLoader): The data loader providing labeled batches.
+        device (torch.device or str): The device to use for evaluation.
+        thresholds (list of float): Confidence thresholds to evaluate.
+
+    Returns:
+        list of dict: One entry per threshold with 'threshold', 'accuracy', 'f1', 'avg_layers' and
+        'latency_ms' (average latency per sample in milliseconds).
+    """
+    early_exit_model.eval()
+    early_exit_model.to(device)
+    results = []
+    with torch.no_grad():
+        for threshold in thresholds:
+            y_true, y_pred, layers = [], [], []
+            elapsed = 0.0
+            for batch in data_loader:
+                input_ids = batch['input_ids'].to(device)
+                attention_mask = batch['attention_mask'].to(device)
+                start = time.perf_counter()
+                logits, layers_executed = early_exit_model(input_ids, attention_mask, threshold=threshold)
+                elapsed += time.perf_counter() - start
+                y_true.extend(batch['labels'].numpy())
+                y_pred.extend(torch.argmax(logits, dim=-1).cpu().numpy())
+                layers.extend(layers_executed.cpu().numpy())
+
+            result = {
+                'threshold': threshold,
+                'accuracy': accuracy_score(y_true, y_pred),
+                'f1': calculate_f1_score(y_true, y_pred),
+                'avg_layers': sum(layers) / len(layers),
+                'latency_ms': 1000 * elapsed / len(y_true)
+            }
+            print(f"Threshold {threshold:.2f}: accuracy {result['accuracy']:.4f}, F1 {result['f1']:.4f}, "
+                  f"avg layers {result['avg_layers']:.2f}, latency {result['latency_ms']:.2f} ms/sample")
+            results.append(result)
+    return results
+
+
+def main():
+    """
+    Command line entry point: `python src/early_exit.py --config configs/config.yaml`. Trains the exit heads post
+    hoc on config['trainpath'], saves them at config['exit_heads_path'] and reports accuracy, F1, average depth
+    and latency on config['valpath'] for several thresholds.
+    """
+    from config import load_config
+
+    parser = argparse.ArgumentParser(description="Train the early-exit heads on top of the trained model.")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.7, 0.8, 0.9, 0.95, 0.99])
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    early_exit_model = load_early_exit_model(config, args.device)
+    train_loader = create_data_loader(config['trainpath'], config['train_label_col'], config['tokenizer_model'],
+                                      config['max_length'], config['batch_size'], shuffle=True)
+    val_loader = create_data_loader(config['valpath'], config['val_label_col'], config['tokenizer_model'],
+                                    config['max_length'], config['batch_size'], shuffle=False)
+    optimizer = torch.optim.AdamW(early_exit_model.exit_heads.parameters(), lr=config['learning_rate'])
+    for epoch in range(args.epochs):
+        loss = train_exit_heads(early_exit_model, train_loader, optimizer, args.device)
+        print(f"Epoch {epoch + 1}/{args.epochs}: exit head loss {loss:.4f}")
+    save_exit_heads(early_exit_model, config['exit_heads_path'])
+    print(f"Exit heads saved at {config['exit_heads_path']}")
+    evaluate_early_exit(early_exit_model, val_loader, args.device, args.thresholds)
+
+
+if __name__ == '__main__':
+    main()
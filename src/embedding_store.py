@@ -0,0 +1,504 @@
+import os
+import json
+import hashlib
+import sqlite3
+import argparse
+import numpy as np
+
+VECTORS_FILE = 'embeddings.f16'
+INDEX_FILE = 'index.db'
+META_FILE = 'meta.json'
+IVF_FILE = 'ivf.npz'
+POOLINGS = ('cls', 'mean')
+
+
+class Embedder:
+    """
+    Extracts pooled, L2-normalized sentence embeddings from the DistilBERT encoder of a sequence classification
+    model, batched like `BatchPredictor`: texts are sorted by token length and grouped by a token budget.
+
+    Args:
+        model (DistilBertForSequenceClassification): The model, e.g. from `load_model_for_inference`.
+        tokenizer (callable): The tokenizer, e.g. from `load_tokenizer`.
+        device (str or torch.device): The device the model is on.
+        max_length (int): Maximum length of the tokenized sequences.
+        token_budget (int): Maximum number of tokens per batch.
+        max_batch_size (int): Maximum number of texts per batch.
+        pooling (str): 'cls', the final hidden state of [CLS] that the classifier reads, or 'mean', the average
+            of the final hidden states of the real tokens.
+
+    Methods:
+        embed(texts):
+            Returns the embeddings, a float32 NumPy array of shape (len(texts), dim) with unit-norm rows.
+    """
+    def __init__(self, model, tokenizer, device='cpu', max_length=365, token_budget=8192, max_batch_size=64,
+                 pooling='cls'):
+        import torch
+
+        if pooling not in POOLINGS:
+            raise ValueError(f"Unsupported pooling {pooling}. Choose one of {', '.join(POOLINGS)}.")
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = torch.device(device)
+        self.max_length = max_length
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+        self.pooling = pooling
+        self.dim = model.config.dim
+
+    def embed(self, texts):
+        import torch
+        from predict import make_batches
+
+        texts = list(texts)
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return embeddings
+        input_ids = self.tokenizer(texts, truncation=True, max_length=self.max_length)['input_ids']
+        lengths = np.array([len(ids) for ids in input_ids])
+        order = np.argsort(lengths, kind='stable')
+        sorted_lengths = lengths[order]
+
+        for start, end in make_batches(sorted_lengths, self.token_budget, self.max_batch_size):
+            batch_indices = order[start:end]
+            batch_input_ids = np.full((end - start, sorted_lengths[end - 1]), self.tokenizer.pad_token_id,
+                                      dtype=np.int64)
+            batch_attention_mask = np.zeros_like(batch_input_ids)
+            for row, idx in enumerate(batch_indices):
+                batch_input_ids[row, :lengths[idx]] = input_ids[idx]
+                batch_attention_mask[row, :lengths[idx]] = 1
+
+            attention_mask = torch.from_numpy(batch_attention_mask).to(self.device)
+            with torch.inference_mode():
+                hidden_states = self.model.distilbert(torch.from_numpy(batch_input_ids).to(self.device),
+                                                      attention_mask=attention_mask).last_hidden_state.float()
+                if self.pooling == 'cls':
+                    pooled = hidden_states[:, 0]
+                else:
+                    mask = attention_mask[:, :, None].float()
+                    pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1)
+                pooled = torch.nn.functional.normalize(pooled, dim=-1)
+            embeddings[batch_indices] = pooled.cpu().numpy()
+        return embeddings
+
+
+def text_key(text):
+    """
+    Returns the key under which a quote is indexed, the hash of its normalized text (see `cache.normalize_text`),
+    so that known quotes are found again even with trivial differences.
+    """
+    from cache import normalize_text
+
+    return hashlib.sha256(normalize_text(text).encode()).hexdigest()
+
+
+def _top_k(scores, rows, k):
+    # Keeps the k best scores of each query row, unsorted
+    if scores.shape[1] <= k:
+        return scores, rows
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, best, axis=1), np.take_along_axis(rows, best, axis=1)
+
+
+class EmbeddingStore:
+    """
+    A store of unit-norm embeddings on disk with exact and approximate top-k cosine similarity search.
+
+    The embeddings are appended to a float16 matrix that is read through a memory map, so searches and lookups
+    never load the store into RAM. Each row has an id, the key of its text (see `text_key`) and optionally a class
+    label, indexed in a SQLite file. `meta.json` records the committed number of rows, which is updated last, so a
+    store interrupted while adding rows is rolled back to its last complete `add` when it is opened again.
+
+    Exact search multiplies the queries with blocks of rows and keeps a running top-k, so its memory use is
+    bounded by the block size. For large stores, `build_ivf` clusters the rows with spherical k-means and searches
+    only the rows of the `nprobe` lists closest to each query. Rows added after the index was built are searched
+    exactly.
+
+    Args:
+        path (str): Directory of the store, created if it does not exist.
+        dim (int, optional): Embedding dimension, required to create a store.
+        fingerprint (str, optional): Identifies the model and pooling that produced the embeddings, see
+            `cache.model_fingerprint`. Opening a store with another fingerprint fails.
+
+    Raises:
+        ValueError: If the store does not exist and `dim` is None, or its dimension or fingerprint differ.
+
+    Methods:
+        add(ids, texts, embeddings, labels=None):
+            Appends rows. Ids must be new.
+
+        rows_for_ids(ids) / rows_for_texts(texts):
+            Return the row of each id or text, -1 if it is not stored.
+
+        ids(rows) / labels(rows):
+            Return the id or label of each row.
+
+        search(queries, k=10, nprobe=None):
+            Returns the scores and rows of the k nearest rows of each query.
+
+        build_ivf(num_lists=None):
+            Builds the approximate index.
+    """
+    def __init__(self, path, dim=None, fingerprint=None):
+        self.path = path
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as file:
+                self.meta = json.load(file)
+            if dim is not None and dim != self.meta['dim']:
+                raise ValueError(f"{path} stores embeddings of dimension {self.meta['dim']}, not {dim}.")
+            if fingerprint is not None and self.meta.get('fingerprint') not in (None, fingerprint):
+                raise ValueError(f"{path} stores embeddings of another model ({self.meta['fingerprint']}).")
+        elif dim is None:
+            raise ValueError(f"No embedding store at {path}, the dimension is needed to create one.")
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.meta = {'dim': dim, 'count': 0, 'fingerprint': fingerprint}
+            self._save_meta()
+
+        self.dim = self.meta['dim']
+        self._db = sqlite3.connect(os.path.join(path, INDEX_FILE), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS rows "
+                         "(row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, text_key TEXT, label INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS rows_text_key ON rows (text_key)")
+        # Rolls back the rows of an interrupted add
+        self._db.execute("DELETE FROM rows WHERE row >= ?", (self.meta['count'],))
+        self._db.commit()
+        vectors_path = os.path.join(path, VECTORS_FILE)
+        with open(vectors_path, 'ab') as file:
+            file.truncate(self.meta['count'] * self.dim * 2)
+        self._vectors = None
+        self.ivf = None
+        if os.path.exists(os.path.join(path, IVF_FILE)):
+            with np.load(os.path.join(path, IVF_FILE)) as ivf:
+                self.ivf = {name: ivf[name] for name in ivf.files}
+
+    def _save_meta(self):
+        meta_path = os.path.join(self.path, META_FILE)
+        with open(meta_path + '.tmp', 'w') as file:
+            json.dump(self.meta, file)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def __len__(self):
+        return self.meta['count']
+
+    @property
+    def vectors(self):
+        """The read-only float16 memory map of shape (len(store), dim)."""
+        if self._vectors is None or len(self._vectors) != len(self):
+            if len(self) == 0:
+                return np.zeros((0, self.dim), dtype=np.float16)
+            self._vectors = np.memmap(os.path.join(self.path, VECTORS_FILE), dtype=np.float16, mode='r',
+                                      shape=(len(self), self.dim))
+        return self._vectors
+
+    def add(self, ids, texts, embeddings, labels=None):
+        ids, texts = [str(i) for i in ids], list(texts)
+        embeddings = np.asarray(embeddings, dtype=np.float16).reshape(-1, self.dim)
+        if not (len(ids) == len(texts) == len(embeddings)):
+            raise ValueError("ids, texts and embeddings must have the same length.")
+        labels = [None] * len(ids) if labels is None else [None if label is None else int(label) for label in labels]
+        if not ids:
+            return
+        start = len(self)
+        with open(os.path.join(self.path, VECTORS_FILE), 'ab') as file:
+            file.write(embeddings.tobytes())
+        try:
+            self._db.executemany("INSERT INTO rows VALUES (?, ?, ?, ?)",
+                                 [(start + offset, id_, text_key(text), label)
+                                  for offset, (id_, text, label) in enumerate(zip(ids, texts, labels))])
+        except sqlite3.IntegrityError as error:
+            self._db.rollback()
+            with open(os.path.join(self.path, VECTORS_FILE), 'ab') as file:
+                file.truncate(start * self.dim * 2)
+            raise ValueError(f"Duplicate id: {error}") from error
+        self._db.commit()
+        self.meta['count'] = start + len(ids)
+        self._save_meta()
+
+    def _rows_for(self, column, values):
+        rows = np.full(len(values), -1, dtype=np.int64)
+        positions = {}
+        for position, value in enumerate(values):
+            positions.setdefault(value, []).append(position)
+        unique = list(positions)
+        # SQLite limits the number of parameters of a statement
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            query = f"SELECT {column}, MIN(row) FROM rows WHERE {column} IN ({','.join('?' * len(chunk))}) " \
+                    f"GROUP BY {column}"
+            for value, row in self._db.execute(query, chunk):
+                rows[positions[value]] = row
+        return rows
+
+    def rows_for_ids(self, ids):
+        return self._rows_for('id', [str(i) for i in ids])
+
+    def rows_for_texts(self, texts):
+        return self._rows_for('text_key', [text_key(text) for text in texts])
+
+    def _column(self, column, rows):
+        rows = [int(row) for row in np.asarray(rows).ravel()]
+        values = {}
+        for start in range(0, len(rows), 500):
+            chunk = rows[start:start + 500]
+            values.update(self._db.execute(f"SELECT row, {column} FROM rows WHERE row IN "
+                                           f"({','.join('?' * len(chunk))})", chunk))
+        return [values.get(row) for row in rows]
+
+    def ids(self, rows):
+        return self._column('id', rows)
+
+    def labels(self, rows):
+        return self._column('label', rows)
+
+    def _search_exact(self, queries, k, start, end, block_size):
+        scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for block_start in range(start, end, block_size):
+            block_end = min(block_start + block_size, end)
+            block_scores = queries @ self.vectors[block_start:block_end].astype(np.float32).T
+            block_rows = np.broadcast_to(np.arange(block_start, block_end), block_scores.shape)
+            scores, rows = _top_k(np.concatenate([scores, block_scores], axis=1),
+                                  np.concatenate([rows, block_rows], axis=1), k)
+        return scores, rows
+
+    def _search_ivf(self, queries, k, nprobe):
+        centroids, order, offsets = self.ivf['centroids'], self.ivf['order'], self.ivf['offsets']
+        nprobe = min(nprobe, len(centroids))
+        probes = np.argpartition(-(queries @ centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for query_index, lists in enumerate(probes):
+            # Sorted rows read the memory map in file order
+            candidates = np.sort(np.concatenate([order[offsets[i]:offsets[i + 1]] for i in lists]))
+            if len(candidates) == 0:
+                continue
+            candidate_scores = self.vectors[candidates].astype(np.float32) @ queries[query_index]
+            best_scores, best_rows = _top_k(candidate_scores[None], candidates[None], k)
+            scores[query_index, :best_scores.shape[1]] = best_scores[0]
+            rows[query_index, :best_rows.shape[1]] = best_rows[0]
+        return scores, rows
+
+    def search(self, queries, k=10, nprobe=None, block_size=65536):
+        """
+        Finds the rows with the highest cosine similarity to each query.
+
+        Args:
+            queries (np.ndarray): Unit-norm query embeddings of shape (num_queries, dim).
+            k (int): Number of neighbours per query.
+            nprobe (int, optional): Search the approximate index, probing this many lists. Exact if None or if
+                no index was built.
+            block_size (int): Rows per block of the exact search.
+
+        Returns:
+            tuple: scores (np.ndarray of shape (num_queries, k), best first) and rows (np.ndarray of the same
+            shape). If there are fewer than k candidates, the remaining scores are -inf and the rows -1.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        if nprobe is not None and self.ivf is not None:
+            indexed = int(self.ivf['count'])
+            scores, rows = self._search_ivf(queries, k, nprobe)
+            if indexed < len(self):
+                tail_scores, tail_rows = self._search_exact(queries, k, indexed, len(self), block_size)
+                scores, rows = _top_k(np.concatenate([scores, tail_scores], axis=1),
+                                      np.concatenate([rows, tail_rows], axis=1), k)
+        else:
+            scores, rows = self._search_exact(queries, k, 0, len(self), block_size)
+
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        result_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        found = scores.shape[1]
+        result_scores[:, :found] = np.take_along_axis(scores, order, axis=1)
+        result_rows[:, :found] = np.take_along_axis(rows, order, axis=1)
+        result_rows[np.isneginf(result_scores)] = -1
+        return result_scores, result_rows
+
+    def build_ivf(self, num_lists=None, sample_size=100000, iterations=10, block_size=65536, seed=0):
+        """
+        Builds the approximate index: spherical k-means on a sample of the rows, then every row is assigned to
+        its closest centroid, block by block. The index is saved with the store.
+
+        Args:
+            num_lists (int, optional): Number of clusters, defaults to 4 * sqrt(len(store)).
+            sample_size (int): Rows used to fit the centroids.
+            iterations (int): k-means iterations.
+            block_size (int): Rows per block of the assignment.
+            seed (int): Random seed.
+
+        Returns:
+            dict: The index, with 'centroids', 'order' (rows grouped by list), 'offsets' and 'count' (rows
+            indexed).
+
+        Raises:
+            ValueError: If the store is empty.
+        """
+        if len(self) == 0:
+            raise ValueError("Cannot index an empty embedding store.")
+        rng = np.random.default_rng(seed)
+        num_lists = min(num_lists or max(1, int(4 * np.sqrt(len(self)))), len(self))
+        sample = np.sort(rng.choice(len(self), min(sample_size, len(self)), replace=False))
+        sample = self.vectors[sample].astype(np.float32)
+        centroids = sample[rng.choice(len(sample), num_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(num_lists):
+                members = sample[assignment == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+        assignment = np.concatenate([np.argmax(self.vectors[start:start + block_size].astype(np.float32) @
+                                               centroids.T, axis=1)
+                                     for start in range(0, len(self), block_size)])
+        offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=num_lists))
+        self.ivf = {'centroids': centroids, 'order': np.argsort(assignment, kind='stable'), 'offsets': offsets,
+                    'count': np.array(len(self))}
+        np.savez(os.path.join(self.path, IVF_FILE), **self.ivf)
+        return self.ivf
+
+    def close(self):
+        self._db.close()
+        self._vectors = None
+
+
+def embed_texts(store, embedder, texts):
+    """
+    Embeds texts, reading the embedding of quotes already in the store instead of encoding them again.
+
+    Returns:
+        tuple: The float32 embeddings of shape (len(texts), dim) and a boolean mask of the texts found in the
+        store.
+    """
+    texts = list(texts)
+    rows = store.rows_for_texts(texts)
+    known = rows >= 0
+    embeddings = np.empty((len(texts), store.dim), dtype=np.float32)
+    if known.any():
+        embeddings[known] = store.vectors[rows[known]].astype(np.float32)
+    if not known.all():
+        embeddings[~known] = embedder.embed([text for text, found in zip(texts, known) if not found])
+    return embeddings, known
+
+
+def add_corpus(store, embedder, texts, ids, labels=None):
+    """
+    Adds quotes to the store. Ids that are already stored are skipped, so an interrupted build can be resumed,
+    and quotes whose text is already stored reuse its embedding.
+
+    Returns:
+        int: Number of rows added.
+    """
+    texts, ids = list(texts), [str(i) for i in ids]
+    new = store.rows_for_ids(ids) < 0
+    if not new.any():
+        return 0
+    texts = [text for text, keep in zip(texts, new) if keep]
+    labels = None if labels is None else [label for label, keep in zip(labels, new) if keep]
+    embeddings, _ = embed_texts(store, embedder, texts)
+    store.add([i for i, keep in zip(ids, new) if keep], texts, embeddings, labels)
+    return len(texts)
+
+
+def nearest_labeled(store, embedder, texts, k=5, nprobe=None):
+    """
+    Finds the nearest stored quotes of each text, e.g. the most similar labeled training quotes.
+
+    Returns:
+        list of list of dict: For each text, up to k neighbours with 'id', 'label' and 'score' (cosine
+        similarity), most similar first.
+    """
+    embeddings, _ = embed_texts(store, embedder, texts)
+    scores, rows = store.search(embeddings, k=k, nprobe=nprobe)
+    found = rows[rows >= 0]
+    ids, labels = dict(zip(found.tolist(), store.ids(found))), dict(zip(found.tolist(), store.labels(found)))
+    return [[{'id': ids[row], 'label': labels[row], 'score': float(score)}
+             for score, row in zip(text_scores, text_rows) if row >= 0]
+            for text_scores, text_rows in zip(scores, rows)]
+
+
+def load_embedder(config, device='cpu'):
+    """
+    Creates an Embedder from the inference model and tokenizer, with the pooling config['embedding_pooling']
+    (defaults to 'cls').
+    """
+    from model import load_model_for_inference
+    from predict import load_tokenizer
+
+    return Embedder(load_model_for_inference(config, device), load_tokenizer(config), device=device,
+                    max_length=config['max_length'],
+                    token_budget=config.get('token_budget', 8192),
+                    max_batch_size=config.get('max_inference_batch_size', 64),
+                    pooling=config.get('embedding_pooling', 'cls'))
+
+
+def open_store(config, embedder):
+    """
+    Opens or creates the store of config['embedding_store_path'] for the embeddings of `embedder`. The fingerprint
+    covers the model weights, the pooling and max_length, so a store is never mixed across models.
+    """
+    from artifact import ARTIFACT_WEIGHTS
+    from cache import model_fingerprint
+
+    model_path = os.path.join(config['model_artifact_path'], ARTIFACT_WEIGHTS) \
+        if config.get('model_artifact_path') else config['trained_model_path']
+    fingerprint = model_fingerprint(model_path, pooling=embedder.pooling, max_length=embedder.max_length,
+                                    quantization=config.get('inference_quantization'))
+    return EmbeddingStore(config['embedding_store_path'], dim=embedder.dim, fingerprint=fingerprint)
+
+
+def main():
+    """
+    Command line entry points:
+        `python src/embedding_store.py build quotes.parquet --label-column label [--id-column id]` embeds a corpus
+        into config['embedding_store_path'], resuming an interrupted build, and builds the approximate index if
+        config['embedding_ivf_lists'] is set.
+        `python src/embedding_store.py query "quote" ...` prints the nearest stored quotes of each quote.
+    """
+    from config import load_config
+    from bulk_classify import iter_input_chunks
+
+    parser = argparse.ArgumentParser(description="Build and query the embedding store of labeled quotes.")
+    parser.add_argument('command', choices=['build', 'query'])
+    parser.add_argument('inputs', nargs='+', help="The corpus file for build, quotes for query.")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--text-column', default='quote')
+    parser.add_argument('--id-column', help="Defaults to the row number.")
+    parser.add_argument('--label-column')
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    embedder = load_embedder(config, args.device)
+    store = open_store(config, embedder)
+    nprobe = config.get('embedding_ivf_nprobe')
+
+    if args.command == 'query':
+        for text, neighbours in zip(args.inputs, nearest_labeled(store, embedder, args.inputs, args.k, nprobe)):
+            print(json.dumps({'text': text, 'neighbours': neighbours}))
+        return
+
+    columns = [column for column in (args.text_column, args.id_column, args.label_column) if column]
+    first_row = 0
+    for chunk in iter_input_chunks(args.inputs[0], columns, config.get('bulk_chunk_size', 4096)):
+        ids = chunk[args.id_column] if args.id_column else range(first_row, first_row + len(chunk))
+        labels = None
+        if args.label_column:
+            labels = chunk[args.label_column]
+            if not np.issubdtype(labels.dtype, np.number):
+                # Labels such as '0_not_relevant', like `process_labels`
+                labels = labels.astype(str).str.split('_').str[0].astype(int)
+        added = add_corpus(store, embedder, chunk[args.text_column].fillna('').astype(str).tolist(), ids, labels)
+        first_row += len(chunk)
+        print(f"{first_row} rows read, {added} added, {len(store)} stored")
+    if config.get('embedding_ivf_lists'):
+        store.build_ivf(config['embedding_ivf_lists'])
+        print(f"Approximate index built with {config['embedding_ivf_lists']} lists")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
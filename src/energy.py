@@ -0,0 +1,215 @@
+import os
+import re
+import time
+import argparse
+
+RAPL_ROOT = '/sys/class/powercap'
+RAPL_PACKAGE = re.compile(r'^intel-rapl:\d+$')
+# Average carbon intensity of electricity generation worldwide, in grams of CO2 equivalent per kWh
+DEFAULT_CARBON_INTENSITY = 475.0
+DEFAULT_WATTS_PER_CORE = 10.0
+DEFAULT_IDLE_WATTS = 0.0
+
+
+def rapl_packages(root=RAPL_ROOT):
+    """
+    Returns the readable RAPL CPU package domains, e.g. '/sys/class/powercap/intel-rapl:0'. AMD processors expose
+    their package counters under the same names. Sub-domains such as 'intel-rapl:0:0' (cores, DRAM) are already
+    included in their package.
+
+    Args:
+        root (str): The powercap sysfs directory.
+
+    Returns:
+        list of str: The package directories, empty if RAPL is not available or its counters are not readable
+        (recent kernels restrict them to root).
+    """
+    if not os.path.isdir(root):
+        return []
+    packages = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if RAPL_PACKAGE.match(name) and os.access(os.path.join(path, 'energy_uj'), os.R_OK):
+            packages.append(path)
+    return packages
+
+
+def _read_int(path):
+    with open(path, 'r') as file:
+        return int(file.read().strip())
+
+
+def _cpu_seconds():
+    # User and system time of this process and of its terminated children, e.g. data loader workers
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class EnergyMeter:
+    """
+    Measures the energy of training and inference runs.
+
+    The CPU package energy is read from the Linux RAPL counters when they are readable. Otherwise it is estimated
+    from the CPU time of the process as `idle_watts * seconds + watts_per_core * cpu_seconds`, with the
+    coefficients from `calibrate` on a machine with RAPL access, or conservative defaults. RAPL counts the whole
+    package, including other processes, so measure on an otherwise idle machine.
+
+    `train_one_epoch`, `validate_model`, `test_model` and `evaluate_onnx_model` take an `energy_meter` and record
+    one report per call in `reports`.
+
+    Args:
+        idle_watts (float): Estimated package power when idle.
+        watts_per_core (float): Estimated additional power per fully busy core.
+        carbon_intensity (float): Grams of CO2 equivalent per kWh of electricity.
+        use_rapl (bool): Read the RAPL counters if available.
+        rapl_root (str): The powercap sysfs directory.
+
+    Attributes:
+        source (str): 'rapl' or 'estimate'.
+        reports (list of dict): The reports of `stop`.
+
+    Methods:
+        start():
+            Returns a reading to pass to `stop`.
+
+        stop(reading, samples, label):
+            Returns and records the report of the work since `reading`.
+    """
+    def __init__(self, idle_watts=DEFAULT_IDLE_WATTS, watts_per_core=DEFAULT_WATTS_PER_CORE,
+                 carbon_intensity=DEFAULT_CARBON_INTENSITY, use_rapl=True, rapl_root=RAPL_ROOT):
+        self.idle_watts = idle_watts
+        self.watts_per_core = watts_per_core
+        self.carbon_intensity = carbon_intensity
+        self.packages = rapl_packages(rapl_root) if use_rapl else []
+        self.source = 'rapl' if self.packages else 'estimate'
+        self.reports = []
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Creates an EnergyMeter from the optional keys 'energy_idle_watts', 'energy_watts_per_core',
+        'energy_carbon_intensity' and 'energy_use_rapl' of a configuration dictionary.
+        """
+        return cls(idle_watts=config.get('energy_idle_watts', DEFAULT_IDLE_WATTS),
+                   watts_per_core=config.get('energy_watts_per_core', DEFAULT_WATTS_PER_CORE),
+                   carbon_intensity=config.get('energy_carbon_intensity', DEFAULT_CARBON_INTENSITY),
+                   use_rapl=config.get('energy_use_rapl', True))
+
+    def _rapl_microjoules(self):
+        return [_read_int(os.path.join(package, 'energy_uj')) for package in self.packages]
+
+    def start(self):
+        return {'time': time.perf_counter(), 'cpu': _cpu_seconds(),
+                'rapl': self._rapl_microjoules() if self.packages else None}
+
+    def stop(self, reading, samples=None, label=None):
+        """
+        Computes the energy used since `reading`.
+
+        Args:
+            reading (dict): The result of `start`.
+            samples (int, optional): Number of samples processed, for the per-sample figures.
+            label (str, optional): Name of the measured run, e.g. the function name.
+
+        Returns:
+            dict: 'label', 'source', 'seconds', 'cpu_seconds', 'joules', 'samples', 'joules_per_sample',
+            'co2_g' and 'co2_g_per_1k_samples'. The per-sample figures are None without samples.
+        """
+        seconds = time.perf_counter() - reading['time']
+        cpu_seconds = _cpu_seconds() - reading['cpu']
+        if reading['rapl'] is not None:
+            joules = 0.0
+            for package, start, end in zip(self.packages, reading['rapl'], self._rapl_microjoules()):
+                if end < start:
+                    # The counter wrapped around
+                    end += _read_int(os.path.join(package, 'max_energy_range_uj'))
+                joules += (end - start) / 1e6
+        else:
+            joules = self.idle_watts * seconds + self.watts_per_core * cpu_seconds
+
+        co2_g = joules / 3.6e6 * self.carbon_intensity
+        report = {
+            'label': label,
+            'source': 'rapl' if reading['rapl'] is not None else 'estimate',
+            'seconds': seconds,
+            'cpu_seconds': cpu_seconds,
+            'joules': joules,
+            'samples': samples,
+            'joules_per_sample': joules / samples if samples else None,
+            'co2_g': co2_g,
+            'co2_g_per_1k_samples': 1000 * co2_g / samples if samples else None
+        }
+        self.reports.append(report)
+        return report
+
+    def summary(self):
+        """
+        Returns one line per report, e.g. for printing after a run.
+        """
+        lines = []
+        for report in self.reports:
+            line = f"{report['label'] or 'run'}: {report['joules']:.1f} J in {report['seconds']:.1f} s ({report['source']})"
+            if report['samples']:
+                line += (f", {report['joules_per_sample']:.4f} J/sample, "
+                         f"{report['co2_g_per_1k_samples']:.4f} g CO2e per 1k samples")
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+def calibrate(meter, seconds=5.0):
+    """
+    Fits the coefficients of the estimate on a machine with RAPL access, by measuring the package power while
+    idle and while all cores run matrix multiplications. The result can be set as 'energy_idle_watts' and
+    'energy_watts_per_core' on machines of the same type without RAPL access, e.g. in containers.
+
+    Args:
+        meter (EnergyMeter): A meter reading the RAPL counters.
+        seconds (float): Duration of each of the two measurements.
+
+    Returns:
+        dict: 'energy_idle_watts' and 'energy_watts_per_core'.
+
+    Raises:
+        ValueError: If the meter does not read RAPL counters.
+    """
+    import torch
+
+    if meter.source != 'rapl':
+        raise ValueError("Calibration needs readable RAPL counters.")
+    reading = meter.start()
+    time.sleep(seconds)
+    idle = meter.stop(reading, label='calibration idle')
+
+    matrix = torch.randn(1024, 1024)
+    reading = meter.start()
+    while time.perf_counter() - reading['time'] < seconds:
+        matrix = torch.tanh(matrix @ matrix)
+    busy = meter.stop(reading, label='calibration busy')
+
+    idle_watts = idle['joules'] / idle['seconds']
+    watts_per_core = (busy['joules'] - idle_watts * busy['seconds']) / max(busy['cpu_seconds'], 1e-9)
+    return {'energy_idle_watts': idle_watts, 'energy_watts_per_core': watts_per_core}
+
+
+def main():
+    """
+    Command line entry point: `python src/energy.py [--calibrate]`. Shows how energy is measured on this machine
+    and optionally calibrates the estimate.
+    """
+    parser = argparse.ArgumentParser(description="Check or calibrate the energy measurement.")
+    parser.add_argument('--calibrate', action='store_true')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    meter = EnergyMeter()
+    if meter.source == 'rapl':
+        print(f"Reading RAPL counters of {', '.join(meter.packages)}")
+    else:
+        print("RAPL counters are not available, energy is estimated from the CPU time.")
+    if args.calibrate:
+        for key, value in calibrate(meter, args.seconds).items():
+            print(f"{key} : {value:.2f}")
+
+
+if __name__ == '__main__':
+    main()
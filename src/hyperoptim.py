@@ -3,70 +3,349 @@ import os
 import pandas as pd
 import numpy as np
 import torch
+import optuna
 import torch.nn.utils.prune as prune
 from torch.optim import AdamW, lr_scheduler
 from transformers import DistilBertTokenizer, DistilBertForSequenceClassification, DistilBertConfig
-from data_prep import create_data_loader
+from torch.utils.data import DataLoader
+from data_prep import create_data_loader, create_dataset, truncate_dataset, stratified_subset
 from model import load_model_for_finetuning
 from train import train_one_epoch, validate_model
+from utils import partition_cores
 
 
-def objective(config, hyperoptim_config, trial):
+def create_pruner(hyperoptim_config):
+    """
+    Creates the Optuna pruner declared in the hyperparameter optimization configuration.
+
+    Args:
+        hyperoptim_config (dict): Hyperparameter optimization configuration dictionary. The optional 'pruner'
+            entry holds the pruner 'type' ('median', 'successive_halving', 'hyperband' or 'none') and any
+            keyword arguments for the corresponding Optuna pruner, e.g. 'n_warmup_steps' or 'min_resource'.
+
+    Returns:
+        optuna.pruners.BasePruner: The configured pruner. Defaults to a `MedianPruner` when no pruner is declared.
+
+    Raises:
+        ValueError: If the pruner type is not supported.
+    """
+    pruner_config = dict(hyperoptim_config.get('pruner') or {})
+    pruner_type = pruner_config.pop('type', 'median')
+    pruners = {
+        'median': optuna.pruners.MedianPruner,
+        'successive_halving': optuna.pruners.SuccessiveHalvingPruner,
+        'hyperband': optuna.pruners.HyperbandPruner,
+        'none': optuna.pruners.NopPruner
+    }
+    if pruner_type not in pruners:
+        raise ValueError(f"Unsupported pruner type {pruner_type}. Choose from {list(pruners)}.")
+    return pruners[pruner_type](**pruner_config)
+
+
+class StudyContext:
+    """
+    Data and pretrained weights shared by all trials of a study.
+
+    The training and validation data are read and tokenized once, and the pretrained model is loaded from disk
+    once. Their tensors are moved to shared memory so that worker processes of a parallel study read the same
+    copy, and each trial only makes an in-memory copy of the pretrained model.
+
+    Args:
+        config (dict): Configuration dictionary containing the data paths, tokenizer and model settings.
+
+    Attributes:
+        train_dataset (QuotesDataset): The tokenized training data.
+        val_dataset (QuotesDataset): The tokenized validation data.
+        pretrained_model (DistilBertForSequenceClassification): The pretrained model trials copy from.
+
+    Methods:
+        fidelity_datasets(data_fraction, max_length):
+            Returns the training and validation datasets at a reduced fidelity: a stratified fraction of the
+            training data and both datasets truncated to `max_length`. Results are cached per fidelity.
+    """
+    def __init__(self, config):
+        tokenizer = DistilBertTokenizer.from_pretrained(config['tokenizer_model'], do_lower_case=True)
+        self.train_dataset = create_dataset(config["trainpath"], config["train_label_col"],
+                                            config['tokenizer_model'], config['max_length'], tokenizer=tokenizer)
+        self.val_dataset = create_dataset(config["valpath"], config["val_label_col"],
+                                          config['tokenizer_model'], config['max_length'], tokenizer=tokenizer)
+        self.max_length = config['max_length']
+        self.sep_token_id = tokenizer.sep_token_id
+
+        model_config = DistilBertConfig.from_pretrained(config['model_name'], num_labels=config['num_labels'])
+        self.pretrained_model = DistilBertForSequenceClassification.from_pretrained(config['model_name'],
+                                                                                    config=model_config)
+
+        for dataset in (self.train_dataset, self.val_dataset):
+            for tensor in dataset.encodings.values():
+                tensor.share_memory_()
+        self.pretrained_model.share_memory()
+        self._fidelity_cache = {}
+
+    def fidelity_datasets(self, data_fraction, max_length):
+        key = (data_fraction, max_length)
+        if key not in self._fidelity_cache:
+            train_dataset, val_dataset = self.train_dataset, self.val_dataset
+            if max_length < self.max_length:
+                train_dataset = truncate_dataset(train_dataset, max_length, self.sep_token_id)
+                val_dataset = truncate_dataset(val_dataset, max_length, self.sep_token_id)
+            if data_fraction < 1:
+                train_dataset = stratified_subset(train_dataset, data_fraction)
+            self._fidelity_cache[key] = (train_dataset, val_dataset)
+        return self._fidelity_cache[key]
+
+
+def fidelity_schedule(hyperoptim_config, epochs, max_length):
+    """
+    Builds the per-epoch fidelity schedule of a trial.
+
+    With multi-fidelity enabled, the first epochs of a trial run at the rungs declared under 'fidelity' in the
+    hyperparameter optimization configuration, one epoch per rung. The remaining epochs, and always at least
+    the last one, run at full fidelity. Every trial runs the whole ladder, adding full-fidelity epochs if
+    `epochs` is too short, so each epoch index, the step reported to the pruner, has the same fidelity in every
+    trial and the pruner only compares accuracies measured at the same fidelity.
+
+    Args:
+        hyperoptim_config (dict): Hyperparameter optimization configuration dictionary.
+        epochs (int): Number of epochs of the trial.
+        max_length (int): Full-fidelity maximum sequence length.
+
+    Returns:
+        list of dict: One entry per epoch with 'data_fraction' and 'max_length'.
+    """
+    fidelity = hyperoptim_config.get('fidelity') or {}
+    rungs = fidelity.get('rungs', []) if fidelity.get('enabled') else []
+    schedule = [{'data_fraction': rung.get('data_fraction', 1.0),
+                 'max_length': min(rung.get('max_length', max_length), max_length)}
+                for rung in rungs]
+    schedule += [{'data_fraction': 1.0, 'max_length': max_length}] * max(epochs - len(schedule), 1)
+    return schedule
+
+
+def fidelity_cost(fidelity, max_length):
+    """
+    Estimates the compute of one epoch at a fidelity, in full-fidelity epochs (proportional to tokens trained).
+    """
+    return fidelity['data_fraction'] * fidelity['max_length'] / max_length
+
+
+def objective(config, hyperoptim_config, trial, context=None):
     """
     Objective function for hyperparameter optimization.
     This function defines the objective for hyperparameter optimization using Optuna.
     It suggests values for various hyperparameters, loads the training and validation data,
-    initializes the model, optimizer, and learning rate scheduler, and trains the model
-    for a specified number of epochs. The function returns the best validation accuracy
-    achieved during training.
+    initializes the model, optimizer, and learning rate scheduler with the suggested values, and trains
+    the model for the suggested number of epochs. The validation accuracy is reported to the trial after
+    every epoch so that the study's pruner can stop unpromising trials early. With multi-fidelity enabled, the
+    first epochs train on stratified data fractions and truncated sequences (see `fidelity_schedule`). The
+    compute used so far is recorded in the 'compute_cost' user attribute. The function returns the best
+    full-fidelity validation accuracy achieved during training.
     Args:
         config (dict): Configuration dictionary containing paths, model parameters, and other settings.
         hyperoptim_config (dict): Hyperparameter optimization configuration dictionary containing ranges and settings for hyperparameters.
         trial (optuna.trial.Trial): Optuna trial object used to suggest hyperparameter values.
+        context (StudyContext, optional): Tokenized data and pretrained weights shared across trials. Without it
+            the data is read and tokenized and the pretrained weights are loaded from disk for this trial.
     Returns:
         float: Best validation accuracy achieved during training.
+    Raises:
+        optuna.TrialPruned: If the pruner decides to stop the trial after an epoch.
     """
     learning_rate = trial.suggest_float('learning_rate', *hyperoptim_config['learning_rate']['range'], log=hyperoptim_config['learning_rate']['log'])
     num_trainable_layers = trial.suggest_int('num_trainable_layers', *hyperoptim_config['num_trainable_layers']['range'])
     dropout_rate = trial.suggest_float('dropout_rate', *hyperoptim_config['dropout_rate']['range'])
-    batch_size = trial.suggest_categorical('batch_size', *hyperoptim_config['batch_size']['range'])
+    batch_size = trial.suggest_categorical('batch_size', hyperoptim_config['batch_size']['values'])
     epochs = trial.suggest_int('epochs', *hyperoptim_config['epochs']['range'])
     step_size = trial.suggest_int('step_size', *hyperoptim_config['step_size']['range'])
     gamma = trial.suggest_float('gamma', *hyperoptim_config['gamma']['range'])
 
-    # Load training and validation data
-    train_loader = create_data_loader(config["trainpath"], 
-                                        config["train_label_col"],
+    schedule = fidelity_schedule(hyperoptim_config, epochs, config['max_length'])
+    full_fidelity = {'data_fraction': 1.0, 'max_length': config['max_length']}
+    if context is None and any(fidelity != full_fidelity for fidelity in schedule):
+        context = StudyContext(config)
+
+    trial_config = dict(config, dropout_rate=dropout_rate, num_trainable_layers=num_trainable_layers)
+    if context is not None:
+        # Reuse the study's tokenized data and copy the pretrained model held in memory
+        train_loader = DataLoader(context.train_dataset, batch_size=batch_size, shuffle=True)
+        val_loader = DataLoader(context.val_dataset, batch_size=batch_size, shuffle=False)
+        model = load_model_for_finetuning(trial_config, pretrained_model=context.pretrained_model)
+    else:
+        # Load training and validation data
+        train_loader = create_data_loader(config["trainpath"], 
+                                            config["train_label_col"],
+                                            config['tokenizer_model'],
+                                            config['max_length'],
+                                            batch_size,
+                                            shuffle=True)
+
+        val_loader = create_data_loader(config["valpath"], 
+                                        config["val_label_col"],
                                         config['tokenizer_model'],
                                         config['max_length'],
-                                        config['batch_size'],
-                                        shuffle=True)
+                                        batch_size,
+                                        shuffle=False) 
 
-    val_loader = create_data_loader(config["valpath"], 
-                                    config["val_label_col"],
-                                    config['tokenizer_model'],
-                                    config['max_length'],
-                                    config['batch_size'],
-                                    shuffle=False) 
-
-    # load model
-    model = load_model(config)
+        # load model with the suggested architecture settings
+        model = load_model_for_finetuning(trial_config)
 
     # define scheduler and optimizer
-    optimizer = AdamW(model.parameters(), lr=config['learning_rate'])
-    scheduler = lr_scheduler.StepLR(optimizer, step_size=config['step_size'], gamma=config['gamma'])
+    optimizer = AdamW(model.parameters(), lr=learning_rate)
+    scheduler = lr_scheduler.StepLR(optimizer, step_size=step_size, gamma=gamma)
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     model.to(device)
     
     val_accuracies = []
-    for epoch in range(epochs):
-        average_train_loss, train_accuracy, train_f1 = train_one_epoch(model, train_loader, optimizer, device)
-        average_val_loss, val_accuracy, val_f1 = validate_model(model, val_loader, device)
+    compute_cost = 0.0
+    for epoch, fidelity in enumerate(schedule):
+        if fidelity == full_fidelity:
+            epoch_train_loader, epoch_val_loader = train_loader, val_loader
+        else:
+            train_dataset, val_dataset = context.fidelity_datasets(fidelity['data_fraction'], fidelity['max_length'])
+            epoch_train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
+            epoch_val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
+
+        train_one_epoch(model, epoch_train_loader, optimizer, device)
+        average_val_loss, val_accuracy, val_f1, _, _ = validate_model(model, epoch_val_loader, device)
         scheduler.step()
-        val_accuracies.append(val_accuracy)
+        if fidelity == full_fidelity:
+            val_accuracies.append(val_accuracy)
+        compute_cost += fidelity_cost(fidelity, config['max_length'])
+
+        # Report intermediate results so the pruner can stop bad trials early
+        trial.report(val_accuracy, epoch)
+        trial.set_user_attr(f'val_f1_epoch_{epoch}', val_f1)
+        trial.set_user_attr('compute_cost', compute_cost)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
     
     best_val_accuracy = max(val_accuracies)
     
     return best_val_accuracy
 
+
+def create_storage(hyperoptim_config):
+    """
+    Creates the persistent store for the study.
+
+    Args:
+        hyperoptim_config (dict): Hyperparameter optimization configuration dictionary. 'storage_path' points to a
+            SQLite database or, if it ends with '.log', to a journal file. Without it the study stays in memory.
+
+    Returns:
+        optuna.storages.BaseStorage or None: The storage, or None for an in-memory study.
+    """
+    storage_path = hyperoptim_config.get('storage_path')
+    if not storage_path:
+        return None
+    os.makedirs(os.path.dirname(storage_path) or '.', exist_ok=True)
+    if storage_path.endswith('.log'):
+        return optuna.storages.JournalStorage(optuna.storages.journal.JournalFileBackend(storage_path))
+    # The heartbeat marks trials left running by an interrupted worker as failed when the study resumes
+    return optuna.storages.RDBStorage(f"sqlite:///{storage_path}", heartbeat_interval=60, grace_period=120)
+
+
+FINISHED_STATES = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+
+
+def _optimize(study, config, hyperoptim_config, context):
+    # Stops once the study holds num_trials finished trials, so a resumed study only runs the remainder
+    study.optimize(lambda trial: objective(config, hyperoptim_config, trial, context),
+                   callbacks=[optuna.study.MaxTrialsCallback(hyperoptim_config['num_trials'], states=FINISHED_STATES)])
+
+
+def _study_worker(config, hyperoptim_config, cores, context):
+    """
+    Worker process entry point: pins the process to its cores, limits its thread budget and pulls trials
+    from the shared study until the study has enough finished trials.
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    study = optuna.load_study(study_name=hyperoptim_config['study_name'],
+                              storage=create_storage(hyperoptim_config),
+                              pruner=create_pruner(hyperoptim_config))
+    _optimize(study, config, hyperoptim_config, context)
+
+
+def run_study(config, hyperoptim_config):
+    """
+    Runs the hyperparameter search with the pruner declared in the configuration.
+
+    With a 'storage_path' the study is persisted and resumed on the next call without rerunning finished
+    trials. With 'n_workers' greater than 1, worker processes each pull trials from the shared store and are
+    pinned to their own set of cores ('threads_per_worker' cores each, by default an even split). The data is
+    tokenized and the pretrained weights are loaded once per study in a `StudyContext` shared by all trials.
+
+    Args:
+        config (dict): Configuration dictionary containing paths, model parameters, and other settings.
+        hyperoptim_config (dict): Hyperparameter optimization configuration dictionary, including 'num_trials'
+            and optionally 'study_name', 'storage_path', 'n_workers' and 'threads_per_worker'.
+
+    Returns:
+        optuna.study.Study: The finished study.
+
+    Raises:
+        ValueError: If several workers are requested without a persistent storage.
+        RuntimeError: If a worker process fails.
+    """
+    storage = create_storage(hyperoptim_config)
+    n_workers = hyperoptim_config.get('n_workers', 1)
+    if storage is None and n_workers > 1:
+        raise ValueError("Parallel search needs a persistent study store. Set storage_path in the config.")
+
+    study = optuna.create_study(study_name=hyperoptim_config.get('study_name'),
+                                storage=storage,
+                                load_if_exists=True,
+                                direction='maximize',
+                                pruner=create_pruner(hyperoptim_config))
+    finished = len(study.get_trials(deepcopy=False, states=FINISHED_STATES))
+    print(f"Study {study.study_name}: {finished} of {hyperoptim_config['num_trials']} trials already finished")
+
+    if finished < hyperoptim_config['num_trials']:
+        context = StudyContext(config)
+        if n_workers == 1:
+            _optimize(study, config, hyperoptim_config, context)
+        else:
+            worker_config = dict(hyperoptim_config, study_name=study.study_name)
+            mp_context = torch.multiprocessing.get_context('spawn')
+            workers = [mp_context.Process(target=_study_worker, args=(config, worker_config, cores, context))
+                       for cores in partition_cores(n_workers, hyperoptim_config.get('threads_per_worker'))]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            if any(worker.exitcode != 0 for worker in workers):
+                raise RuntimeError("A hyperparameter search worker failed. Rerun to resume the study.")
+
+    pruned = len(study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.PRUNED,)))
+    completed = study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,))
+    if completed:
+        print(f"Study finished: {len(study.trials)} trials, {pruned} pruned, best value {study.best_value:.4f}")
+    else:
+        # study.best_value raises when every trial was pruned or failed
+        print(f"Study finished: {len(study.trials)} trials, {pruned} pruned, no trial completed")
+    savings = compute_savings(study)
+    print(f"Compute used: {savings['compute_cost']:.1f} of {savings['full_fidelity_cost']} full-fidelity epochs "
+          f"({100 * savings['saved_fraction']:.1f}% saved)")
+    return study
+
+
+def compute_savings(study):
+    """
+    Compares the compute used by a study with a full-fidelity search without pruning.
+
+    Args:
+        study (optuna.study.Study): The study.
+
+    Returns:
+        dict: 'compute_cost' (full-fidelity epochs actually trained, from the trials' 'compute_cost' user
+        attribute), 'full_fidelity_cost' (epochs the same trials would have trained at full fidelity without
+        pruning) and 'saved_fraction'.
+    """
+    trials = study.get_trials(deepcopy=False, states=FINISHED_STATES)
+    compute_cost = sum(trial.user_attrs.get('compute_cost', 0.0) for trial in trials)
+    full_fidelity_cost = sum(trial.params.get('epochs', 0) for trial in trials)
+    saved_fraction = 1 - compute_cost / full_fidelity_cost if full_fidelity_cost else 0.0
+    return {'compute_cost': compute_cost, 'full_fidelity_cost': full_fidelity_cost, 'saved_fraction': saved_fraction}
@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import argparse
+
+HEAVY_MODULES = ('torch', 'transformers', 'onnxruntime', 'sklearn', 'matplotlib')
+
+
+def loaded_heavy_modules():
+    """
+    Returns the heavy dependencies imported so far, to check what a code path pulls in.
+
+    Returns:
+        list of str: The names of HEAVY_MODULES found in sys.modules.
+    """
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def apply_autotuned_config(config, backend='torch'):
+    """
+    Merges the settings written by `python src/autotune.py` into a configuration. The file at
+    'autotuned_config_path' is only applied if it exists and was tuned for the same backend.
+
+    Args:
+        config (dict): Configuration dictionary.
+        backend (str): 'torch' or 'onnx'.
+
+    Returns:
+        dict: The configuration with the tuned keys, or `config` itself if nothing applies.
+    """
+    path = config.get('autotuned_config_path')
+    if not path or not os.path.exists(path):
+        return config
+    import yaml
+
+    with open(path, 'r') as file:
+        tuned = yaml.safe_load(file) or {}
+    if tuned.pop('autotune_backend', backend) != backend:
+        return config
+    return {**config, **tuned}
+
+
+def load_inference_predictor(config, backend='torch', device='cpu', onnx_path=None):
+    """
+    Creates the predictor used for serving. Importing this module is cheap: each dependency is imported when the
+    chosen backend needs it, so the ONNX backend never imports PyTorch or transformers, and plotting and the
+    training code are never imported.
+
+    The settings tuned by `python src/autotune.py` are applied first, see `apply_autotuned_config`. In order of
+    precedence, the predictor is a CachedPredictor if 'cache_enabled' is set, an InferencePool for the
+    PyTorch backend on the CPU if 'pool_workers' is set, and a BatchPredictor otherwise. If 'cascade_enabled' is
+    set, it is wrapped in a CascadePredictor that only escalates the quotes the fast model is unsure about.
+
+    Args:
+        config (dict): Configuration dictionary with the keys used by `load_predictor` and optionally
+            'cache_enabled', 'pool_workers', 'cascade_enabled' and 'autotuned_config_path'. For the ONNX backend,
+            the 'session_*' keys tune the session pool.
+        backend (str): 'torch' or 'onnx'.
+        device (str): The device for the PyTorch backend.
+        onnx_path (str, optional): The ONNX model, required for the ONNX backend.
+
+    Returns:
+        BatchPredictor, CachedPredictor, InferencePool or CascadePredictor: The predictor. An InferencePool is
+        already started.
+
+    Raises:
+        ValueError: If the ONNX backend has no model path.
+    """
+    config = apply_autotuned_config(config, backend)
+    if config.get('cascade_enabled', False):
+        from cascade import load_cascade_predictor
+        return load_cascade_predictor(config, load_inference_predictor({**config, 'cascade_enabled': False},
+                                                                       backend, device, onnx_path))
+    session = None
+    if backend == 'onnx':
+        if onnx_path is None:
+            raise ValueError("The ONNX backend needs the path of an ONNX model.")
+        from onnx_session import load_session_pool
+        session = load_session_pool(onnx_path, config)
+
+    if config.get('cache_enabled', False):
+        from cache import load_cached_predictor
+        return load_cached_predictor(config, backend=backend, device=device, session=session, model_path=onnx_path)
+    if backend == 'torch' and device == 'cpu' and config.get('pool_workers'):
+        from worker_pool import load_inference_pool
+        return load_inference_pool(config).start()
+    from predict import load_predictor
+    return load_predictor(config, backend=backend, device=device, session=session)
+
+
+def main():
+    """
+    Command line entry point: `python src/inference.py --config configs/config.yaml "quote" ...`. Reads one quote
+    per line from stdin if no quotes are given, and prints one JSON line per quote with the predicted label and
+    the class probabilities.
+    """
+    from config import load_config
+
+    parser = argparse.ArgumentParser(description="Classify quotes with the trained model.")
+    parser.add_argument('texts', nargs='*')
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch')
+    parser.add_argument('--onnx-path', help="ONNX model for the onnx backend.")
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    texts = args.texts or [line.rstrip('\n') for line in sys.stdin if line.strip()]
+    predictor = load_inference_predictor(load_config(args.config), backend=args.backend, device=args.device,
+                                         onnx_path=args.onnx_path)
+    try:
+        probabilities = predictor.predict_proba(texts)
+    finally:
+        if hasattr(predictor, 'close'):
+            predictor.close()
+    for text, row in zip(texts, probabilities):
+        print(json.dumps({'text': text, 'label': int(row.argmax()), 'probabilities': [float(p) for p in row]}))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
+import os
+import copy
 import torch
+import torch.nn as nn
 from transformers import DistilBertConfig, DistilBertForSequenceClassification
+from artifact import load_model_artifact
 
-def load_model_for_finetuning(config):
+def load_model_for_finetuning(config, pretrained_model=None):
     """
     Loads and configures a DistilBERT model for sequence classification using parameters specified in a YAML config file.
     The function initializes the model with a pre-trained DistilBERT checkpoint, freezes all layers, unfreezes a specified number
@@ -13,6 +17,9 @@ def load_model_for_finetuning(config):
             - 'dropout_rate' (float): The dropout rate applied to the model's layers for regularization. 
             - 'total_layers' (int): The total number of layers in the DistilBERT model (typically 6).
             - 'num_trainable_layers' (int): The number of transformer layers to unfreeze for fine-tuning. 
+        pretrained_model (DistilBertForSequenceClassification, optional): A pretrained model already held in memory.
+            If given, the model is an in-memory copy of it with the configured dropout rate instead of a fresh
+            load from disk, e.g. to reuse one copy of the weights across hyperparameter search trials.
     Returns:
         DistilBertForSequenceClassification: The configured DistilBERT model ready for training or evaluation.
 
@@ -32,15 +39,19 @@ def load_model_for_finetuning(config):
         4. Unfreeze the classifier layer.
 
     """
-    model_config = DistilBertConfig.from_pretrained(
-        config['model_name'],
-        num_labels=config['num_labels'],
-        dropout=config['dropout_rate'],
-        attention_dropout=config['dropout_rate']
-    )
+    if pretrained_model is not None:
+        model = copy.deepcopy(pretrained_model)
+        set_dropout_rate(model, config['dropout_rate'])
+    else:
+        model_config = DistilBertConfig.from_pretrained(
+            config['model_name'],
+            num_labels=config['num_labels'],
+            dropout=config['dropout_rate'],
+            attention_dropout=config['dropout_rate']
+        )
    
-    model = DistilBertForSequenceClassification.from_pretrained(config['model_name'],
-                                                                 config=model_config)
+        model = DistilBertForSequenceClassification.from_pretrained(config['model_name'],
+                                                                     config=model_config)
     
     # Freeze all layers
     for name, param in model.named_parameters():
@@ -58,7 +69,30 @@ def load_model_for_finetuning(config):
     return model
 
 
-def load_model_for_inference(config, device):
+def set_dropout_rate(model, dropout_rate):
+    """
+    Sets the dropout and attention dropout rate of the DistilBERT encoder in place, as if the model had been
+    created with `dropout=dropout_rate` and `attention_dropout=dropout_rate`.
+
+    Args:
+        model (DistilBertForSequenceClassification): The model to update.
+        dropout_rate (float): The new dropout rate.
+
+    Returns:
+        DistilBertForSequenceClassification: The same model.
+    """
+    for module in model.distilbert.modules():
+        if isinstance(module, torch.nn.Dropout):
+            module.p = dropout_rate
+        # Some attention implementations keep their own copy of the attention dropout
+        if hasattr(module, 'dropout_prob'):
+            module.dropout_prob = dropout_rate
+    model.config.dropout = dropout_rate
+    model.config.attention_dropout = dropout_rate
+    return model
+
+
+def load_model_for_inference(config, device, quantization=None):
     """
     Loads a pre-trained DistilBERT model for inference, using configuration parameters specified in a YAML file.
     The function initializes the model, loads trained weights, freezes all layers to prevent gradient computation,,
@@ -69,11 +103,21 @@ def load_model_for_inference(config, device):
             - 'model_name' (str): The name or path of the pre-trained DistilBERT model (e.g., 'distilbert-base-uncased').
             - 'num_labels' (int): The number of output labels for the classification task.
             - 'trained_model_path' (str): The file path to the trained model weights (e.g., a `.pt` or `.bin` file).
+            - 'inference_quantization' (str, optional): Default for `quantization`.
+            - 'quantized_model_path' (str, optional): File path where the quantized state dict is cached. A cache
+              made from the same trained weights with the same quantization is loaded instead of re-quantizing.
+            - 'model_artifact_path' (str, optional): Directory of a model artifact saved with `save_model_artifact`.
+              If set, the model is loaded from it instead of 'model_name' and 'trained_model_path'.
         device (str or torch.device): The device to load the model onto (e.g., 'cpu' or 'cuda').
+        quantization (str, optional): 'dynamic_int8' (CPU only), 'fp16' or 'bf16', see `quantize_model`.
+            The model is not quantized if None.
 
     Returns:
         DistilBertForSequenceClassification: The trained DistilBERT model, loaded with trained weights, frozen, and set to evaluation mode.
 
+    Raises:
+        ValueError: If the quantization is not supported or not available on the device.
+
     Example:
         If the YAML configuration file contains:
         ```
@@ -83,25 +127,65 @@ def load_model_for_inference(config, device):
         ```
         And the device is set to 'cpu', the function will:
         1. Load the 'distilbert-base-uncased' model with 2 output labels.
-        2. Load the trained weights from `/path/to/trained_model.pt`.
-        3. Freeze all layers to prevent gradient computation.
-        4. Set the model to evaluation mode.
+        2. Load the trained weights from `/path/to/trained_model.pt`, resizing the word embeddings if the
+           weights come from a model with a pruned vocabulary.
+        3. Quantize the model if `quantization` is set, or load the cached quantized weights.
+        4. Freeze all layers to prevent gradient computation.
+        5. Set the model to evaluation mode.
     
     """
     
+    quantization = quantization or config.get('inference_quantization')
+    if quantization is not None:
+        check_quantization(quantization, device)
+
+    artifact_path = config.get('model_artifact_path')
+    if artifact_path:
+        # A single memory-mapped load of the self-contained artifact, without the pretrained checkpoint
+        model = load_model_artifact(artifact_path, device)
+        if quantization is not None:
+            model = quantize_model(model, quantization)
+        for param in model.parameters():
+            param.requires_grad = False
+        return model.eval()
+
     # Load model configuration
     model_config = DistilBertConfig.from_pretrained(
         config['model_name'],
         num_labels=config['num_labels']
     )
 
-    # Initialize model
-    model = DistilBertForSequenceClassification.from_pretrained(config['model_name'],
-                                                             config=model_config)
+    cache_path = config.get('quantized_model_path')
+    cached = load_quantized_cache(cache_path, config['trained_model_path'], quantization, device) \
+        if quantization is not None and cache_path else None
+    if cached is not None:
+        # The cached weights replace all parameters, so the pretrained checkpoint is not needed
+        model = DistilBertForSequenceClassification(model_config)
+        vocab_size = cached['distilbert.embeddings.word_embeddings.weight'].shape[0] \
+            if 'distilbert.embeddings.word_embeddings.weight' in cached else model.config.vocab_size
+        if vocab_size != model.config.vocab_size:
+            model.resize_token_embeddings(vocab_size)
+        model = quantize_model(model, quantization)
+        model.load_state_dict(cached)
+    else:
+        # Initialize model
+        model = DistilBertForSequenceClassification.from_pretrained(config['model_name'],
+                                                                 config=model_config)
+
+        # Load trained weights
+        state_dict = torch.load(config['trained_model_path'], map_location=torch.device(device))
 
-    # Load trained weights
-    model.load_state_dict(torch.load(config['trained_model_path'],
-                                    map_location=torch.device(device)))  
+        # Models with a pruned vocabulary have a smaller embedding matrix
+        vocab_size = state_dict['distilbert.embeddings.word_embeddings.weight'].shape[0]
+        if vocab_size != model.config.vocab_size:
+            model.resize_token_embeddings(vocab_size)
+
+        model.load_state_dict(state_dict)
+
+        if quantization is not None:
+            model = quantize_model(model, quantization)
+            if cache_path:
+                save_quantized_cache(model, cache_path, config['trained_model_path'], quantization)
 
     # Freeze all layers 
     for param in model.parameters():
@@ -113,3 +197,67 @@ def load_model_for_inference(config, device):
     return model
 
 
+QUANTIZATIONS = ('dynamic_int8', 'fp16', 'bf16')
+
+
+def check_quantization(quantization, device):
+    """
+    Checks that a quantization option is supported on a device.
+
+    Raises:
+        ValueError: If the quantization is unknown, or dynamic int8 is requested on a non-CPU device.
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unsupported quantization {quantization}. Choose from {list(QUANTIZATIONS)}.")
+    if quantization == 'dynamic_int8' and torch.device(device).type != 'cpu':
+        raise ValueError("Dynamic int8 quantization is only available on the CPU.")
+
+
+def quantize_model(model, quantization):
+    """
+    Quantizes a model for inference.
+
+    Args:
+        model (DistilBertForSequenceClassification): The fp32 model.
+        quantization (str): 'dynamic_int8' stores the weights of all linear layers in int8 and quantizes their
+            activations on the fly; 'fp16' and 'bf16' cast all weights to half precision.
+
+    Returns:
+        torch.nn.Module: The quantized model. Dynamic int8 returns a new module, the other options cast in place.
+    """
+    check_quantization(quantization, 'cpu' if quantization == 'dynamic_int8' else next(model.parameters()).device)
+    if quantization == 'dynamic_int8':
+        # Weights of an fp16 artifact are quantized from fp32
+        return torch.ao.quantization.quantize_dynamic(model.float(), {nn.Linear}, dtype=torch.qint8)
+    return model.to(torch.float16 if quantization == 'fp16' else torch.bfloat16)
+
+
+def _weights_signature(trained_model_path):
+    stat = os.stat(trained_model_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def save_quantized_cache(model, cache_path, trained_model_path, quantization):
+    """
+    Saves the state dict of a quantized model together with the quantization and a signature of the trained
+    weights it was made from.
+    """
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    torch.save({'quantization': quantization,
+                'weights': _weights_signature(trained_model_path),
+                'state_dict': model.state_dict()}, cache_path)
+
+
+def load_quantized_cache(cache_path, trained_model_path, quantization, device):
+    """
+    Loads a cached quantized state dict.
+
+    Returns:
+        dict or None: The state dict, or None if there is no cache for this quantization and these trained weights.
+    """
+    if not os.path.exists(cache_path) or not os.path.exists(trained_model_path):
+        return None
+    cache = torch.load(cache_path, map_location=torch.device(device))
+    if cache.get('quantization') != quantization or cache.get('weights') != _weights_signature(trained_model_path):
+        return None
+    return cache['state_dict']
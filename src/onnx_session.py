@@ -0,0 +1,179 @@
+import os
+import queue
+import hashlib
+from contextlib import contextmanager
+import onnxruntime
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+}
+
+EXECUTION_MODES = {
+    'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL
+}
+
+
+def create_session_options(config):
+    """
+    Builds ONNX Runtime session options from the configuration.
+
+    Args:
+        config (dict): Configuration dictionary. All keys are optional:
+            - 'session_intra_op_threads' (int): Threads used inside an operator, 0 lets ONNX Runtime decide.
+            - 'session_inter_op_threads' (int): Threads used across operators in parallel execution mode.
+            - 'session_execution_mode' (str): 'sequential' (default) or 'parallel'.
+            - 'session_graph_optimization_level' (str): 'disable', 'basic', 'extended' or 'all' (default).
+            - 'session_enable_cpu_mem_arena' (bool): Use the CPU memory arena, defaults to True.
+            - 'session_enable_mem_pattern' (bool): Pre-plan allocations from the first run, defaults to True.
+
+    Returns:
+        onnxruntime.SessionOptions: The session options.
+
+    Raises:
+        ValueError: If the execution mode or optimization level is not supported.
+    """
+    execution_mode = config.get('session_execution_mode', 'sequential')
+    level = config.get('session_graph_optimization_level', 'all')
+    if execution_mode not in EXECUTION_MODES:
+        raise ValueError(f"Unsupported execution mode {execution_mode}. Choose from {list(EXECUTION_MODES)}.")
+    if level not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unsupported graph optimization level {level}. "
+                         f"Choose from {list(GRAPH_OPTIMIZATION_LEVELS)}.")
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = config.get('session_intra_op_threads', 0)
+    options.inter_op_num_threads = config.get('session_inter_op_threads', 0)
+    options.execution_mode = EXECUTION_MODES[execution_mode]
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[level]
+    options.enable_cpu_mem_arena = config.get('session_enable_cpu_mem_arena', True)
+    options.enable_mem_pattern = config.get('session_enable_mem_pattern', True)
+    return options
+
+
+def optimized_model_path(onnx_path, cache_dir, level):
+    """
+    Returns the path of the persisted optimized graph for a model. The name depends on the model file, the
+    optimization level and the ONNX Runtime version, so a stale graph is never reused.
+
+    Args:
+        onnx_path (str): The file path of the ONNX model.
+        cache_dir (str): Directory holding the optimized graphs.
+        level (str): The graph optimization level.
+
+    Returns:
+        str: The file path of the optimized graph.
+    """
+    stat = os.stat(onnx_path)
+    key = f"{os.path.abspath(onnx_path)}:{stat.st_size}:{stat.st_mtime_ns}:{level}:{onnxruntime.__version__}"
+    digest = hashlib.sha256(key.encode()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(onnx_path))[0]
+    return os.path.join(cache_dir, f"{name}.{level}.{digest}.onnx")
+
+
+def load_session(onnx_path, config, providers=None):
+    """
+    Creates a tuned ONNX Runtime session.
+
+    If 'session_optimized_model_dir' is set, the graph optimized at the configured level is saved there on the
+    first load, and later loads read it with graph optimization disabled, which skips the optimization passes
+    at startup.
+
+    Args:
+        onnx_path (str): The file path of the ONNX model.
+        config (dict): Configuration dictionary with the keys of `create_session_options` and optionally
+            'session_optimized_model_dir' (str).
+        providers (list of str, optional): Execution providers, defaults to ["CPUExecutionProvider"].
+
+    Returns:
+        onnxruntime.InferenceSession: The session.
+    """
+    providers = providers or ["CPUExecutionProvider"]
+    options = create_session_options(config)
+    cache_dir = config.get('session_optimized_model_dir')
+    level = config.get('session_graph_optimization_level', 'all')
+    if not cache_dir or level == 'disable':
+        return onnxruntime.InferenceSession(onnx_path, options, providers=providers)
+
+    cached_path = optimized_model_path(onnx_path, cache_dir, level)
+    if os.path.exists(cached_path):
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS['disable']
+        return onnxruntime.InferenceSession(cached_path, options, providers=providers)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written under a temporary name so that concurrent processes never load a partial file
+    temporary_path = f"{cached_path}.{os.getpid()}.tmp"
+    options.optimized_model_filepath = temporary_path
+    session = onnxruntime.InferenceSession(onnx_path, options, providers=providers)
+    os.replace(temporary_path, cached_path)
+    print(f"Optimized graph saved at {cached_path}")
+    return session
+
+
+class SessionPool:
+    """
+    A fixed pool of tuned ONNX Runtime sessions shared by concurrent callers. Each call borrows a session for
+    its duration, so callers never queue behind each other inside one session.
+
+    The pool exposes `run`, `get_inputs` and `get_outputs`, so it can be used wherever a single session is
+    expected, e.g. in `OnnxBackend` or `evaluate_onnx_model`.
+
+    Args:
+        onnx_path (str): The file path of the ONNX model.
+        config (dict): Configuration dictionary for `load_session`.
+        size (int): Number of sessions in the pool.
+        providers (list of str, optional): Execution providers.
+
+    Methods:
+        session():
+            Context manager that borrows a session from the pool.
+
+        run(output_names, inputs):
+            Runs a borrowed session.
+    """
+    def __init__(self, onnx_path, config, size=1, providers=None):
+        if size < 1:
+            raise ValueError("The session pool needs at least one session.")
+        self.size = size
+        self._sessions = queue.Queue()
+        # The first load persists the optimized graph, the others reuse it
+        self._template = load_session(onnx_path, config, providers)
+        self._sessions.put(self._template)
+        for _ in range(size - 1):
+            self._sessions.put(load_session(onnx_path, config, providers))
+
+    @contextmanager
+    def session(self):
+        session = self._sessions.get()
+        try:
+            yield session
+        finally:
+            self._sessions.put(session)
+
+    def run(self, output_names, inputs, run_options=None):
+        with self.session() as session:
+            return session.run(output_names, inputs, run_options)
+
+    def get_inputs(self):
+        return self._template.get_inputs()
+
+    def get_outputs(self):
+        return self._template.get_outputs()
+
+
+def load_session_pool(onnx_path, config, providers=None):
+    """
+    Creates a SessionPool with 'session_pool_size' sessions (defaults to 1).
+
+    Args:
+        onnx_path (str): The file path of the ONNX model.
+        config (dict): Configuration dictionary for `load_session`.
+        providers (list of str, optional): Execution providers.
+
+    Returns:
+        SessionPool: The session pool.
+    """
+    return SessionPool(onnx_path, config, size=config.get('session_pool_size', 1), providers=providers)
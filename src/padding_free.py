@@ -0,0 +1,217 @@
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+ATTENTION_MODES = ('sdpa', 'nested')
+
+
+def pack(input_ids, attention_mask):
+    """
+    Removes the padding of a batch: the real tokens of all sequences are concatenated into one sequence.
+
+    Args:
+        input_ids (torch.Tensor): Token ids of shape (batch_size, seq_len).
+        attention_mask (torch.Tensor): Mask of shape (batch_size, seq_len), 1 for real tokens. Real tokens must
+            come first in each row.
+
+    Returns:
+        dict: 'input_ids' and 'positions' of shape (total_tokens,), 'offsets' of shape (batch_size + 1,) with the
+        start of each sequence in the packed tokens, 'index' the position of each packed token in the flattened
+        batch, and 'mask', the boolean attention mask.
+    """
+    mask = attention_mask.bool()
+    batch_size, seq_len = input_ids.shape
+    offsets = torch.zeros(batch_size + 1, dtype=torch.long, device=input_ids.device)
+    offsets[1:] = mask.sum(dim=1).cumsum(dim=0)
+    positions = torch.arange(seq_len, device=input_ids.device).expand(batch_size, seq_len)
+    return {'input_ids': input_ids[mask], 'positions': positions[mask], 'offsets': offsets,
+            'index': mask.view(-1).nonzero().squeeze(1), 'mask': mask}
+
+
+def packed_attention(attention, hidden_states, packing, mode='sdpa'):
+    """
+    Multi-head self-attention of a DistilBERT layer over packed tokens.
+
+    The projections run on the packed tokens only. Only the attention itself needs the sequences apart: 'sdpa'
+    scatters queries, keys and values into a padded batch for `scaled_dot_product_attention` with a mask, while
+    'nested' wraps them in jagged nested tensors, so no attention score is computed for padding.
+
+    Args:
+        attention (MultiHeadSelfAttention): The attention module of a transformer block.
+        hidden_states (torch.Tensor): Packed hidden states of shape (total_tokens, dim).
+        packing (dict): The result of `pack`.
+        mode (str): 'sdpa' or 'nested'.
+
+    Returns:
+        torch.Tensor: The attention output of shape (total_tokens, dim), before the output projection.
+    """
+    total_tokens, dim = hidden_states.shape
+    n_heads = attention.n_heads
+    head_dim = dim // n_heads
+    query, key, value = attention.q_lin(hidden_states), attention.k_lin(hidden_states), attention.v_lin(hidden_states)
+
+    if mode == 'nested':
+        def split_heads(x):
+            return torch.nested.nested_tensor_from_jagged(x.view(total_tokens, n_heads, head_dim),
+                                                          packing['offsets']).transpose(1, 2)
+
+        context = F.scaled_dot_product_attention(split_heads(query), split_heads(key), split_heads(value))
+        return context.transpose(1, 2).values().reshape(total_tokens, dim)
+
+    batch_size, seq_len = packing['mask'].shape
+
+    def split_heads(x):
+        padded = x.new_zeros(batch_size * seq_len, dim)
+        padded[packing['index']] = x
+        return padded.view(batch_size, seq_len, n_heads, head_dim).transpose(1, 2)
+
+    context = F.scaled_dot_product_attention(split_heads(query), split_heads(key), split_heads(value),
+                                             attn_mask=packing['mask'][:, None, None, :])
+    return context.transpose(1, 2).reshape(batch_size * seq_len, dim)[packing['index']]
+
+
+def padding_free_forward(model, input_ids, attention_mask, mode='sdpa'):
+    """
+    Runs a DistilBertForSequenceClassification model in evaluation mode without computing anything for padding.
+    The embeddings, projections, feed-forward networks and layer norms run on the packed real tokens, see `pack`
+    and `packed_attention`. The logits match those of `model(input_ids, attention_mask=attention_mask)`.
+
+    Args:
+        model (DistilBertForSequenceClassification): The model, e.g. from `load_model_for_inference`.
+        input_ids (torch.Tensor): Token ids of shape (batch_size, seq_len).
+        attention_mask (torch.Tensor): Mask of shape (batch_size, seq_len), 1 for real tokens.
+        mode (str): The attention mode, 'sdpa' or 'nested'.
+
+    Returns:
+        torch.Tensor: The logits of shape (batch_size, num_labels).
+
+    Raises:
+        ValueError: If the attention mode is not supported.
+    """
+    if mode not in ATTENTION_MODES:
+        raise ValueError(f"Unsupported attention mode {mode}. Choose one of {', '.join(ATTENTION_MODES)}.")
+    packing = pack(input_ids, attention_mask)
+    embeddings = model.distilbert.embeddings
+    hidden_states = embeddings.LayerNorm(embeddings.word_embeddings(packing['input_ids']) +
+                                         embeddings.position_embeddings(packing['positions']))
+
+    for layer in model.distilbert.transformer.layer:
+        context = packed_attention(layer.attention, hidden_states, packing, mode)
+        hidden_states = layer.sa_layer_norm(layer.attention.out_lin(context) + hidden_states)
+        ffn = layer.ffn
+        hidden_states = layer.output_layer_norm(ffn.lin2(ffn.activation(ffn.lin1(hidden_states))) + hidden_states)
+
+    # The first token of each sequence is [CLS]
+    pooled_output = F.relu(model.pre_classifier(hidden_states[packing['offsets'][:-1]]))
+    return model.classifier(pooled_output)
+
+
+class PaddingFreeBackend:
+    """
+    Runs a PyTorch sequence classification model on padded NumPy batches with `padding_free_forward`, as a
+    drop-in replacement for `TorchBackend`.
+
+    Args:
+        model (DistilBertForSequenceClassification): The model, e.g. from `load_model_for_inference`.
+        device (str or torch.device): The device the model is on.
+        mode (str): The attention mode, 'sdpa' or 'nested'.
+    """
+    def __init__(self, model, device='cpu', mode='sdpa'):
+        if mode not in ATTENTION_MODES:
+            raise ValueError(f"Unsupported attention mode {mode}. Choose one of {', '.join(ATTENTION_MODES)}.")
+        self.model = model
+        self.device = torch.device(device)
+        self.mode = mode
+        self.num_labels = model.config.num_labels
+
+    def __call__(self, input_ids, attention_mask):
+        with torch.inference_mode():
+            logits = padding_free_forward(self.model, torch.from_numpy(input_ids).to(self.device),
+                                          torch.from_numpy(attention_mask).to(self.device), self.mode)
+        return logits.float().cpu().numpy()
+
+
+def padding_fraction(predictor, texts):
+    """
+    Returns the fraction of the tokens in the padded batches of a BatchPredictor that are padding.
+    """
+    from predict import make_batches
+
+    lengths = np.sort([len(ids) for ids in predictor.encode(texts)])
+    padded = sum((end - start) * lengths[end - 1]
+                 for start, end in make_batches(lengths, predictor.token_budget, predictor.max_batch_size))
+    return float(1.0 - lengths.sum() / padded)
+
+
+def measure_speedup(predictor, texts, modes=ATTENTION_MODES, repeats=3):
+    """
+    Compares the padded PyTorch path of a BatchPredictor with the padding-free path on the same texts.
+
+    Args:
+        predictor (BatchPredictor): A predictor with a TorchBackend.
+        texts (list of str): The texts, e.g. validation quotes, so the lengths follow the real distribution.
+        modes (list of str): The attention modes to measure.
+        repeats (int): Timed passes over the texts, the fastest one counts.
+
+    Returns:
+        dict: 'padding_fraction' (see `padding_fraction`), the 'padded' texts per second and, per mode,
+        'texts_per_second', 'speedup' and 'max_abs_diff' (largest difference of the probabilities).
+    """
+    from predict import BatchPredictor
+
+    def timed(candidate):
+        probabilities = candidate.predict_proba(texts)
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            candidate.predict_proba(texts)
+            seconds.append(time.perf_counter() - start)
+        return probabilities, len(texts) / min(seconds)
+
+    reference, padded_rate = timed(predictor)
+    report = {'padding_fraction': padding_fraction(predictor, texts), 'padded': {'texts_per_second': padded_rate}}
+    for mode in modes:
+        candidate = BatchPredictor(PaddingFreeBackend(predictor.backend.model, predictor.backend.device, mode),
+                                   predictor.tokenizer, predictor.max_length, predictor.token_budget,
+                                   predictor.max_batch_size)
+        probabilities, rate = timed(candidate)
+        report[mode] = {'texts_per_second': rate, 'speedup': rate / padded_rate,
+                        'max_abs_diff': float(np.abs(probabilities - reference).max())}
+    return report
+
+
+def main():
+    """
+    Command line entry point: `python src/padding_free.py --config configs/config.yaml`. Measures the speedup of
+    the padding-free path on the quotes of config['valpath'].
+    """
+    from config import load_config
+    from data_prep import read_data
+    from predict import load_predictor
+
+    parser = argparse.ArgumentParser(description="Measure the speedup of padding-free inference.")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--limit', type=int, default=1000, help="Number of validation quotes.")
+    parser.add_argument('--max-batch-sizes', type=int, nargs='+', help="Batch sizes to compare, defaults to the "
+                                                                         "configured max_inference_batch_size.")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    config['inference_padding_free'] = False
+    texts = read_data(config['valpath'], config['val_label_col'])['quote'].tolist()[:args.limit]
+    predictor = load_predictor(config, backend='torch', device=args.device)
+    for max_batch_size in args.max_batch_sizes or [predictor.max_batch_size]:
+        predictor.max_batch_size = max_batch_size
+        report = measure_speedup(predictor, texts)
+        print(f"max batch size {max_batch_size}: {report['padding_fraction']:.1%} of the padded tokens are padding, "
+              f"padded {report['padded']['texts_per_second']:.1f} texts/s")
+        for mode in ATTENTION_MODES:
+            print(f"  {mode}: {report[mode]['texts_per_second']:.1f} texts/s, speedup {report[mode]['speedup']:.2f}x, "
+                  f"max abs diff {report[mode]['max_abs_diff']:.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+import os
+import json
+import numpy as np
+
+
+class TorchBackend:
+    """
+    Runs a PyTorch sequence classification model on padded NumPy batches.
+
+    Args:
+        model (DistilBertForSequenceClassification): The model, e.g. from `load_model_for_inference`.
+        device (str or torch.device): The device the model is on.
+    """
+    def __init__(self, model, device='cpu'):
+        import torch
+
+        self.model = model
+        self.device = torch.device(device)
+        self.num_labels = model.config.num_labels
+
+    def __call__(self, input_ids, attention_mask):
+        import torch
+
+        with torch.inference_mode():
+            outputs = self.model(torch.from_numpy(input_ids).to(self.device),
+                                 attention_mask=torch.from_numpy(attention_mask).to(self.device))
+        return outputs.logits.float().cpu().numpy()
+
+
+class OnnxBackend:
+    """
+    Runs an ONNX sequence classification model on padded NumPy batches.
+
+    Args:
+        session (onnxruntime.InferenceSession): The ONNX Runtime session. If the model was exported with a fixed
+            sequence length, batches are padded to that length.
+    """
+    def __init__(self, session):
+        self.session = session
+        sequence_length = session.get_inputs()[0].shape[1]
+        self.fixed_length = sequence_length if isinstance(sequence_length, int) else None
+        num_labels = session.get_outputs()[0].shape[1]
+        self.num_labels = num_labels if isinstance(num_labels, int) else None
+
+    def __call__(self, input_ids, attention_mask):
+        if self.fixed_length is not None and input_ids.shape[1] < self.fixed_length:
+            padding = ((0, 0), (0, self.fixed_length - input_ids.shape[1]))
+            input_ids = np.pad(input_ids, padding)
+            attention_mask = np.pad(attention_mask, padding)
+        return self.session.run(["logits"], {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+
+
+def make_batches(lengths, token_budget, max_batch_size):
+    """
+    Groups length-sorted sequences into batches whose padded size stays within a token budget.
+
+    Args:
+        lengths (array-like): Sequence lengths, sorted in ascending order.
+        token_budget (int): Maximum number of tokens (batch size times padded length) per batch.
+        max_batch_size (int): Maximum number of sequences per batch.
+
+    Returns:
+        list of tuple: (start, end) index ranges into `lengths`, one per batch.
+    """
+    batches = []
+    start = 0
+    for end in range(1, len(lengths) + 1):
+        # Sorted ascending, so the last sequence sets the padded length of the batch
+        too_many_tokens = (end - start) * lengths[end - 1] > token_budget
+        if end - start > 1 and (too_many_tokens or end - start > max_batch_size):
+            batches.append((start, end - 1))
+            start = end - 1
+    if start < len(lengths):
+        batches.append((start, len(lengths)))
+    return batches
+
+
+class BatchPredictor:
+    """
+    High-throughput prediction over raw texts.
+
+    Texts are tokenized without padding, sorted by token length and grouped into batches bounded by a token
+    budget rather than a fixed count, so short texts run in large batches and little compute goes to padding.
+    Results are returned in the original order.
+
+    Args:
+        backend (TorchBackend, PaddingFreeBackend or OnnxBackend): The model backend.
+        tokenizer (callable): The tokenizer, e.g. a `DistilBertTokenizer` or `PrunedTokenizer`.
+        max_length (int): Maximum length of the tokenized sequences.
+        token_budget (int): Maximum number of tokens per batch.
+        max_batch_size (int): Maximum number of texts per batch.
+
+    Methods:
+        predict_proba(texts):
+            Returns the class probabilities, a NumPy array of shape (len(texts), num_labels).
+
+        predict(texts):
+            Returns the predicted class ids, a NumPy array of shape (len(texts),).
+
+        encode(texts):
+            Tokenizes the texts without padding, returns a list of token id lists.
+
+        predict_proba_encoded(input_ids):
+            Returns the class probabilities of texts tokenized with `encode`.
+    """
+    def __init__(self, backend, tokenizer, max_length=365, token_budget=8192, max_batch_size=64):
+        self.backend = backend
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+
+    def encode(self, texts):
+        return self.tokenizer(list(texts), truncation=True, max_length=self.max_length)['input_ids']
+
+    def predict_proba(self, texts):
+        texts = list(texts)
+        return self.predict_proba_encoded(self.encode(texts) if texts else [])
+
+    def predict_proba_encoded(self, input_ids):
+        if len(input_ids) == 0:
+            return np.zeros((0, self.backend.num_labels or 0), dtype=np.float32)
+
+        lengths = np.array([len(ids) for ids in input_ids])
+        order = np.argsort(lengths, kind='stable')
+        sorted_lengths = lengths[order]
+
+        probabilities = None
+        for start, end in make_batches(sorted_lengths, self.token_budget, self.max_batch_size):
+            batch_indices = order[start:end]
+            padded_length = sorted_lengths[end - 1]
+            batch_input_ids = np.full((end - start, padded_length), self.tokenizer.pad_token_id, dtype=np.int64)
+            batch_attention_mask = np.zeros((end - start, padded_length), dtype=np.int64)
+            for row, idx in enumerate(batch_indices):
+                batch_input_ids[row, :lengths[idx]] = input_ids[idx]
+                batch_attention_mask[row, :lengths[idx]] = 1
+
+            logits = self.backend(batch_input_ids, batch_attention_mask)
+            logits = logits - logits.max(axis=1, keepdims=True)
+            batch_probabilities = np.exp(logits)
+            batch_probabilities /= batch_probabilities.sum(axis=1, keepdims=True)
+
+            if probabilities is None:
+                probabilities = np.empty((len(input_ids), batch_probabilities.shape[1]), dtype=np.float32)
+            probabilities[batch_indices] = batch_probabilities
+        return probabilities
+
+    def predict(self, texts):
+        return np.argmax(self.predict_proba(texts), axis=1)
+
+
+class WordPieceTokenizer:
+    """
+    Uncased WordPiece tokenizer on the `tokenizers` library, producing the same ids as `DistilBertTokenizer`
+    with `do_lower_case=True` without importing transformers, which takes seconds at startup.
+
+    Args:
+        tokenizer_path (str): Path to a tokenizer.json file saved by a fast tokenizer, or to a vocab.txt file.
+        kept_ids (list of int, optional): Sorted ids of the original vocabulary kept in a pruned model, see
+            `PrunedTokenizer`. Word pieces that were pruned are mapped to the unknown token.
+    """
+    def __init__(self, tokenizer_path, kept_ids=None):
+        from tokenizers import Tokenizer, BertWordPieceTokenizer
+
+        if tokenizer_path.endswith('.json'):
+            self.tokenizer = Tokenizer.from_file(tokenizer_path)
+            self.tokenizer.no_padding()
+            self.tokenizer.no_truncation()
+        else:
+            self.tokenizer = BertWordPieceTokenizer(tokenizer_path, lowercase=True)
+        self.pad_token_id = self.tokenizer.token_to_id('[PAD]')
+        self.id_map = None
+        if kept_ids is not None:
+            unk_token_id = kept_ids.index(self.tokenizer.token_to_id('[UNK]'))
+            self.id_map = np.full(self.tokenizer.get_vocab_size(), unk_token_id, dtype=np.int64)
+            self.id_map[kept_ids] = np.arange(len(kept_ids))
+            self.pad_token_id = int(self.id_map[self.pad_token_id])
+
+    def __call__(self, texts, truncation=True, max_length=512, **kwargs):
+        input_ids = []
+        for encoding in self.tokenizer.encode_batch(list(texts)):
+            ids = encoding.ids
+            if truncation and len(ids) > max_length:
+                # Keeps the trailing [SEP] like the transformers tokenizers
+                ids = ids[:max_length - 1] + ids[-1:]
+            if self.id_map is not None:
+                ids = self.id_map[ids].tolist()
+            input_ids.append(ids)
+        return {'input_ids': input_ids}
+
+
+def load_tokenizer(config):
+    """
+    Loads the tokenizer for inference from 'model_artifact_path' if it is set, else from 'tokenizer_model'.
+    A local directory with a tokenizer.json or vocab.txt file (and kept_ids.json for a pruned vocabulary) is loaded
+    as a WordPieceTokenizer, anything else with `DistilBertTokenizer.from_pretrained`.
+
+    Args:
+        config (dict): Configuration dictionary.
+
+    Returns:
+        WordPieceTokenizer or DistilBertTokenizer: The tokenizer.
+    """
+    path = config.get('model_artifact_path') or config['tokenizer_model']
+    for name in ('tokenizer.json', 'vocab.txt'):
+        if os.path.exists(os.path.join(path, name)):
+            kept_ids = None
+            if os.path.exists(os.path.join(path, 'kept_ids.json')):
+                with open(os.path.join(path, 'kept_ids.json'), 'r') as file:
+                    kept_ids = json.load(file)
+            return WordPieceTokenizer(os.path.join(path, name), kept_ids)
+
+    from transformers import DistilBertTokenizer
+    return DistilBertTokenizer.from_pretrained(path, do_lower_case=True)
+
+
+def load_predictor(config, backend='torch', device='cpu', session=None):
+    """
+    Creates a BatchPredictor for the PyTorch or ONNX backend. PyTorch and transformers are only imported for the
+    PyTorch backend.
+
+    Args:
+        config (dict): Configuration dictionary. Uses 'tokenizer_model', 'max_length' and optionally
+            'token_budget', 'max_inference_batch_size', 'inference_threads' (intra-op threads of the PyTorch
+            backend) and 'inference_padding_free' with 'padding_free_attention' (see `PaddingFreeBackend`). The
+            tokenizer of 'model_artifact_path' is used instead of 'tokenizer_model' if it is set, see
+            `load_tokenizer`. The PyTorch backend also needs the keys required by `load_model_for_inference`.
+        backend (str): 'torch' or 'onnx'.
+        device (str or torch.device): The device for the PyTorch backend.
+        session (onnxruntime.InferenceSession, optional): The session for the ONNX backend.
+
+    Returns:
+        BatchPredictor: The predictor.
+
+    Raises:
+        ValueError: If the backend is not supported or the ONNX backend has no session.
+    """
+    if backend == 'torch':
+        from model import load_model_for_inference
+        if config.get('inference_threads'):
+            import torch
+            torch.set_num_threads(config['inference_threads'])
+        model = load_model_for_inference(config, device)
+        if config.get('inference_padding_free', False):
+            from padding_free import PaddingFreeBackend
+            model_backend = PaddingFreeBackend(model, device, mode=config.get('padding_free_attention', 'sdpa'))
+        else:
+            model_backend = TorchBackend(model, device)
+    elif backend == 'onnx':
+        if session is None:
+            raise ValueError("The ONNX backend needs an onnxruntime.InferenceSession.")
+        model_backend = OnnxBackend(session)
+    else:
+        raise ValueError(f"Unsupported backend {backend}. Choose 'torch' or 'onnx'.")
+
+    return BatchPredictor(model_backend, load_tokenizer(config),
+                          max_length=config['max_length'],
+                          token_budget=config.get('token_budget', 8192),
+                          max_batch_size=config.get('max_inference_batch_size', 64))
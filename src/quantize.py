@@ -1,15 +1,35 @@
+import os
+import queue
+import threading
+import onnx
 import torch
 import numpy as np
 import pandas as pd
 from transformers import DistilBertForSequenceClassification, DistilBertTokenizer, AutoConfig
 from torch.utils.data import DataLoader, Dataset
-from onnxruntime.quantization import quantize_dynamic, QuantType, CalibrationDataReader
+from onnxruntime import InferenceSession, OrtValue
+from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType, QuantFormat, CalibrationDataReader, \
+    CalibrationMethod
+from onnxruntime.transformers.optimizer import optimize_model
+from onnx_session import SessionPool
 from utils import calculate_f1_score
 
+WEIGHT_TYPES = {
+    'qint8': QuantType.QInt8,
+    'quint8': QuantType.QUInt8
+}
 
-def convert_to_onnx(model, config, quantize_config):
+CALIBRATION_METHODS = {
+    'minmax': CalibrationMethod.MinMax,
+    'entropy': CalibrationMethod.Entropy,
+    'percentile': CalibrationMethod.Percentile
+}
+
+
+def convert_to_onnx(model, config, quantize_config, tokenizer=None):
     """
-    Converts a given PyTorch model to ONNX format.
+    Converts a given PyTorch model to ONNX format with dynamic batch size and sequence length, so inputs only
+    need padding to the longest sequence of their batch.
 
     Args:
         model (torch.nn.Module): The PyTorch model to be converted.
@@ -18,6 +38,13 @@ def convert_to_onnx(model, config, quantize_config):
             - max_length (int): The maximum length for tokenization.
         quantize_config (dict): Configuration dictionary for ONNX export.
             - onnx_path (str): The file path where the ONNX model will be saved.
+            - validation_lengths (list of int, optional): Sequence lengths at which the exported model is checked
+              against PyTorch.
+            - validation_atol (float, optional): Maximum absolute logit difference allowed, defaults to 1e-4.
+            - optimized_onnx_path (str, optional): If set, the exported model is optimized with ONNX Runtime's
+              transformer optimizer and saved to this path.
+        tokenizer (callable, optional): Tokenizer used to build the dummy input, e.g. a `PrunedTokenizer`
+            for a model with a pruned vocabulary. Defaults to the tokenizer named in `config`.
 
     Returns:
         None
@@ -32,22 +59,138 @@ def convert_to_onnx(model, config, quantize_config):
         }
         convert_to_onnx(model, config, quantize_config)
     """
-    tokenizer = DistilBertTokenizer.from_pretrained(config['tokenizer_name'])
+    if tokenizer is None:
+        tokenizer = DistilBertTokenizer.from_pretrained(config['tokenizer_name'])
     dummy_text = "This is a dummy input for ONNX conversion."
-    dummy_inputs = tokenizer(dummy_text, return_tensors="pt", max_length=config['max_length'], padding="max_length", truncation=True)
-
+    dummy_inputs = tokenizer(dummy_text, return_tensors="pt", max_length=config['max_length'], truncation=True)
 
+    # The TorchScript exporter produces the graph patterns ONNX Runtime's transformer optimizer and quantizer expect
     torch.onnx.export(
         model, 
         (dummy_inputs["input_ids"], dummy_inputs["attention_mask"]),
         quantize_config['onnx_path'],
         input_names=["input_ids", "attention_mask"],
         output_names=["logits"],
-        dynamic_axes={"input_ids": {0: "batch_size"}, "attention_mask": {0: "batch_size"}},
-        opset_version=14
+        dynamic_axes={"input_ids": {0: "batch_size", 1: "sequence_length"},
+                      "attention_mask": {0: "batch_size", 1: "sequence_length"},
+                      "logits": {0: "batch_size"}},
+        opset_version=14,
+        dynamo=False
     )
     print(f"Model exported to {quantize_config['onnx_path']}")
 
+    atol = quantize_config.get('validation_atol', 1e-4)
+    if quantize_config.get('validation_lengths'):
+        validate_onnx_export(model, quantize_config['onnx_path'], quantize_config['validation_lengths'], atol)
+    if quantize_config.get('optimized_onnx_path'):
+        optimize_onnx_model(quantize_config['onnx_path'], quantize_config['optimized_onnx_path'], model.config)
+        if quantize_config.get('validation_lengths'):
+            validate_onnx_export(model, quantize_config['optimized_onnx_path'],
+                                 quantize_config['validation_lengths'], atol)
+
+
+def validate_onnx_export(model, onnx_path, sequence_lengths, atol=1e-4):
+    """
+    Checks that an ONNX model produces the same logits as the PyTorch model at several sequence lengths.
+
+    Each check runs a batch of two random sequences, the second one half padding, so that both the dynamic
+    sequence axis and the attention mask are exercised.
+
+    Args:
+        model (torch.nn.Module): The PyTorch model that was exported.
+        onnx_path (str): The file path of the ONNX model.
+        sequence_lengths (list of int): The sequence lengths to check.
+        atol (float): Maximum absolute logit difference allowed.
+
+    Returns:
+        dict: The maximum absolute logit difference for each sequence length.
+
+    Raises:
+        ValueError: If the difference exceeds `atol` at any length.
+    """
+    session = InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    device = next(model.parameters()).device
+    was_training = model.training
+    model.eval()
+
+    differences = {}
+    for sequence_length in sequence_lengths:
+        input_ids = torch.randint(0, model.config.vocab_size, (2, sequence_length))
+        attention_mask = torch.ones_like(input_ids)
+        attention_mask[1, max(1, sequence_length // 2):] = 0
+        with torch.no_grad():
+            expected = model(input_ids.to(device), attention_mask=attention_mask.to(device)).logits.float().cpu().numpy()
+        actual = session.run(["logits"], {"input_ids": input_ids.numpy(), "attention_mask": attention_mask.numpy()})[0]
+        differences[sequence_length] = float(np.abs(expected - actual).max())
+
+    model.train(was_training)
+    failed = {length: diff for length, diff in differences.items() if diff > atol}
+    if failed:
+        raise ValueError(f"ONNX model {onnx_path} differs from PyTorch beyond {atol} at lengths {failed}.")
+    print(f"Validated {onnx_path} at sequence lengths {list(sequence_lengths)} "
+          f"(max difference {max(differences.values()):.2e})")
+    return differences
+
+
+def optimize_onnx_model(onnx_path, optimized_onnx_path, model_config):
+    """
+    Applies ONNX Runtime's transformer graph optimizations (attention, LayerNorm and GELU fusion) to an exported
+    model and saves the result.
+
+    Args:
+        onnx_path (str): The file path of the exported ONNX model.
+        optimized_onnx_path (str): The file path where the optimized model will be saved.
+        model_config (DistilBertConfig): The model configuration, for the number of heads and hidden size.
+
+    Returns:
+        dict: The number of fused operators of each type.
+    """
+    optimized_model = optimize_model(onnx_path, model_type='bert',
+                                     num_heads=model_config.n_heads, hidden_size=model_config.dim)
+    optimized_model.save_model_to_file(optimized_onnx_path)
+    fused = {op: count for op, count in optimized_model.get_fused_operator_statistics().items() if count}
+    print(f"Optimized model saved at {optimized_onnx_path} (fused operators: {fused})")
+    return fused
+
+
+def quantization_input(quantize_config):
+    """
+    Returns the ONNX model to quantize: config['optimized_onnx_path'] if it exists and is at least as new as
+    config['onnx_path'], else config['onnx_path']. An optimized model older than the export was made from a
+    previous model and is ignored.
+    """
+    onnx_path = quantize_config['onnx_path']
+    optimized_onnx_path = quantize_config.get('optimized_onnx_path')
+    if not optimized_onnx_path or not os.path.exists(optimized_onnx_path):
+        return onnx_path
+    if os.path.getmtime(optimized_onnx_path) < os.path.getmtime(onnx_path):
+        print(f"Ignoring {optimized_onnx_path}: it is older than {onnx_path}. Re-export to optimize it again.")
+        return onnx_path
+    return optimized_onnx_path
+
+
+def nodes_in_scopes(onnx_path, scopes):
+    """
+    Finds the nodes of an exported model that belong to the given module scopes.
+
+    Args:
+        onnx_path (str): The file path of the ONNX model.
+        scopes (list of str): Substrings of node names, e.g. 'classifier' for the classification head or
+            'embeddings' for the embedding layer.
+
+    Returns:
+        list of str: Names of the matching nodes, for `nodes_to_exclude`.
+    """
+    graph = onnx.load(onnx_path, load_external_data=False).graph
+    names = []
+    for node in graph.node:
+        if any(scope in node.name for scope in scopes):
+            names.append(node.name)
+            # Dynamic quantization first rewrites Gemm into MatMul + Add, renaming the node
+            if node.op_type == 'Gemm':
+                names.append(node.name + '_MatMul')
+    return names
+
 
 def dynamic_quantize(quantize_config):
     """
@@ -57,6 +200,11 @@ def dynamic_quantize(quantize_config):
         quantize_config (dict): A dictionary containing the following keys:
             - 'onnx_path' (str): The file path to the input ONNX model.
             - 'quantized_onnx_path' (str): The file path where the quantized ONNX model will be saved.
+            - 'optimized_onnx_path' (str, optional): If the optimized model exists and is not older than
+              'onnx_path', it is quantized instead, see `quantization_input`.
+            - 'weight_type' (str, optional): 'qint8' or 'quint8', defaults to 'qint8'.
+            - 'per_channel' (bool, optional): Quantize weights per output channel.
+            - 'exclude_scopes' (list of str, optional): Module scopes kept in float, see `nodes_in_scopes`.
 
     Returns:
         None
@@ -64,62 +212,220 @@ def dynamic_quantize(quantize_config):
     Notes:
         Saves the quantized ONNX model to the specified output path and prints a confirmation message.
     """
+    model_input = quantization_input(quantize_config)
+    options = {}
+    if model_input != quantize_config['onnx_path']:
+        # Fused operators come from the com.microsoft domain, which ONNX shape inference cannot type
+        options['extra_options'] = {'DefaultTensorType': onnx.TensorProto.FLOAT}
+    if 'per_channel' in quantize_config:
+        options['per_channel'] = quantize_config['per_channel']
+    if quantize_config.get('exclude_scopes'):
+        options['nodes_to_exclude'] = nodes_in_scopes(model_input, quantize_config['exclude_scopes'])
+
     quantize_dynamic(
-        model_input=quantize_config['onnx_path'],
+        model_input=model_input,
         model_output=quantize_config['quantized_onnx_path'],
-        weight_type=QuantType.QInt8
+        weight_type=WEIGHT_TYPES[quantize_config.get('weight_type', 'qint8')],
+        **options
     )
     print(f"Dynamic quantized model saved at {quantize_config['quantized_onnx_path']}")
 
+
+class QuoteCalibrationDataReader(CalibrationDataReader):
+    """
+    Feeds batches from a data loader to ONNX Runtime's static quantization calibration.
+
+    Batches are trimmed to their longest sequence, since the exported model has a dynamic sequence length.
+
+    Args:
+        data_loader (DataLoader): A data loader providing batches with 'input_ids' and 'attention_mask',
+            e.g. from `create_data_loader`.
+        num_batches (int, optional): Number of batches to use. Uses the whole loader if None.
+
+    Methods:
+        get_next():
+            Returns the next input dictionary, or None when the calibration data is exhausted.
+
+        rewind():
+            Restarts from the first batch.
+    """
+    def __init__(self, data_loader, num_batches=None):
+        self.batches = []
+        for batch in data_loader:
+            if num_batches is not None and len(self.batches) >= num_batches:
+                break
+            attention_mask = np.asarray(batch["attention_mask"], dtype=np.int64)
+            length = max(int(attention_mask.sum(axis=1).max()), 1)
+            self.batches.append({
+                "input_ids": np.asarray(batch["input_ids"], dtype=np.int64)[:, :length],
+                "attention_mask": attention_mask[:, :length]
+            })
+        self.rewind()
+
+    def get_next(self):
+        return next(self._iterator, None)
+
+    def rewind(self):
+        self._iterator = iter(self.batches)
+
+
+def static_quantize(quantize_config, calibration_loader):
+    """
+    Perform static INT8 quantization on an ONNX model, with activation ranges calibrated on real batches.
+
+    The model is saved in QDQ format and only MatMul/Gemm are quantized. Attention masks and LayerNorm inputs
+    stay in float, because their ranges (e.g. the large negative mask values) do not quantize well. ONNX
+    Runtime applies its graph fusions around the QDQ nodes when the session is created.
+
+    Args:
+        quantize_config (dict): A dictionary containing the following keys:
+            - 'onnx_path' (str): The file path to the exported (not optimized) ONNX model.
+            - 'static_quantized_onnx_path' (str): The file path where the quantized ONNX model will be saved.
+            - 'calibration_batches' (int, optional): Number of calibration batches, defaults to 16.
+            - 'calibration_method' (str, optional): 'minmax', 'entropy' or 'percentile', defaults to 'minmax'.
+            - 'per_channel' (bool, optional): Quantize weights per output channel, defaults to False.
+            - 'exclude_scopes' (list of str, optional): Module scopes kept in float, see `nodes_in_scopes`.
+        calibration_loader (DataLoader): A data loader providing calibration batches, e.g. the validation
+            loader from `create_data_loader`.
+
+    Returns:
+        str: The file path of the quantized model.
+
+    Raises:
+        ValueError: If the calibration method is not supported.
+
+    Example:
+        static_quantize(quantize_config, val_loader)
+        session = onnxruntime.InferenceSession(quantize_config['static_quantized_onnx_path'])
+        evaluate_onnx_model(session, val_loader)
+    """
+    method = quantize_config.get('calibration_method', 'minmax')
+    if method not in CALIBRATION_METHODS:
+        raise ValueError(f"Unsupported calibration method {method}. Choose from {list(CALIBRATION_METHODS)}.")
+
+    reader = QuoteCalibrationDataReader(calibration_loader, quantize_config.get('calibration_batches', 16))
+    quantize_static(
+        model_input=quantize_config['onnx_path'],
+        model_output=quantize_config['static_quantized_onnx_path'],
+        calibration_data_reader=reader,
+        quant_format=QuantFormat.QDQ,
+        op_types_to_quantize=['MatMul', 'Gemm'],
+        # uint8 activations with int8 weights use the fast U8S8 integer kernels on x86
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=quantize_config.get('per_channel', False),
+        nodes_to_exclude=nodes_in_scopes(quantize_config['onnx_path'], quantize_config.get('exclude_scopes') or []),
+        calibrate_method=CALIBRATION_METHODS[method]
+    )
+    print(f"Static quantized model ({method} calibration on {len(reader.batches)} batches) saved at "
+          f"{quantize_config['static_quantized_onnx_path']}")
+    return quantize_config['static_quantized_onnx_path']
+
     
-def evaluate_onnx_model(session, val_loader):
+def _as_int64(tensor):
+    # torch CPU tensors share memory with .numpy(); ascontiguousarray only copies if dtype or layout differ
+    if isinstance(tensor, torch.Tensor):
+        tensor = tensor.numpy()
+    return np.ascontiguousarray(tensor, dtype=np.int64)
+
+
+def _prefetch(iterable, depth):
+    """Iterates over `iterable` in a background thread, keeping up to `depth` items ready."""
+    items = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def evaluate_onnx_model(session, val_loader, use_io_binding=True, prefetch=0, verbose=1, energy_meter=None):
     """
     Evaluate an ONNX model using a validation data loader.
 
+    Loader tensors are handed to ONNX Runtime without copies. With IO binding the logits are written into
+    pre-allocated buffers that are reused across batches. Predictions are accumulated as arrays and the
+    metrics are computed once at the end.
+
     Args:
-        session (onnxruntime.InferenceSession): The ONNX runtime session for the model.
+        session (onnxruntime.InferenceSession or SessionPool): The ONNX runtime session for the model.
         val_loader (DataLoader): A data loader providing validation data batches.
-        
+        use_io_binding (bool): Bind inputs and outputs to reusable buffers. Only applies to real ONNX Runtime
+            sessions; other session objects are called through `run`.
+        prefetch (int): Number of batches loaded ahead in a background thread, 0 to load in the calling thread.
+        verbose (int): 0 prints nothing, 1 prints the final metrics, 2 also prints per-batch results.
+        energy_meter (EnergyMeter, optional): Records the energy of the evaluation and per prediction.
+
     Returns:
         tuple: A tuple containing:
             - accuracy (float): The accuracy of the model on the validation set.
             - f1 (float): The F1 score of the model on the validation set.
-            - all_val_labels (list): A list of all true labels from the validation set.
-            - all_val_preds (list): A list of all predicted labels from the validation set.
-    """
-    print("Starting ONNX evaluation...")
-    total_correct = 0
-    total_samples = 0
-    all_val_labels = []
-    all_val_preds = []
-
-    for batch_idx, batch in enumerate(val_loader):
-        print(f"Processing batch {batch_idx+1}...")
-        # Ensure inputs are numpy arrays
-        input_ids = np.array(batch["input_ids"], dtype=np.int64)
-        attention_mask = np.array(batch["attention_mask"], dtype=np.int64)
-        labels = np.array(batch["labels"], dtype=np.int64)
-
-        # Prepare ONNX input dictionary
-        inputs = {
-            "input_ids": input_ids,
-            "attention_mask": attention_mask
-        }
-        
-        # Run inference
-        outputs = session.run(["logits"], inputs)
-        predictions = np.argmax(outputs[0], axis=1)
-
-        # Compute accuracy
-        batch_correct = np.sum(predictions == labels)
-        total_correct += batch_correct
-        total_samples += len(labels)
-        all_val_labels.extend(labels)
-        all_val_preds.extend(predictions)
-        print(f"Batch {batch_idx+1}: {batch_correct}/{len(labels)} correct")
-
-    accuracy = total_correct / total_samples
+            - all_val_labels (numpy.ndarray): All true labels from the validation set.
+            - all_val_preds (numpy.ndarray): All predicted labels from the validation set.
+    """
+    if isinstance(session, SessionPool):
+        with session.session() as pooled_session:
+            return evaluate_onnx_model(pooled_session, val_loader, use_io_binding, prefetch, verbose, energy_meter)
+
+    if verbose:
+        print("Starting ONNX evaluation...")
+    binding = session.io_binding() if use_io_binding and isinstance(session, InferenceSession) else None
+    output_buffers = {}
+    batch_labels = []
+    batch_preds = []
+    reading = energy_meter.start() if energy_meter is not None else None
+
+    batches = _prefetch(val_loader, prefetch) if prefetch else val_loader
+    for batch_idx, batch in enumerate(batches):
+        input_ids = _as_int64(batch["input_ids"])
+        attention_mask = _as_int64(batch["attention_mask"])
+        labels = _as_int64(batch["labels"])
+
+        if binding is not None:
+            logits = output_buffers.get(len(input_ids))
+            if logits is None:
+                num_labels = session.get_outputs()[0].shape[1]
+                logits = np.empty((len(input_ids), num_labels), dtype=np.float32)
+                output_buffers[len(input_ids)] = logits
+            binding.bind_cpu_input("input_ids", input_ids)
+            binding.bind_cpu_input("attention_mask", attention_mask)
+            binding.bind_ortvalue_output("logits", OrtValue.ortvalue_from_numpy(logits))
+            session.run_with_iobinding(binding)
+        else:
+            logits = session.run(["logits"], {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+
+        predictions = np.argmax(logits, axis=1)
+        batch_labels.append(labels)
+        batch_preds.append(predictions)
+        if verbose > 1:
+            print(f"Batch {batch_idx+1}: {np.sum(predictions == labels)}/{len(labels)} correct")
+
+    if energy_meter is not None:
+        energy_meter.stop(reading, samples=sum(len(labels) for labels in batch_labels), label='evaluate_onnx_model')
+    if not batch_labels:
+        if verbose:
+            print("ONNX evaluation skipped: the data loader is empty.")
+        return 0.0, 0.0, np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    all_val_labels = np.concatenate(batch_labels)
+    all_val_preds = np.concatenate(batch_preds)
+    total_correct = int(np.sum(all_val_labels == all_val_preds))
+    accuracy = total_correct / len(all_val_labels)
     f1 = calculate_f1_score(all_val_labels, all_val_preds)
-    print(f"ONNX Validation Accuracy: {accuracy:.4f} ({total_correct}/{total_samples})")
-    print(f"ONNX Validation F1 Score: {f1:.4f}")
-    return accuracy, f1, all_val_labels, all_val_preds
\ No newline at end of file
+    if verbose:
+        print(f"ONNX Validation Accuracy: {accuracy:.4f} ({total_correct}/{len(all_val_labels)})")
+        print(f"ONNX Validation F1 Score: {f1:.4f}")
+    return accuracy, f1, all_val_labels, all_val_preds
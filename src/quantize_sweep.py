@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from onnxruntime import InferenceSession
+from quantize import convert_to_onnx, dynamic_quantize, static_quantize, evaluate_onnx_model, quantization_input
+
+DEFAULT_VARIANTS = [
+    {'name': 'fp32', 'method': 'fp32'},
+    {'name': 'dynamic_qint8', 'method': 'dynamic', 'weight_type': 'qint8'},
+    {'name': 'dynamic_quint8', 'method': 'dynamic', 'weight_type': 'quint8'},
+    {'name': 'dynamic_qint8_per_channel', 'method': 'dynamic', 'weight_type': 'qint8', 'per_channel': True},
+    {'name': 'dynamic_qint8_float_classifier', 'method': 'dynamic', 'weight_type': 'qint8',
+     'exclude_scopes': ['classifier']},
+    {'name': 'dynamic_qint8_float_embeddings', 'method': 'dynamic', 'weight_type': 'qint8',
+     'exclude_scopes': ['embeddings']},
+    {'name': 'static_minmax', 'method': 'static', 'calibration_method': 'minmax'},
+    {'name': 'static_minmax_per_channel', 'method': 'static', 'calibration_method': 'minmax', 'per_channel': True}
+]
+
+
+def build_variant(variant, quantize_config, output_dir, calibration_loader=None):
+    """
+    Builds one quantization variant of the exported model.
+
+    Args:
+        variant (dict): The variant. 'name' and 'method' ('fp32', 'dynamic' or 'static') are required; the other
+            keys override `quantize_config`, e.g. 'weight_type', 'per_channel', 'exclude_scopes' or
+            'calibration_method'.
+        quantize_config (dict): The quantization configuration with 'onnx_path' and optionally
+            'optimized_onnx_path'.
+        output_dir (str): Directory where the quantized model is saved.
+        calibration_loader (DataLoader, optional): Calibration batches, required for static variants.
+
+    Returns:
+        str: The file path of the variant's model.
+
+    Raises:
+        ValueError: If the method is not supported.
+    """
+    settings = {k: v for k, v in variant.items() if k not in ('name', 'method')}
+    variant_config = {**quantize_config, **settings}
+    output_path = os.path.join(output_dir, f"{variant['name']}.onnx")
+
+    if variant['method'] == 'fp32':
+        return quantization_input(quantize_config)
+    if variant['method'] == 'dynamic':
+        variant_config['quantized_onnx_path'] = output_path
+        dynamic_quantize(variant_config)
+    elif variant['method'] == 'static':
+        variant_config['static_quantized_onnx_path'] = output_path
+        static_quantize(variant_config, calibration_loader)
+    else:
+        raise ValueError(f"Unsupported quantization method {variant['method']}. Choose 'fp32', 'dynamic' or 'static'.")
+    return output_path
+
+
+def measure_latency(session, sample_batch, batch_sizes, iterations=20, warmup=3):
+    """
+    Measures the latency of an ONNX model at several batch sizes.
+
+    Args:
+        session (onnxruntime.InferenceSession): The session to benchmark.
+        sample_batch (dict): A batch with 'input_ids' and 'attention_mask' whose rows are repeated to build
+            each batch size. It is trimmed to its longest sequence.
+        batch_sizes (list of int): The batch sizes to measure.
+        iterations (int): Timed runs per batch size.
+        warmup (int): Untimed runs per batch size.
+
+    Returns:
+        dict: For each batch size, 'p50_ms' and 'p95_ms' latency per batch in milliseconds.
+    """
+    attention_mask = np.asarray(sample_batch['attention_mask'], dtype=np.int64)
+    length = max(int(attention_mask.sum(axis=1).max()), 1)
+    input_ids = np.asarray(sample_batch['input_ids'], dtype=np.int64)[:, :length]
+    attention_mask = attention_mask[:, :length]
+
+    latencies = {}
+    for batch_size in batch_sizes:
+        rows = np.arange(batch_size) % len(input_ids)
+        inputs = {"input_ids": input_ids[rows], "attention_mask": attention_mask[rows]}
+        for _ in range(warmup):
+            session.run(["logits"], inputs)
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            session.run(["logits"], inputs)
+            timings.append(1000 * (time.perf_counter() - start))
+        latencies[batch_size] = {'p50_ms': float(np.percentile(timings, 50)),
+                                 'p95_ms': float(np.percentile(timings, 95))}
+    return latencies
+
+
+def pareto_front(results):
+    """
+    Marks the variants that are Pareto-optimal in F1 (higher is better), model size and p95 latency at every
+    batch size (lower is better).
+
+    Args:
+        results (list of dict): Sweep results with 'f1', 'size_mb' and 'latency'.
+
+    Returns:
+        list of dict: The same results, each with a boolean 'pareto' key.
+    """
+    def objectives(result):
+        return [-result['f1'], result['size_mb']] + [latency['p95_ms'] for _, latency in
+                                                      sorted(result['latency'].items())]
+
+    for result in results:
+        own = objectives(result)
+        result['pareto'] = not any(
+            all(o <= s for o, s in zip(objectives(other), own)) and objectives(other) != own
+            for other in results if other is not result
+        )
+    return results
+
+
+def sweep(quantize_config, val_loader, variants=None, batch_sizes=(1, 8, 32), output_dir='quantization_sweep',
+          iterations=20, energy_meter=None):
+    """
+    Builds and benchmarks every quantization variant.
+
+    Args:
+        quantize_config (dict): The quantization configuration, the exported model must exist at 'onnx_path'.
+        val_loader (DataLoader): Validation batches, used for F1, latency inputs and static calibration.
+        variants (list of dict, optional): The variants, see `build_variant`. Defaults to DEFAULT_VARIANTS.
+        batch_sizes (list of int): Batch sizes for the latency measurements.
+        output_dir (str): Directory where the variant models are saved.
+        iterations (int): Timed runs per batch size.
+        energy_meter (EnergyMeter, optional): Measures the energy per prediction of the F1 evaluation.
+
+    Returns:
+        list of dict: One entry per variant with 'name', 'method', 'path', 'accuracy', 'f1', 'size_mb', 'latency'
+        and 'pareto', and 'joules_per_sample' with an energy meter.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    sample_batch = next(iter(val_loader))
+    results = []
+    for variant in variants or DEFAULT_VARIANTS:
+        print(f"Building variant {variant['name']}...")
+        path = build_variant(variant, quantize_config, output_dir, calibration_loader=val_loader)
+        session = InferenceSession(path, providers=["CPUExecutionProvider"])
+        accuracy, f1, _, _ = evaluate_onnx_model(session, val_loader, energy_meter=energy_meter)
+        results.append({
+            'name': variant['name'],
+            'method': variant['method'],
+            'path': path,
+            'accuracy': float(accuracy),
+            'f1': float(f1),
+            'size_mb': os.path.getsize(path) / 1e6,
+            'latency': measure_latency(session, sample_batch, batch_sizes, iterations)
+        })
+        if energy_meter is not None:
+            results[-1]['joules_per_sample'] = energy_meter.reports[-1]['joules_per_sample']
+    return pareto_front(results)
+
+
+def write_report(results, output_dir):
+    """
+    Writes the sweep results as JSON and as a Markdown table, Pareto-optimal variants marked with '*'.
+
+    Args:
+        results (list of dict): The results of `sweep`.
+        output_dir (str): Directory where 'report.json' and 'report.md' are written.
+
+    Returns:
+        str: The Markdown report.
+    """
+    batch_sizes = sorted(results[0]['latency']) if results else []
+    with_energy = any(result.get('joules_per_sample') is not None for result in results)
+    header = ['', 'variant', 'F1', 'accuracy', 'size (MB)'] + (['J/sample'] if with_energy else []) + \
+             [f"p50/p95 ms @ bs {batch_size}" for batch_size in batch_sizes]
+    lines = ['| ' + ' | '.join(header) + ' |', '|' + '---|' * len(header)]
+    for result in sorted(results, key=lambda r: (not r['pareto'], -r['f1'])):
+        row = ['*' if result['pareto'] else '', result['name'], f"{result['f1']:.4f}", f"{result['accuracy']:.4f}",
+               f"{result['size_mb']:.1f}"]
+        if with_energy:
+            row.append(f"{result['joules_per_sample']:.4f}" if result.get('joules_per_sample') is not None else '')
+        row += [f"{result['latency'][b]['p50_ms']:.1f} / {result['latency'][b]['p95_ms']:.1f}" for b in batch_sizes]
+        lines.append('| ' + ' | '.join(row) + ' |')
+    report = '\n'.join(lines) + '\n'
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'report.json'), 'w') as file:
+        json.dump(results, file, indent=2)
+    with open(os.path.join(output_dir, 'report.md'), 'w') as file:
+        file.write(report)
+    return report
+
+
+def run_quantization_sweep(config, quantize_config):
+    """
+    Exports the trained model if needed, sweeps the quantization variants and writes the report.
+
+    Args:
+        config (dict): The model configuration, with the keys used by `load_model_for_inference` and
+            `create_data_loader` ('valpath', 'val_label_col', 'tokenizer_model', 'max_length', 'batch_size'), and
+            optionally the 'energy_*' keys of `EnergyMeter.from_config`.
+        quantize_config (dict): The quantization configuration. In addition to the export keys:
+            - 'sweep_variants' (list of dict, optional): The variants, defaults to DEFAULT_VARIANTS.
+            - 'sweep_batch_sizes' (list of int, optional): Latency batch sizes, defaults to [1, 8, 32].
+            - 'sweep_iterations' (int, optional): Timed runs per batch size, defaults to 20.
+            - 'sweep_output_dir' (str, optional): Output directory, defaults to 'quantization_sweep'.
+
+    Returns:
+        list of dict: The results of `sweep`.
+    """
+    from model import load_model_for_inference
+    from data_prep import create_data_loader
+    from energy import EnergyMeter
+
+    if not os.path.exists(quantize_config['onnx_path']):
+        model = load_model_for_inference(config, 'cpu')
+        convert_to_onnx(model, {**config, 'tokenizer_name': config['tokenizer_model']}, quantize_config)
+    val_loader = create_data_loader(config['valpath'], config['val_label_col'], config['tokenizer_model'],
+                                    config['max_length'], config['batch_size'], shuffle=False)
+
+    output_dir = quantize_config.get('sweep_output_dir', 'quantization_sweep')
+    results = sweep(quantize_config, val_loader,
+                    variants=quantize_config.get('sweep_variants'),
+                    batch_sizes=quantize_config.get('sweep_batch_sizes', [1, 8, 32]),
+                    output_dir=output_dir,
+                    iterations=quantize_config.get('sweep_iterations', 20),
+                    energy_meter=EnergyMeter.from_config(config))
+    print(write_report(results, output_dir))
+    return results
+
+
+def main():
+    """
+    Command line entry point: `python src/quantize_sweep.py --config configs/config.yaml
+    --quantize-config configs/quantization_config.yaml`.
+    """
+    from config import load_config
+
+    parser = argparse.ArgumentParser(description="Sweep ONNX quantization variants and report the Pareto front.")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--quantize-config', default='configs/quantization_config.yaml')
+    args = parser.parse_args()
+    run_quantization_sweep(load_config(args.config), load_config(args.quantize_config))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent prediction requests into micro-batches.
+
+    Requests are queued and grouped until the batch holds `max_batch_size` texts or `max_wait_ms` has passed
+    since the first request of the batch arrived. A request that does not fit in the batch waits for the next
+    one; only a request larger than `max_batch_size` on its own runs as an oversized batch. Each batch runs through the predictor in a worker thread so
+    the event loop keeps accepting requests while the model runs.
+
+    Args:
+        predictor (BatchPredictor): Any object with a `predict_proba(texts)` method returning a NumPy array.
+        max_batch_size (int): Maximum number of texts per micro-batch.
+        max_wait_ms (float): Maximum time to wait for more requests after the first one, in milliseconds.
+        num_workers (int): Number of worker threads running batches.
+
+    Methods:
+        start():
+            Starts the batching loop. Must be awaited from the running event loop.
+
+        stop():
+            Stops the batching loop and the worker threads.
+
+        submit(texts):
+            Queues a request and returns its class probabilities once its batch has run.
+    """
+    def __init__(self, predictor, max_batch_size=32, max_wait_ms=5, num_workers=1):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.num_workers = num_workers
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.batches_run = 0
+        self._queue = None
+        self._held = deque()
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._batch_loop()) for _ in range(self.num_workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, texts):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((list(texts), future))
+        return await future
+
+    async def _collect_batch(self):
+        requests = [self._held.popleft() if self._held else await self._queue.get()]
+        size = len(requests[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                # Starts the next batch instead of overflowing this one
+                self._held.append(request)
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = await self._collect_batch()
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            try:
+                probabilities = await loop.run_in_executor(self.executor, self.predictor.predict_proba, texts)
+            except Exception as e:
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches_run += 1
+            start = 0
+            for request_texts, future in requests:
+                if not future.done():
+                    future.set_result(probabilities[start:start + len(request_texts)])
+                start += len(request_texts)
+
+
+def _response(status, payload):
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {reasons[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n")
+    return head.encode() + body
+
+
+async def _handle_request(batcher, method, path, body):
+    if method == 'GET' and path == '/health':
+        return 200, {'status': 'ok'}
+    if method != 'POST' or path != '/predict':
+        return 404, {'error': f"No route for {method} {path}"}
+    try:
+        payload = json.loads(body or b'{}')
+        texts = payload['texts'] if 'texts' in payload else [payload['text']]
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            raise ValueError("texts must be a list of strings")
+    except (ValueError, KeyError, TypeError) as e:
+        return 400, {'error': f"Expected a JSON body with 'text' or 'texts': {e}"}
+    try:
+        probabilities = await batcher.submit(texts)
+    except Exception as e:
+        return 500, {'error': str(e)}
+    predictions = [{'label': int(row.argmax()), 'probabilities': row.tolist()} for row in probabilities]
+    return 200, {'predictions': predictions}
+
+
+def make_connection_handler(batcher):
+    """
+    Creates the asyncio stream handler for the HTTP/1.1 API.
+
+    Routes:
+        GET /health: Returns {"status": "ok"}.
+        POST /predict: Takes {"text": str} or {"texts": [str, ...]} and returns
+            {"predictions": [{"label": int, "probabilities": [float, ...]}, ...]} in the request order.
+
+    Args:
+        batcher (MicroBatcher): The started micro-batcher.
+
+    Returns:
+        coroutine function: The handler for `asyncio.start_server`.
+    """
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, payload = await _handle_request(batcher, method, path, body)
+                writer.write(_response(status, payload))
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    return handle_connection
+
+
+async def start_server(batcher, host='127.0.0.1', port=8080):
+    """
+    Starts the micro-batcher and the HTTP server.
+
+    Args:
+        batcher (MicroBatcher): The micro-batcher.
+        host (str): Host to bind to.
+        port (int): Port to bind to. Use 0 to pick a free port.
+
+    Returns:
+        asyncio.Server: The running server. Its bound port is `server.sockets[0].getsockname()[1]`.
+    """
+    await batcher.start()
+    return await asyncio.start_server(make_connection_handler(batcher), host, port)
+
+
+class InferenceClient:
+    """
+    Minimal HTTP/1.1 client for the inference server, for local testing and load generation.
+
+    Args:
+        host (str): Server host.
+        port (int): Server port.
+
+    Methods:
+        predict(texts):
+            Sends the texts to POST /predict over a keep-alive connection and returns the decoded response.
+
+        request(method, path, payload=None):
+            Sends a request and returns the status code and the decoded JSON body.
+
+        close():
+            Closes the connection.
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def request(self, method, path, payload=None):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        self._writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body)
+        await self._writer.drain()
+
+        status = int((await self._reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        response_body = await self._reader.readexactly(int(headers.get('content-length', 0)))
+        return status, json.loads(response_body)
+
+    async def predict(self, texts):
+        status, payload = await self.request('POST', '/predict', {'texts': list(texts)})
+        if status != 200:
+            raise RuntimeError(f"Prediction request failed with status {status}: {payload.get('error')}")
+        return payload['predictions']
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+async def _serve_forever(predictor, config):
+    batcher = MicroBatcher(predictor,
+                           max_batch_size=config.get('serve_max_batch_size', 32),
+                           max_wait_ms=config.get('serve_max_wait_ms', 5),
+                           num_workers=config.get('serve_workers', 1))
+    server = await start_server(batcher, config.get('serve_host', '127.0.0.1'), config.get('serve_port', 8080))
+    print(f"Serving on {server.sockets[0].getsockname()}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+def main():
+    """
+    Command line entry point: `python src/serve.py --config configs/config.yaml [--backend onnx --onnx-path model.onnx]`.
+    """
+    from config import load_config
+    from inference import apply_autotuned_config, load_inference_predictor
+
+    parser = argparse.ArgumentParser(description="Serve the quote classifier over HTTP with dynamic micro-batching.")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch')
+    parser.add_argument('--onnx-path', help="ONNX model to serve with the onnx backend.")
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    config = apply_autotuned_config(load_config(args.config), args.backend)
+    predictor = load_inference_predictor(config, backend=args.backend, device=args.device, onnx_path=args.onnx_path)
+    asyncio.run(_serve_forever(predictor, config))
+
+
+if __name__ == '__main__':
+    main()
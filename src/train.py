@@ -1,9 +1,11 @@
 import os
+import time
 import torch
 from utils import calculate_f1_score
 from sklearn.metrics import accuracy_score
+from model import load_model_for_inference
 
-def train_one_epoch(model, train_loader, optimizer, device):
+def train_one_epoch(model, train_loader, optimizer, device, energy_meter=None):
     """
     Trains the model for one epoch using the provided data loader for training data and the optimizer.
 
@@ -12,6 +14,7 @@ def train_one_epoch(model, train_loader, optimizer, device):
         train_loader (torch.utils.data.DataLoader): The data loader providing training batches.
         optimizer (torch.optim.Optimizer): The optimizer used to update the model parameters.
         device (torch.device or str): The device to use for training (e.g., 'cpu' or 'cuda').
+        energy_meter (EnergyMeter, optional): Records the energy of the epoch and per training sample.
 
     Returns:
         tuple: A tuple containing the following metrics:
@@ -30,6 +33,7 @@ def train_one_epoch(model, train_loader, optimizer, device):
     
     """
     model.train()
+    reading = energy_meter.start() if energy_meter is not None else None
     train_loss = 0
     correct_train = 0
     total_train = 0
@@ -48,13 +52,15 @@ def train_one_epoch(model, train_loader, optimizer, device):
         total_train += batch['labels'].size(0)
         all_train_labels.extend(batch['labels'].cpu().numpy())
         all_train_preds.extend(predictions.cpu().numpy())
+    if energy_meter is not None:
+        energy_meter.stop(reading, samples=total_train, label='train_one_epoch')
     average_train_loss = train_loss / len(train_loader)
     train_accuracy = correct_train / total_train
     train_f1 = calculate_f1_score(all_train_labels, all_train_preds)
     return average_train_loss, train_accuracy, train_f1, all_train_labels, all_train_preds
 
 
-def validate_model(model, val_loader, device):
+def validate_model(model, val_loader, device, energy_meter=None):
     """
     Validates the model using the data loader for validation data.
     
@@ -62,6 +68,7 @@ def validate_model(model, val_loader, device):
         model (torch.nn.Module): The model to validate.
         val_loader (torch.utils.data.DataLoader): The data loader providing validation batches.
         device (torch.device or str): The device to use for validation (e.g., 'cpu' or 'cuda').
+        energy_meter (EnergyMeter, optional): Records the energy of the validation and per sample.
     
     Returns:
         tuple: A tuple containing the following metrics:
@@ -76,6 +83,7 @@ def validate_model(model, val_loader, device):
         
     """
     model.eval()
+    reading = energy_meter.start() if energy_meter is not None else None
     val_loss = 0
     correct_val = 0
     total_val = 0
@@ -91,19 +99,24 @@ def validate_model(model, val_loader, device):
             total_val += batch['labels'].size(0)
             all_val_labels.extend(batch['labels'].cpu().numpy())
             all_val_preds.extend(predictions.cpu().numpy())
+    if energy_meter is not None:
+        energy_meter.stop(reading, samples=total_val, label='validate_model')
     average_val_loss = val_loss / len(val_loader)
     val_accuracy = correct_val / total_val
     val_f1 = calculate_f1_score(all_val_labels, all_val_preds)
     return average_val_loss, val_accuracy, val_f1, all_val_labels, all_val_preds
 
-def test_model(model, test_loader, device):
+def test_model(model, test_loader, device, energy_meter=None):
     """
     Evaluates the model on the provided test data loader.
 
     Args:
         model (torch.nn.Module): The model to evaluate.
-        test_loader (torch.utils.data.DataLoader): The data loader providing test batches.
+        test_loader (torch.utils.data.DataLoader): The data loader providing test batches, either
+            (input_ids, attention_mask, labels) tuples or dictionaries with these keys as produced by
+            `create_data_loader`.
         device (torch.device or str): The device to use for evaluation (e.g., 'cpu' or 'cuda').
+        energy_meter (EnergyMeter, optional): Records the energy of the evaluation and per prediction.
 
     Returns:
         tuple: A tuple containing the following metrics:
@@ -115,9 +128,12 @@ def test_model(model, test_loader, device):
     """
     model.eval()
     model.to(device)
+    reading = energy_meter.start() if energy_meter is not None else None
     y_true, y_pred = [], []
     with torch.no_grad():
         for batch in test_loader:
+            if isinstance(batch, dict):
+                batch = (batch['input_ids'], batch['attention_mask'], batch['labels'])
             input_ids, attention_mask, labels = [x.to(device) for x in batch]
             outputs = model(input_ids, attention_mask=attention_mask)
             preds = torch.argmax(outputs.logits, dim=1)
@@ -125,9 +141,57 @@ def test_model(model, test_loader, device):
             y_true.extend(labels.cpu().numpy())
             y_pred.extend(preds.cpu().numpy())
 
+        if energy_meter is not None:
+            energy_meter.stop(reading, samples=len(y_true), label='test_model')
+        if not y_true:
+            print("Test set is empty.")
+            return 0.0, 0.0, y_true, y_pred
+
         accuracy = accuracy_score(y_true, y_pred)
         f1 = calculate_f1_score(y_true, y_pred)
         print(f"Test Accuracy: {accuracy:.4f}")
         print(f"Test F1 Score: {f1:.4f}")
 
-        return accuracy, f1, y_true, y_pred
\ No newline at end of file
+        return accuracy, f1, y_true, y_pred
+
+
+def compare_quantized_models(config, test_loader, device='cpu', quantizations=('dynamic_int8',), energy_meter=None):
+    """
+    Evaluates quantized variants of the trained model with `test_model` and compares them to fp32.
+
+    Args:
+        config (dict): The model configuration used by `load_model_for_inference`.
+        test_loader (torch.utils.data.DataLoader): The data loader providing test batches.
+        device (torch.device or str): The device to use for evaluation.
+        quantizations (list of str): Quantization options of `load_model_for_inference` to compare.
+        energy_meter (EnergyMeter, optional): Also compares the energy per prediction.
+
+    Returns:
+        list of dict: One entry per model, fp32 first, with 'quantization', 'accuracy', 'f1', 'seconds',
+        'speedup' and 'accuracy_delta' / 'f1_delta' versus fp32. With an energy meter, also 'joules_per_sample'
+        and 'co2_g_per_1k_samples'.
+    """
+    results = []
+    for quantization in [None, *quantizations]:
+        model = load_model_for_inference({**config, 'inference_quantization': None}, device,
+                                         quantization=quantization)
+        start = time.perf_counter()
+        accuracy, f1, _, _ = test_model(model, test_loader, device, energy_meter=energy_meter)
+        results.append({'quantization': quantization or 'fp32', 'accuracy': accuracy, 'f1': f1,
+                        'seconds': time.perf_counter() - start})
+        if energy_meter is not None:
+            energy = energy_meter.reports[-1]
+            results[-1].update(joules_per_sample=energy['joules_per_sample'],
+                               co2_g_per_1k_samples=energy['co2_g_per_1k_samples'])
+
+    baseline = results[0]
+    for result in results:
+        result['speedup'] = baseline['seconds'] / result['seconds']
+        result['accuracy_delta'] = result['accuracy'] - baseline['accuracy']
+        result['f1_delta'] = result['f1'] - baseline['f1']
+        line = (f"{result['quantization']}: accuracy {result['accuracy']:.4f} ({result['accuracy_delta']:+.4f}), "
+                f"F1 {result['f1']:.4f} ({result['f1_delta']:+.4f}), {result['speedup']:.2f}x speed")
+        if result.get('joules_per_sample') is not None:
+            line += f", {result['joules_per_sample']:.4f} J/sample"
+        print(line)
+    return results
@@ -1,4 +1,4 @@
-import matplotlib.pyplot as plt
+import os
 import numpy as np
 from sklearn.metrics import confusion_matrix, f1_score, precision_recall_curve, roc_curve, auc
 
@@ -14,6 +14,8 @@ def plot_loss(train_losses, val_losses, epochs):
     Returns:
         None
     """
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 5))
     plt.plot(range(1, epochs + 1), train_losses, label='Train Loss')
     plt.plot(range(1, epochs + 1), val_losses, label='Validation Loss')
@@ -35,6 +37,8 @@ def plot_accuracy(train_accuracies, val_accuracies, epochs):
     Returns:
         None
     """
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 5))
     plt.plot(range(1, epochs + 1), train_accuracies, label='Train Accuracy')
     plt.plot(range(1, epochs + 1), val_accuracies, label='Validation Accuracy')
@@ -56,6 +60,8 @@ def plot_confusion_matrix(true_labels, pred_labels, classes):
     Returns:
     None
     """
+    import matplotlib.pyplot as plt
+
     cm = confusion_matrix(true_labels, pred_labels)
     plt.figure(figsize=(10, 7))
     plt.imshow(cm, interpolation='nearest', cmap=plt.cm.Blues)
@@ -79,6 +85,8 @@ def plot_precision_recall(true_labels, pred_probs):
     Returns:
         None
     """
+    import matplotlib.pyplot as plt
+
     precision, recall, _ = precision_recall_curve(true_labels, pred_probs)
     plt.figure(figsize=(10, 5))
     plt.plot(recall, precision, marker='.')
@@ -98,6 +106,8 @@ def plot_roc_curve(true_labels, pred_probs):
     Returns:
     None: This function does not return anything. It displays the ROC curve plot.
     """
+    import matplotlib.pyplot as plt
+
     fpr, tpr, _ = roc_curve(true_labels, pred_probs)
     roc_auc = auc(fpr, tpr)
     plt.figure(figsize=(10, 5))
@@ -120,4 +130,38 @@ def calculate_f1_score(true_labels, pred_labels):
     Returns:
     float: The weighted F1 score.
     """
-    return f1_score(true_labels, pred_labels, average='weighted')
\ No newline at end of file
+    return f1_score(true_labels, pred_labels, average='weighted')
+
+def partition_cores(num_workers, threads_per_worker=None, cores=None):
+    """
+    Splits CPU cores into one contiguous set per worker, e.g. to pin worker processes.
+
+    Without `threads_per_worker` all cores are split into disjoint sets of nearly equal size; if there are more
+    workers than cores, each worker gets a single core and cores are shared round-robin. With
+    `threads_per_worker`, every worker gets that many consecutive cores (at most all of them), wrapping around
+    when the workers need more cores than there are.
+
+    Args:
+        num_workers (int): Number of workers.
+        threads_per_worker (int, optional): Number of cores per worker. Defaults to an even split.
+        cores (list of int, optional): The cores to split, defaults to the cores this process may run on.
+
+    Returns:
+        list of list of int: The cores of each worker.
+    """
+    if cores is None:
+        cores = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else range(os.cpu_count())
+    cores = sorted(cores)
+    if threads_per_worker:
+        threads_per_worker = min(threads_per_worker, len(cores))
+        return [[cores[(worker * threads_per_worker + j) % len(cores)] for j in range(threads_per_worker)]
+                for worker in range(num_workers)]
+    if num_workers > len(cores):
+        return [[cores[worker % len(cores)]] for worker in range(num_workers)]
+    per_worker, remainder = divmod(len(cores), num_workers)
+    partitions, start = [], 0
+    for worker in range(num_workers):
+        end = start + per_worker + (1 if worker < remainder else 0)
+        partitions.append(cores[start:end])
+        start = end
+    return partitions
@@ -0,0 +1,174 @@
+import os
+import json
+import numpy as np
+import torch
+import torch.nn as nn
+import pandas as pd
+from transformers import DistilBertTokenizer
+from model import load_model_for_inference
+
+
+def read_texts(filepath, text_column='quote'):
+    """
+    Reads the text column of a corpus file.
+
+    Args:
+        filepath (str): Path to a CSV, Parquet or JSONL file.
+        text_column (str): Name of the column containing the text.
+
+    Returns:
+        list of str: The texts in the file.
+
+    Raises:
+        ValueError: If the file type is not supported or the text column is not found.
+    """
+    if filepath.endswith('.csv'):
+        data = pd.read_csv(filepath)
+    elif filepath.endswith('.parquet'):
+        data = pd.read_parquet(filepath)
+    elif filepath.endswith('.jsonl'):
+        data = pd.read_json(filepath, lines=True)
+    else:
+        raise ValueError("Unsupported file type. Only CSV, Parquet and JSONL are supported.")
+    if text_column not in data.columns:
+        raise ValueError(f"Text column {text_column} not found in {filepath}.")
+    return data[text_column].astype(str).tolist()
+
+
+def build_reduced_vocab(tokenizer, texts, max_length=None):
+    """
+    Collects the token ids used by a corpus.
+
+    Args:
+        tokenizer (PreTrainedTokenizer): The original tokenizer.
+        texts (list of str): The training and expected-inference texts.
+        max_length (int, optional): Truncation length, so that only tokens the model can see are kept.
+
+    Returns:
+        list of int: Sorted ids of the original vocabulary to keep. Special tokens are always kept.
+    """
+    kept_ids = set(tokenizer.all_special_ids)
+    encodings = tokenizer(texts, truncation=max_length is not None, max_length=max_length)
+    for input_ids in encodings['input_ids']:
+        kept_ids.update(input_ids)
+    return sorted(kept_ids)
+
+
+class PrunedTokenizer:
+    """
+    Wraps a tokenizer so that it produces ids in the reduced vocabulary of a pruned model.
+    Word pieces that were pruned are mapped to the unknown token.
+
+    Args:
+        tokenizer (PreTrainedTokenizer): The original tokenizer.
+        kept_ids (list of int): Sorted ids of the original vocabulary kept in the pruned model.
+
+    Methods:
+        __call__(texts, **kwargs):
+            Tokenizes like the wrapped tokenizer and remaps `input_ids` to the reduced vocabulary.
+
+        save_pretrained(save_directory):
+            Saves the wrapped tokenizer and the kept ids.
+
+        from_pretrained(save_directory):
+            Loads a tokenizer saved with `save_pretrained`.
+    """
+    def __init__(self, tokenizer, kept_ids):
+        self.tokenizer = tokenizer
+        self.kept_ids = list(kept_ids)
+        self.unk_token_id = self.kept_ids.index(tokenizer.unk_token_id)
+        self.pad_token_id = self.kept_ids.index(tokenizer.pad_token_id)
+        self.id_map = torch.full((len(tokenizer),), self.unk_token_id, dtype=torch.long)
+        self.id_map[torch.tensor(self.kept_ids)] = torch.arange(len(self.kept_ids))
+
+    def __len__(self):
+        return len(self.kept_ids)
+
+    def __call__(self, texts, **kwargs):
+        encodings = self.tokenizer(texts, **kwargs)
+        input_ids = encodings['input_ids']
+        if isinstance(input_ids, torch.Tensor):
+            encodings['input_ids'] = self.id_map[input_ids]
+        elif isinstance(input_ids, np.ndarray):
+            encodings['input_ids'] = self.id_map.numpy()[input_ids]
+        elif input_ids and isinstance(input_ids[0], list):
+            encodings['input_ids'] = [self.id_map[ids].tolist() for ids in input_ids]
+        else:
+            encodings['input_ids'] = self.id_map[input_ids].tolist()
+        return encodings
+
+    def save_pretrained(self, save_directory):
+        self.tokenizer.save_pretrained(save_directory)
+        with open(os.path.join(save_directory, 'kept_ids.json'), 'w') as file:
+            json.dump(self.kept_ids, file)
+
+    @classmethod
+    def from_pretrained(cls, save_directory):
+        tokenizer = DistilBertTokenizer.from_pretrained(save_directory, do_lower_case=True)
+        with open(os.path.join(save_directory, 'kept_ids.json'), 'r') as file:
+            kept_ids = json.load(file)
+        return cls(tokenizer, kept_ids)
+
+
+def prune_embeddings(model, kept_ids):
+    """
+    Shrinks the word embedding matrix of a DistilBERT model to the kept ids, in place.
+
+    Args:
+        model (DistilBertForSequenceClassification): The trained model.
+        kept_ids (list of int): Sorted ids of the original vocabulary to keep.
+
+    Returns:
+        DistilBertForSequenceClassification: The same model with a reduced embedding matrix and `vocab_size`.
+    """
+    old_embeddings = model.distilbert.embeddings.word_embeddings
+    index = torch.tensor(kept_ids, device=old_embeddings.weight.device)
+    pad_token_id = kept_ids.index(model.config.pad_token_id)
+
+    new_embeddings = nn.Embedding(len(kept_ids), old_embeddings.embedding_dim, padding_idx=pad_token_id)
+    new_embeddings.weight.data = old_embeddings.weight.data[index].clone()
+    new_embeddings.weight.requires_grad = old_embeddings.weight.requires_grad
+    model.distilbert.embeddings.word_embeddings = new_embeddings
+
+    model.config.vocab_size = len(kept_ids)
+    model.config.pad_token_id = pad_token_id
+    return model
+
+
+def prune_model_vocabulary(config, device='cpu'):
+    """
+    Prunes the vocabulary of the trained model to the tokens used by the domain corpora and saves the pruned
+    weights and the matching tokenizer.
+
+    Args:
+        config (dict): Configuration dictionary. In addition to the keys required by `load_model_for_inference`:
+            - 'tokenizer_model' (str): Name or path of the original tokenizer.
+            - 'max_length' (int): Maximum length of the tokenized sequences.
+            - 'prune_corpus_paths' (list of str): Training and expected-inference corpora to scan.
+            - 'pruned_vocab_path' (str): Directory where the pruned tokenizer is saved.
+            - 'pruned_model_path' (str): File path where the pruned state dict is saved.
+        device (str or torch.device): The device to load the model onto.
+
+    Returns:
+        tuple: The pruned model (DistilBertForSequenceClassification) and its tokenizer (PrunedTokenizer).
+    """
+    tokenizer = DistilBertTokenizer.from_pretrained(config['tokenizer_model'], do_lower_case=True)
+    texts = []
+    for filepath in config['prune_corpus_paths']:
+        texts.extend(read_texts(filepath))
+
+    kept_ids = build_reduced_vocab(tokenizer, texts, config['max_length'])
+    print(f"Kept {len(kept_ids)} of {len(tokenizer)} tokens from {len(texts)} texts")
+
+    model = load_model_for_inference(config, device)
+    prune_embeddings(model, kept_ids)
+    pruned_tokenizer = PrunedTokenizer(tokenizer, kept_ids)
+
+    os.makedirs(config['pruned_vocab_path'], exist_ok=True)
+    pruned_tokenizer.save_pretrained(config['pruned_vocab_path'])
+    torch.save(model.state_dict(), config['pruned_model_path'])
+
+    original_size = os.path.getsize(config['trained_model_path']) / 1e6
+    pruned_size = os.path.getsize(config['pruned_model_path']) / 1e6
+    print(f"Pruned model saved at {config['pruned_model_path']} ({original_size:.1f} MB -> {pruned_size:.1f} MB)")
+    return model, pruned_tokenizer
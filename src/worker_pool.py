@@ -0,0 +1,297 @@
+import os
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from utils import partition_cores
+
+MEMORY_FIELDS = {'Rss': 'rss_mb', 'Pss': 'pss_mb', 'Shared_Clean': 'shared_mb', 'Shared_Dirty': 'shared_mb',
+                 'Private_Clean': 'private_mb', 'Private_Dirty': 'private_mb'}
+
+
+def memory_usage(pid='self'):
+    """
+    Reads the memory usage of a process from /proc/<pid>/smaps_rollup (Linux only).
+
+    Returns:
+        dict: 'rss_mb' (resident), 'shared_mb' (resident pages also mapped by other processes, e.g. weights
+        inherited copy-on-write), 'private_mb' (pages only this process maps) and 'pss_mb' (proportional set size,
+        shared pages divided among the processes mapping them), in MB. Empty if /proc is not available.
+    """
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as file:
+            for line in file:
+                name, _, value = line.partition(':')
+                if name in MEMORY_FIELDS:
+                    field = MEMORY_FIELDS[name]
+                    usage[field] = usage.get(field, 0.0) + int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return usage
+
+
+def _worker_main(worker_id, predictor, cores, num_threads, tasks, results):
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+    results.put((None, worker_id, None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, texts = task
+        try:
+            results.put((task_id, predictor.predict_proba(texts), None))
+        except Exception as error:
+            results.put((task_id, None, repr(error)))
+
+
+class InferencePool:
+    """
+    Runs a predictor in several worker processes that share one copy of the model weights.
+
+    The weights are loaded once in the parent process. Forked workers map the parent's pages copy-on-write, and
+    since inference never writes to the weights, the pages stay shared. Spawned workers receive weights that were
+    moved to shared memory with `share_memory`. Each worker is pinned to its own cores with a matching thread
+    count, and the texts of a call are split into chunks that the workers take from a common work queue.
+
+    Calls are thread-safe, so concurrent callers, e.g. the micro-batcher of the server, keep all workers busy.
+    If a worker dies, the pending calls and all later calls raise a RuntimeError until the pool is closed and
+    started again.
+
+    Args:
+        predictor (BatchPredictor): The predictor, e.g. from `load_predictor` with the PyTorch backend on the CPU.
+        num_workers (int): Number of worker processes.
+        threads_per_worker (int, optional): Intra-op threads per worker, defaults to the number of its cores.
+        pin_cores (bool): Pin each worker to a disjoint set of cores, see `partition_cores`.
+        start_method (str): 'fork' or 'spawn'.
+        chunk_size (int): Maximum number of texts per task.
+
+    Methods:
+        start():
+            Starts the workers and waits until they are ready.
+
+        predict_proba(texts):
+            Returns the class probabilities, a NumPy array of shape (len(texts), num_labels).
+
+        predict(texts):
+            Returns the predicted class ids, a NumPy array of shape (len(texts),).
+
+        memory_report():
+            Returns the memory usage of the parent and of each worker.
+
+        close():
+            Stops the workers.
+    """
+    def __init__(self, predictor, num_workers=2, threads_per_worker=None, pin_cores=True, start_method='fork',
+                 chunk_size=256):
+        if num_workers < 1:
+            raise ValueError("The inference pool needs at least one worker.")
+        self.predictor = predictor
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.pin_cores = pin_cores
+        self.chunk_size = chunk_size
+        self._context = mp.get_context(start_method)
+        self._processes = []
+        self._futures = {}
+        self._next_task_id = 0
+        self._lock = threading.Lock()
+        self._collector = None
+        self._error = None
+
+    def start(self):
+        if self._processes:
+            return self
+        self._error = None
+        if self._context.get_start_method() != 'fork':
+            # Spawned workers would otherwise receive a pickled copy of the weights
+            self.predictor.backend.model.share_memory()
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        partitions = partition_cores(self.num_workers) if self.pin_cores and hasattr(os, 'sched_getaffinity') \
+            else [None] * self.num_workers
+        for worker_id, cores in enumerate(partitions):
+            num_threads = self.threads_per_worker or (len(cores) if cores else 1)
+            process = self._context.Process(target=_worker_main, daemon=True,
+                                            args=(worker_id, self.predictor, cores, num_threads,
+                                                  self._tasks, self._results))
+            process.start()
+            self._processes.append(process)
+
+        ready = 0
+        while ready < self.num_workers:
+            try:
+                task_id, _, _ = self._results.get(timeout=1)
+            except queue.Empty:
+                if any(not process.is_alive() for process in self._processes):
+                    self.close()
+                    raise RuntimeError("An inference worker exited during startup.")
+                continue
+            ready += task_id is None
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        return self
+
+    def _collect(self):
+        while True:
+            try:
+                task_id, probabilities, error = self._results.get(timeout=1)
+            except queue.Empty:
+                if not self._processes:
+                    return
+                if any(not process.is_alive() for process in self._processes):
+                    self._fail_all(RuntimeError("An inference worker exited unexpectedly."))
+                    return
+                continue
+            if task_id is None:
+                return
+            with self._lock:
+                future = self._futures.pop(task_id, None)
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(probabilities)
+            else:
+                future.set_exception(RuntimeError(f"Inference worker failed: {error}"))
+
+    def _fail_all(self, error):
+        with self._lock:
+            # Later calls raise the error instead of queuing tasks that nobody collects
+            self._error = error
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.set_exception(error)
+
+    def predict_proba(self, texts):
+        texts = list(texts)
+        if not texts:
+            return self.predictor.predict_proba([])
+        if not self._processes:
+            raise RuntimeError("The inference pool is not started.")
+        futures = []
+        for start in range(0, len(texts), self.chunk_size):
+            future = Future()
+            with self._lock:
+                if self._error is not None:
+                    raise RuntimeError(str(self._error))
+                task_id = self._next_task_id
+                self._next_task_id += 1
+                self._futures[task_id] = future
+            self._tasks.put((task_id, texts[start:start + self.chunk_size]))
+            futures.append(future)
+        return np.concatenate([future.result() for future in futures])
+
+    def predict(self, texts):
+        return np.argmax(self.predict_proba(texts), axis=1)
+
+    def memory_report(self):
+        return {'parent': memory_usage(),
+                'workers': [memory_usage(process.pid) for process in self._processes]}
+
+    def close(self):
+        if not self._processes:
+            return
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        # A killed worker can die holding a queue lock, so the feeder threads may never flush. The collector also
+        # stops without the sentinel once there are no processes left.
+        self._tasks.cancel_join_thread()
+        self._results.cancel_join_thread()
+        self._results.put((None, None, None))
+        if self._collector is not None:
+            self._collector.join()
+            self._collector = None
+        self._fail_all(RuntimeError("The inference pool was closed."))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_inference_pool(config):
+    """
+    Loads the model once with `load_predictor` (PyTorch backend on the CPU) and creates an InferencePool.
+
+    Args:
+        config (dict): Configuration dictionary with the keys used by `load_predictor` and optionally:
+            - 'pool_workers' (int): Number of worker processes, defaults to 2.
+            - 'pool_threads_per_worker' (int): Threads per worker, defaults to the number of its cores.
+            - 'pool_pin_cores' (bool): Pin the workers to disjoint cores, defaults to True.
+            - 'pool_start_method' (str): 'fork' (default) or 'spawn'.
+            - 'pool_chunk_size' (int): Maximum number of texts per task, defaults to 256.
+
+    Returns:
+        InferencePool: The pool, not started yet.
+    """
+    from predict import load_predictor
+
+    predictor = load_predictor(config, backend='torch', device='cpu')
+    return InferencePool(predictor,
+                         num_workers=config.get('pool_workers', 2),
+                         threads_per_worker=config.get('pool_threads_per_worker'),
+                         pin_cores=config.get('pool_pin_cores', True),
+                         start_method=config.get('pool_start_method', 'fork'),
+                         chunk_size=config.get('pool_chunk_size', 256))
+
+
+def benchmark_pool(config, texts, worker_counts):
+    """
+    Measures the throughput and the memory usage of the pool for several worker counts.
+
+    Args:
+        config (dict): Configuration dictionary for `load_inference_pool`.
+        texts (list of str): The texts to classify.
+        worker_counts (list of int): The worker counts to measure.
+
+    Returns:
+        list of dict: For each worker count, 'workers', 'texts_per_second' and the 'memory' report.
+    """
+    results = []
+    for num_workers in worker_counts:
+        with load_inference_pool({**config, 'pool_workers': num_workers}) as pool:
+            pool.predict_proba(texts[:pool.chunk_size * num_workers])
+            start = time.perf_counter()
+            pool.predict_proba(texts)
+            seconds = time.perf_counter() - start
+            results.append({'workers': num_workers, 'texts_per_second': len(texts) / seconds,
+                            'memory': pool.memory_report()})
+        workers = results[-1]['memory']['workers']
+        private = max((usage.get('private_mb', 0.0) for usage in workers), default=0.0)
+        print(f"{num_workers} workers: {results[-1]['texts_per_second']:.1f} texts/s, "
+              f"parent RSS {results[-1]['memory']['parent'].get('rss_mb', 0.0):.0f} MB, "
+              f"max private memory per worker {private:.0f} MB")
+    return results
+
+
+def main():
+    """
+    Command line entry point: `python src/worker_pool.py --config configs/config.yaml --workers 1 2 4`.
+    Benchmarks the pool on the quotes of config['valpath'].
+    """
+    from config import load_config
+    from data_prep import read_data
+
+    parser = argparse.ArgumentParser(description="Benchmark multi-process inference with shared model weights.")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+    config = load_config(args.config)
+    texts = read_data(config['valpath'], config['val_label_col'])['quote'].tolist()
+    benchmark_pool(config, texts, args.workers)
+
+
+if __name__ == '__main__':
+    main()
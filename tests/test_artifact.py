@@ -0,0 +1,72 @@
+import os
+import pytest
+import torch
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+from src.artifact import ARTIFACT_WEIGHTS, save_model_artifact, load_model_artifact, load_artifact_tokenizer
+from src.model import load_model_for_inference
+from src.predict import load_predictor
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'the', 'climate', 'is', 'changing', 'not', 'warming', 'sun']
+
+
+@pytest.fixture
+def trained_model():
+    model_config = DistilBertConfig(vocab_size=len(VOCAB), dim=16, hidden_dim=32, n_layers=2, n_heads=2, num_labels=2)
+    return DistilBertForSequenceClassification(model_config).eval()
+
+
+@pytest.fixture
+def tokenizer(tmpdir):
+    vocab_path = str(tmpdir.join('vocab.txt'))
+    with open(vocab_path, 'w') as file:
+        file.write('\n'.join(VOCAB))
+    return DistilBertTokenizer(vocab_path, do_lower_case=True)
+
+
+# Test 1: The artifact reproduces the model and tokenizer without the pretrained checkpoint
+def test_artifact_round_trip(trained_model, tokenizer, tmpdir, mocker):
+    artifact_dir = str(tmpdir.join('artifact'))
+    save_model_artifact(trained_model, tokenizer, artifact_dir)
+    from_pretrained = mocker.spy(DistilBertForSequenceClassification, 'from_pretrained')
+
+    model = load_model_artifact(artifact_dir)
+    loaded_tokenizer = load_artifact_tokenizer(artifact_dir)
+
+    from_pretrained.assert_not_called()
+    assert not any(tensor.is_meta for tensor in list(model.parameters()) + list(model.buffers()))
+    encodings = loaded_tokenizer(["The climate is changing", "the sun"], padding=True, return_tensors='pt')
+    assert torch.equal(encodings['input_ids'],
+                       tokenizer(["The climate is changing", "the sun"], padding=True, return_tensors='pt')['input_ids'])
+    with torch.no_grad():
+        assert torch.equal(model(**encodings).logits, trained_model(**encodings).logits)
+
+
+# Test 2: fp16 artifacts halve the weights and stay close to the fp32 model
+def test_artifact_fp16(trained_model, tokenizer, tmpdir):
+    fp32_dir, fp16_dir = str(tmpdir.join('fp32')), str(tmpdir.join('fp16'))
+    save_model_artifact(trained_model, tokenizer, fp32_dir)
+    save_model_artifact(trained_model, tokenizer, fp16_dir, fp16=True)
+
+    assert os.path.getsize(os.path.join(fp16_dir, ARTIFACT_WEIGHTS)) < \
+        0.6 * os.path.getsize(os.path.join(fp32_dir, ARTIFACT_WEIGHTS))
+    model = load_model_artifact(fp16_dir)
+    assert model.classifier.weight.dtype == torch.float16
+    upcast = load_model_artifact(fp16_dir, dtype=torch.float32)
+    input_ids = torch.randint(0, len(VOCAB), (3, 7))
+    with torch.no_grad():
+        assert torch.allclose(upcast(input_ids).logits, trained_model(input_ids).logits, atol=1e-2)
+
+
+# Test 3: The inference entry points read the artifact instead of the checkpoint and tokenizer names
+def test_load_from_artifact_config(trained_model, tokenizer, tmpdir):
+    artifact_dir = str(tmpdir.join('artifact'))
+    save_model_artifact(trained_model, tokenizer, artifact_dir, fp16=True)
+    config = {'model_artifact_path': artifact_dir, 'tokenizer_model': 'not-available', 'max_length': 16}
+
+    model = load_model_for_inference(config, 'cpu', quantization='dynamic_int8')
+    assert isinstance(model.classifier, torch.ao.nn.quantized.dynamic.Linear)
+    assert not any(param.requires_grad for param in model.parameters())
+
+    predictor = load_predictor(config)
+    probabilities = predictor.predict_proba(["the climate is warming", "not the sun"])
+    assert probabilities.shape == (2, 2)
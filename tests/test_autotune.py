@@ -0,0 +1,66 @@
+import pytest
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+from src.artifact import save_model_artifact
+from src.autotune import autotune, candidate_settings, settings_to_config, write_autotuned_config
+from src.inference import apply_autotuned_config, load_inference_predictor
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'the', 'climate', 'is', 'changing', 'not', 'warming', 'sun']
+TEXTS = ["the climate is changing", "not the sun", "warming", "the sun is not warming the climate " * 3] * 8
+
+
+@pytest.fixture
+def inference_config(tmpdir):
+    vocab_path = str(tmpdir.join('vocab.txt'))
+    with open(vocab_path, 'w') as file:
+        file.write('\n'.join(VOCAB))
+    model_config = DistilBertConfig(vocab_size=len(VOCAB), dim=16, hidden_dim=32, n_layers=2, n_heads=2, num_labels=3)
+    save_model_artifact(DistilBertForSequenceClassification(model_config), DistilBertTokenizer(vocab_path),
+                        str(tmpdir.join('artifact')))
+    return {'model_artifact_path': str(tmpdir.join('artifact')), 'tokenizer_model': 'unused', 'max_length': 32,
+            'pool_pin_cores': False}
+
+
+# Test 1: The search never oversubscribes the cores, and settings map to the keys of the inference path
+def test_candidate_settings():
+    settings = candidate_settings(token_budgets=[1024, 4096], cores=6)
+    assert {(s['threads'], s['workers']) for s in settings} == {(1, 1), (2, 1), (4, 1), (6, 1), (1, 2), (2, 2),
+                                                               (1, 4), (1, 6)}
+    assert len(settings) == 16
+
+    assert settings_to_config('torch', {'token_budget': 1024, 'threads': 4, 'workers': 1}) == {
+        'token_budget': 1024, 'serve_workers': 1, 'inference_threads': 4, 'pool_workers': None,
+        'pool_threads_per_worker': None}
+    assert settings_to_config('torch', {'token_budget': 1024, 'threads': 2, 'workers': 2})['pool_workers'] == 2
+    assert settings_to_config('onnx', {'token_budget': 2048, 'threads': 2, 'workers': 3}) == {
+        'token_budget': 2048, 'serve_workers': 3, 'session_intra_op_threads': 2, 'session_inter_op_threads': 1,
+        'session_pool_size': 3}
+
+
+# Test 2: The fastest setting meeting the SLO is chosen, or the lowest latency if none meets it
+def test_autotune_torch(inference_config):
+    settings = [{'token_budget': 32, 'threads': 1, 'workers': 1}, {'token_budget': 4096, 'threads': 1, 'workers': 1},
+                {'token_budget': 4096, 'threads': 1, 'workers': 2}]
+
+    report = autotune(inference_config, TEXTS, settings=settings, latency_slo_ms=1e6, request_size=8, verbose=0)
+    assert len(report['results']) == 3 and all(result['meets_slo'] for result in report['results'])
+    assert report['best']['texts_per_second'] == max(result['texts_per_second'] for result in report['results'])
+
+    report = autotune(inference_config, TEXTS, settings=settings[:2], latency_slo_ms=0, request_size=8, verbose=0)
+    assert not report['best']['meets_slo']
+    assert report['best']['p95_ms'] == min(result['p95_ms'] for result in report['results'])
+    with pytest.raises(ValueError):
+        autotune(inference_config, TEXTS, backend='onnx')
+
+
+# Test 3: The written settings are consumed by the inference path of the same backend only
+def test_autotuned_config_is_applied(inference_config, tmpdir):
+    path = str(tmpdir.join('tuned', 'autotuned.yaml'))
+    best = {'token_budget': 512, 'threads': 1, 'workers': 1, 'texts_per_second': 100.0, 'p50_ms': 1.0,
+            'p95_ms': 2.0, 'meets_slo': True}
+    write_autotuned_config(path, 'torch', best, latency_slo_ms=50)
+    config = {**inference_config, 'autotuned_config_path': path, 'token_budget': 8192}
+
+    assert apply_autotuned_config(config, 'torch')['token_budget'] == 512
+    assert apply_autotuned_config(config, 'onnx') is config
+    assert apply_autotuned_config(inference_config, 'torch') is inference_config
+    assert load_inference_predictor(config).token_budget == 512
@@ -0,0 +1,53 @@
+import numpy as np
+from benchmarks.bench_inference import benchmark_backend, build_models, compare_to_baseline, synthetic_corpus
+
+TINY_MODEL = {'dim': 16, 'hidden_dim': 32, 'n_layers': 2, 'n_heads': 2, 'num_labels': 3}
+
+
+def _results(p95_ms, texts_per_second, peak_rss_mb):
+    return {'backends': {'torch': {'load_s': 1.0, 'peak_rss_mb': peak_rss_mb, 'runs': [
+        {'threads': 1, 'batch_size': 8, 'p50_ms': p95_ms / 2, 'p95_ms': p95_ms, 'p99_ms': p95_ms,
+         'texts_per_second': texts_per_second}]}}}
+
+
+# Test 1: The synthetic corpus has a realistic, long-tailed length distribution and is reproducible
+def test_synthetic_corpus():
+    texts = synthetic_corpus(2000, median_words=30, sigma=0.6, max_words=250, seed=1)
+    lengths = np.array([len(text.split()) for text in texts])
+
+    assert len(texts) == 2000
+    assert 25 <= np.median(lengths) <= 35
+    assert np.percentile(lengths, 99) > 2 * np.median(lengths)
+    assert lengths.min() >= 3 and lengths.max() <= 250
+    assert synthetic_corpus(2000, seed=1) == texts
+    assert synthetic_corpus(2000, seed=2) != texts
+
+
+# Test 2: Slower, lower throughput or larger runs beyond the tolerance are flagged, unmatched settings are skipped
+def test_compare_to_baseline():
+    baseline = _results(p95_ms=10.0, texts_per_second=800.0, peak_rss_mb=500.0)
+
+    assert compare_to_baseline(_results(11.0, 700.0, 550.0), baseline, tolerance=0.2) == []
+    regressions = compare_to_baseline(_results(13.0, 600.0, 700.0), baseline, tolerance=0.2)
+    assert sorted(r['metric'] for r in regressions) == ['p95_ms', 'peak_rss_mb', 'texts_per_second']
+    assert all(r['backend'] == 'torch' for r in regressions)
+
+    unmatched = _results(100.0, 1.0, 500.0)
+    unmatched['backends']['torch']['runs'][0]['threads'] = 4
+    assert compare_to_baseline(unmatched, baseline) == []
+    assert compare_to_baseline(_results(100.0, 1.0, 5000.0), {'backends': {}}) == []
+
+
+# Test 3: Every backend is benchmarked offline on a tiny random model
+def test_benchmark_backends(tmpdir):
+    model_config = build_models(str(tmpdir), TINY_MODEL, max_length=32)
+    texts = synthetic_corpus(50, median_words=10)
+
+    for backend in ('torch', 'onnx_fp32', 'onnx_int8'):
+        result = benchmark_backend(backend, model_config, texts, batch_sizes=[1, 4], threads=[1], iterations=3,
+                                   warmup=1)
+        assert [(run['threads'], run['batch_size']) for run in result['runs']] == [(1, 1), (1, 4)]
+        for run in result['runs']:
+            assert 0 < run['p50_ms'] <= run['p95_ms'] <= run['p99_ms']
+            assert run['texts_per_second'] > 0
+        assert result['peak_rss_mb'] > 0 and result['load_s'] > 0
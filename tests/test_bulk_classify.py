@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from transformers import DistilBertConfig, DistilBertForSequenceClassification
+from src.bulk_classify import CHECKPOINT_FILE, classify_file, input_format
+from src.predict import BatchPredictor, TorchBackend, WordPieceTokenizer
+
+WORDS = ['the', 'climate', 'is', 'changing', 'not', 'warming', 'sun', 'has', 'always', 'changed', '.']
+
+
+class FlakyPredictor:
+    """Counts the classified chunks and fails on one of them."""
+    def __init__(self, predictor, fail_on=None):
+        self.predictor = predictor
+        self.fail_on = fail_on
+        self.calls = 0
+
+    def encode(self, texts):
+        return self.predictor.encode(texts)
+
+    def predict_proba_encoded(self, input_ids):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError("worker lost")
+        return self.predictor.predict_proba_encoded(input_ids)
+
+
+@pytest.fixture
+def predictor(tmpdir):
+    vocab_path = str(tmpdir.join('vocab.txt'))
+    with open(vocab_path, 'w') as file:
+        file.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + WORDS))
+    model_config = DistilBertConfig(vocab_size=16, dim=16, hidden_dim=32, n_layers=2, n_heads=2, num_labels=3)
+    model = DistilBertForSequenceClassification(model_config).eval()
+    return BatchPredictor(TorchBackend(model), WordPieceTokenizer(vocab_path), max_length=32)
+
+
+@pytest.fixture
+def quotes():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame({'id': np.arange(300) + 1000,
+                         'quote': [' '.join(rng.choice(WORDS, rng.integers(1, 20))) for _ in range(300)]})
+    data.loc[7, 'quote'] = None
+    return data
+
+
+# Test 1: Parquet, JSONL and CSV inputs are streamed into shards matching the predictor
+@pytest.mark.parametrize("extension", ['parquet', 'jsonl', 'csv'])
+def test_classify_file(predictor, quotes, tmpdir, extension):
+    input_path = str(tmpdir.join(f'quotes.{extension}'))
+    if extension == 'parquet':
+        quotes.to_parquet(input_path, row_group_size=100)
+    elif extension == 'jsonl':
+        quotes.to_json(input_path, orient='records', lines=True)
+    else:
+        quotes.to_csv(input_path, index=False)
+    output_dir = str(tmpdir.join('output'))
+
+    checkpoint = classify_file(predictor, input_path, output_dir, keep_columns=['id'], chunk_size=64, verbose=0)
+
+    output = pd.read_parquet(output_dir)
+    expected = predictor.predict_proba(quotes['quote'].fillna('').tolist())
+    assert checkpoint['finished'] and checkpoint['rows'] == 300 and checkpoint['shards'] == 5
+    assert len(os.listdir(output_dir)) == 6
+    assert output['row'].tolist() == list(range(300))
+    assert output['id'].tolist() == quotes['id'].tolist()
+    np.testing.assert_allclose(np.stack(output['probabilities'].to_numpy()), expected, atol=1e-6)
+    assert output['label'].tolist() == expected.argmax(axis=1).tolist()
+
+
+# Test 2: An interrupted job resumes after the last written shard
+def test_classify_file_resume(predictor, quotes, tmpdir):
+    input_path = str(tmpdir.join('quotes.parquet'))
+    quotes.to_parquet(input_path)
+    output_dir = str(tmpdir.join('output'))
+
+    with pytest.raises(RuntimeError, match="worker lost"):
+        classify_file(FlakyPredictor(predictor, fail_on=3), input_path, output_dir, chunk_size=64, verbose=0)
+    assert sorted(os.listdir(output_dir)) == [CHECKPOINT_FILE, 'part-000000.parquet', 'part-000001.parquet']
+
+    resumed = FlakyPredictor(predictor)
+    classify_file(resumed, input_path, output_dir, chunk_size=64, verbose=0)
+    assert resumed.calls == 3
+    output = pd.read_parquet(output_dir)
+    assert output['row'].tolist() == list(range(300))
+    np.testing.assert_allclose(np.stack(output['probabilities'].to_numpy()),
+                               predictor.predict_proba(quotes['quote'].fillna('').tolist()), atol=1e-6)
+
+    finished = FlakyPredictor(predictor)
+    classify_file(finished, input_path, output_dir, chunk_size=64, verbose=0)
+    assert finished.calls == 0
+    with pytest.raises(ValueError):
+        classify_file(predictor, input_path, output_dir, chunk_size=32, verbose=0)
+
+
+# Test 3: Unsupported files and missing columns are rejected
+def test_classify_file_invalid_input(predictor, quotes, tmpdir):
+    assert input_format('archive/quotes.jsonl.gz') == 'jsonl'
+    with pytest.raises(ValueError):
+        input_format('quotes.xlsx')
+    input_path = str(tmpdir.join('quotes.csv'))
+    quotes.to_csv(input_path, index=False)
+    with pytest.raises(ValueError):
+        classify_file(predictor, input_path, str(tmpdir.join('output')), text_column='text', verbose=0)
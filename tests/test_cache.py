@@ -0,0 +1,69 @@
+import numpy as np
+from src.cache import normalize_text, model_fingerprint, PredictionCache, CachedPredictor
+
+class CountingPredictor:
+    """Returns probabilities derived from the text length and records every text it classifies."""
+    def __init__(self):
+        self.seen = []
+
+    def predict_proba(self, texts):
+        self.seen.extend(texts)
+        probabilities = np.zeros((len(texts), 3), dtype=np.float32)
+        probabilities[np.arange(len(texts)), [len(text) % 3 for text in texts]] = 1.0
+        return probabilities
+
+# Test 1: Retweets, case and whitespace variants normalize to the same text.
+def test_normalize_text():
+    assert normalize_text('RT @skeptic:  The Sun is  warming\nthe planet ') == 'the sun is warming the planet'
+    assert normalize_text('The sun is warming the planet') == 'the sun is warming the planet'
+
+# Test 2: The fingerprint changes with the weights and with the settings.
+def test_model_fingerprint(tmpdir):
+    weights = tmpdir.join('model.pth')
+    weights.write_binary(b'weights v1')
+    first = model_fingerprint(str(weights), max_length=365)
+
+    assert model_fingerprint(str(weights), max_length=128) != first
+    weights.write_binary(b'weights v2')
+    assert model_fingerprint(str(weights), max_length=365) != first
+
+# Test 3: Repeated and duplicate texts are only classified once and results keep the request order.
+def test_cached_predictor_skips_repeated_texts():
+    predictor = CountingPredictor()
+    cached = CachedPredictor(predictor, PredictionCache('v1'))
+
+    first = cached.predict_proba(['Ice is melting', 'ice is  melting', 'hoax'])
+    second = cached.predict_proba(['hoax', 'RT @a: ice is melting'])
+
+    assert predictor.seen == ['Ice is melting', 'hoax']
+    assert np.array_equal(first, CountingPredictor().predict_proba(['Ice is melting', 'Ice is melting', 'hoax']))
+    assert np.array_equal(second, first[[2, 0]])
+    assert cached.cache.stats()['hits'] == 2
+    assert cached.cache.stats()['misses'] == 2
+
+# Test 4: The LRU evicts the least recently used entry and entries expire after the TTL.
+def test_lru_and_ttl_eviction():
+    cache = PredictionCache('v1', max_size=2)
+    cache.put_many({'a': [1.0], 'b': [2.0]})
+    cache.get_many(['a'])
+    cache.put_many({'c': [3.0]})
+    assert set(cache.get_many(['a', 'b', 'c'])) == {'a', 'c'}
+
+    expiring = PredictionCache('v1', ttl=-1)
+    expiring.put_many({'a': [1.0]})
+    assert expiring.get_many(['a']) == {}
+
+# Test 5: The persistent tier is shared between cache instances, and the fingerprint separates model versions.
+def test_persistent_tier(tmpdir):
+    db_path = str(tmpdir.join('cache', 'predictions.db'))
+    writer = PredictionCache('v1', db_path=db_path)
+    writer.put_many({writer.key('hoax'): [0.1, 0.9]})
+    writer.close()
+
+    reader = PredictionCache('v1', db_path=db_path)
+    found = reader.get_many([reader.key('Hoax')])
+    assert np.allclose(found[reader.key('hoax')], [0.1, 0.9])
+    assert reader.stats()['disk_hits'] == 1
+
+    other_model = PredictionCache('v2', db_path=db_path)
+    assert other_model.get_many([other_model.key('hoax')]) == {}
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+from src.artifact import save_model_artifact
+from src.cascade import (CascadePredictor, choose_threshold, evaluate_cascade, fast_proba, save_fast_model,
+                         train_fast_model, write_report)
+from src.inference import load_inference_predictor
+
+KEYWORDS = {0: 'hoax fraud scam', 2: 'sun solar cycle', 3: 'volcano natural cycle'}
+FILLER = ['the', 'climate', 'is', 'not', 'warming', 'it', 'was', 'always', 'changing', 'data']
+
+
+def make_data(num_texts, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = rng.choice(sorted(KEYWORDS), num_texts)
+    texts = [' '.join(list(rng.choice(FILLER, 6)) + [KEYWORDS[label]]) for label in labels]
+    return texts, labels
+
+
+class OneHotPredictor:
+    """Stands in for DistilBERT: always right, and records the texts of each call."""
+    def __init__(self, texts, labels, num_labels=4):
+        self.labels = dict(zip(texts, labels))
+        self.num_labels = num_labels
+        self.calls = []
+
+    def predict_proba(self, texts):
+        self.calls.append(list(texts))
+        return np.eye(self.num_labels, dtype=np.float32)[[self.labels[text] for text in texts]]
+
+
+@pytest.fixture(scope='module')
+def fast_model():
+    return train_fast_model(*make_data(90))
+
+
+# Test 1: The fast model gives calibrated probabilities aligned with the class ids, even for unseen classes
+def test_fast_model(fast_model):
+    texts, labels = make_data(30, seed=1)
+    probabilities = fast_proba(fast_model, texts, num_labels=4)
+
+    assert probabilities.shape == (30, 4)
+    np.testing.assert_allclose(probabilities.sum(axis=1), 1, atol=1e-5)
+    assert np.all(probabilities[:, 1] == 0)
+    assert (probabilities.argmax(axis=1) == labels).mean() > 0.9
+    assert fast_proba(fast_model, [], num_labels=4).shape == (0, 4)
+
+
+# Test 2: Only texts below the threshold are escalated, together in one call, and get the model's answer
+def test_cascade_routing(fast_model):
+    texts, labels = make_data(20, seed=2)
+    texts += ["the climate is always changing", "data"]
+    labels = np.append(labels, [1, 1])
+    model = OneHotPredictor(texts, labels)
+
+    cascade = CascadePredictor(fast_model, model, threshold=0.0, num_labels=4)
+    cascade.predict_proba(texts)
+    assert model.calls == [] and cascade.escalation_rate() == 0.0
+
+    cascade = CascadePredictor(fast_model, model, threshold=0.9, num_labels=4)
+    probabilities, escalated = cascade.route(texts)
+    confidence = fast_proba(fast_model, texts, 4).max(axis=1)
+    np.testing.assert_array_equal(escalated, confidence < 0.9)
+    assert escalated[-2:].all()
+    assert model.calls == [[text for text, e in zip(texts, escalated) if e]]
+    np.testing.assert_array_equal(cascade.predict(texts[-2:]), [1, 1])
+    assert cascade.escalated == escalated.sum() + 2
+
+    cascade = CascadePredictor(fast_model, model, threshold=1.01, num_labels=4)
+    np.testing.assert_array_equal(cascade.predict(texts), labels)
+    assert cascade.escalation_rate() == 1.0
+
+
+# Test 3: The threshold chooser keeps the F1 within the allowed drop with the fewest escalations
+def test_evaluate_and_choose_threshold(fast_model, tmpdir):
+    texts, labels = make_data(40, seed=3)
+    texts += [f"the climate {word}" for word in FILLER]
+    labels = np.append(labels, [1] * len(FILLER))
+    results = evaluate_cascade(fast_model, OneHotPredictor(texts, labels), texts, labels,
+                               thresholds=[0.5, 0.9, 0.99], num_labels=4)
+
+    by_name = {result['name']: result for result in results}
+    assert set(by_name) == {'fast', 'model', 'cascade@0.5', 'cascade@0.9', 'cascade@0.99'}
+    assert by_name['model']['f1'] == 1.0 and by_name['model']['escalation_rate'] == 1.0
+    assert by_name['fast']['escalation_rate'] == 0.0 and by_name['fast']['f1'] < 1.0
+    rates = [by_name[name]['escalation_rate'] for name in ('cascade@0.5', 'cascade@0.9', 'cascade@0.99')]
+    assert rates == sorted(rates)
+
+    chosen = choose_threshold(results, max_f1_drop=0.0)
+    assert chosen['f1'] == 1.0
+    assert all(r['escalation_rate'] >= chosen['escalation_rate'] for r in results
+               if r['name'].startswith('cascade') and r['f1'] == 1.0)
+    report = write_report(results, str(tmpdir), chosen)
+    assert f"| * | {chosen['name']} |" in report
+    assert tmpdir.join('cascade_report.json').exists()
+
+
+# Test 4: The inference path puts the cascade in front of the model when enabled
+def test_load_inference_predictor_with_cascade(fast_model, tmpdir):
+    vocab_path = str(tmpdir.join('vocab.txt'))
+    with open(vocab_path, 'w') as file:
+        file.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + FILLER))
+    model_config = DistilBertConfig(vocab_size=15, dim=16, hidden_dim=32, n_layers=2, n_heads=2, num_labels=4)
+    save_model_artifact(DistilBertForSequenceClassification(model_config), DistilBertTokenizer(vocab_path),
+                        str(tmpdir.join('artifact')))
+    save_fast_model(fast_model, str(tmpdir.join('fast.joblib')))
+    config = {'model_artifact_path': str(tmpdir.join('artifact')), 'tokenizer_model': 'unused', 'max_length': 16,
+              'num_labels': 4, 'cascade_enabled': True, 'cascade_model_path': str(tmpdir.join('fast.joblib')),
+              'cascade_threshold': 0.9}
+
+    predictor = load_inference_predictor(config)
+    assert type(predictor).__name__ == 'CascadePredictor'
+    assert predictor.predict_proba(["the climate is hoax fraud scam", "data"]).shape == (2, 4)
+    assert predictor.escalated >= 1
@@ -1,4 +1,5 @@
 import pytest
+import torch
 from hyperoptim import objective
 from src.config import load_config
 
@@ -9,6 +10,7 @@ def mock_trial(mocker):
     mock_trial.suggest_float.side_effect = [0.001, 0.1, 0.9]
     mock_trial.suggest_int.side_effect = [2, 10, 5]
     mock_trial.suggest_categorical.side_effect = [32]
+    mock_trial.should_prune.return_value = False
     return mock_trial
 
 # This fixture will mock the data loaders.
@@ -23,8 +25,9 @@ def mock_data_loaders(mocker):
 # This fixture will mock the model.
 @pytest.fixture
 def mock_model(mocker):
-    mock_load_model = mocker.patch('hyperoptim.load_model')
+    mock_load_model = mocker.patch('hyperoptim.load_model_for_finetuning')
     mock_model = mocker.MagicMock()
+    mock_model.parameters.return_value = [torch.nn.Parameter(torch.zeros(1))]
     mock_load_model.return_value = mock_model
     return mock_model
 
@@ -33,8 +36,8 @@ def mock_model(mocker):
 def mock_train_validate(mocker):
     mock_train_one_epoch = mocker.patch('hyperoptim.train_one_epoch')
     mock_validate_model = mocker.patch('hyperoptim.validate_model')
-    mock_train_one_epoch.return_value = (0.5, 0.8, 0.7)
-    mock_validate_model.return_value = (0.4, 0.85, 0.75)
+    mock_train_one_epoch.return_value = (0.5, 0.8, 0.7, [], [])
+    mock_validate_model.return_value = (0.4, 0.85, 0.75, [], [])
     return mock_train_one_epoch, mock_validate_model
 
 # This test will check if the objective function returns the best validation accuracy.
@@ -59,7 +62,7 @@ def test_objective(mock_trial, mock_data_loaders, mock_model, mock_train_validat
         'learning_rate': {'range': (1e-5, 1e-3), 'log': True},
         'num_trainable_layers': {'range': (1, 12)},
         'dropout_rate': {'range': (0.1, 0.5)},
-        'batch_size': {'range': [16, 32, 64]},
+        'batch_size': {'values': [16, 32, 64]},
         'epochs': {'range': (1, 10)},
         'step_size': {'range': (1, 10)},
         'gamma': {'range': (0.1, 0.9)}
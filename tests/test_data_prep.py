@@ -1,8 +1,9 @@
 import pytest
+import torch
 import pandas as pd
 from transformers import DistilBertTokenizer
 from torch.utils.data import DataLoader
-from src.data_prep import read_data, process_labels, QuotesDataset, encode_data, create_data_loader
+from src.data_prep import read_data, process_labels, QuotesDataset, encode_data, create_data_loader, truncate_dataset, stratified_subset
 
 # Fixture for csv and parquet data, paths, and tokenizer. 
 @pytest.fixture
@@ -73,4 +74,25 @@ def test_create_data_loader(setup_data):
     _, csv_path, _, _, _ = setup_data
     dataloader = create_data_loader(csv_path, 'label', 'distilbert-base-uncased', max_length=10, batch_size=2, shuffle=False)
     assert isinstance(dataloader, DataLoader)
-    assert len(dataloader.dataset) == 2
\ No newline at end of file
+    assert len(dataloader.dataset) == 2
+
+# Test 8: That the function truncates sequences and ends the cut ones with the separator token.
+def test_truncate_dataset():
+    encodings = {
+        'input_ids': torch.tensor([[101, 5, 6, 7, 102], [101, 5, 102, 0, 0]]),
+        'attention_mask': torch.tensor([[1, 1, 1, 1, 1], [1, 1, 1, 0, 0]])
+    }
+    dataset = truncate_dataset(QuotesDataset(encodings, [0, 1]), max_length=3, sep_token_id=102)
+    assert dataset.encodings['input_ids'].tolist() == [[101, 5, 102], [101, 5, 102]]
+    assert dataset.encodings['attention_mask'].tolist() == [[1, 1, 1], [1, 1, 1]]
+    assert dataset.labels == [0, 1]
+
+# Test 9: That the function samples a fraction of every class.
+def test_stratified_subset():
+    encodings = {'input_ids': torch.zeros((8, 4), dtype=torch.long), 'attention_mask': torch.ones((8, 4), dtype=torch.long)}
+    dataset = QuotesDataset(encodings, [0, 0, 0, 0, 1, 1, 1, 1])
+    subset = stratified_subset(dataset, 0.5)
+    labels = [dataset.labels[idx] for idx in subset.indices]
+    assert len(subset) == 4
+    assert labels.count(0) == labels.count(1) == 2
+    assert subset.indices == stratified_subset(dataset, 0.5).indices
@@ -0,0 +1,106 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+from transformers import DistilBertConfig, DistilBertForSequenceClassification
+from src.early_exit import (EarlyExitDistilBert, load_early_exit_model, save_exit_heads, train_exit_heads,
+                            evaluate_early_exit)
+
+# Fixture for a small randomly initialized model saved locally, so no download is needed
+@pytest.fixture
+def mock_config(tmpdir):
+    model_config = DistilBertConfig(vocab_size=100, dim=32, hidden_dim=64, n_layers=4, n_heads=2,
+                                    max_position_embeddings=64, num_labels=3)
+    model = DistilBertForSequenceClassification(model_config)
+    model.save_pretrained(str(tmpdir.join('base')))
+    torch.save(model.state_dict(), str(tmpdir.join('trained_model.pth')))
+    return {
+        'model_name': str(tmpdir.join('base')),
+        'num_labels': 3,
+        'trained_model_path': str(tmpdir.join('trained_model.pth')),
+        'exit_layers': [1, 2, 3],
+        'exit_threshold': 0.9,
+        'exit_heads_path': str(tmpdir.join('exit_heads.pth'))
+    }
+
+class DictDataset(TensorDataset):
+    def __getitem__(self, idx):
+        input_ids, attention_mask, labels = super().__getitem__(idx)
+        return {'input_ids': input_ids, 'attention_mask': attention_mask, 'labels': labels}
+
+@pytest.fixture
+def mock_loader():
+    input_ids = torch.randint(5, 100, (6, 12))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[0, 8:] = 0
+    labels = torch.randint(0, 3, (6,))
+    return DataLoader(DictDataset(input_ids, attention_mask, labels), batch_size=3)
+
+# Test 1: Without exiting early, the logits match the base model.
+def test_full_depth_matches_base_model(mock_config):
+    model = load_early_exit_model(mock_config, 'cpu')
+    input_ids = torch.randint(5, 100, (2, 10))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, 6:] = 0
+
+    with torch.no_grad():
+        logits, layers = model(input_ids, attention_mask, threshold=1.1)
+        expected = model.model(input_ids, attention_mask=attention_mask).logits
+
+    assert torch.allclose(logits, expected, atol=1e-5)
+    assert (layers == 4).all()
+
+# Test 2: A threshold of 0 exits every sample at the first exit head.
+def test_zero_threshold_exits_at_first_head(mock_config):
+    model = load_early_exit_model(mock_config, 'cpu')
+    input_ids = torch.randint(5, 100, (3, 10))
+
+    with torch.no_grad():
+        logits, layers = model(input_ids, torch.ones_like(input_ids), threshold=0.0)
+
+    assert logits.shape == (3, 3)
+    assert (layers == 1).all()
+
+# Test 3: Exit heads default to every layer except the last.
+def test_default_exit_layers(mock_config):
+    base = DistilBertForSequenceClassification.from_pretrained(mock_config['model_name'])
+    model = EarlyExitDistilBert(base)
+    assert model.exit_layers == [1, 2, 3]
+
+# Test 4: Post hoc training only updates the exit heads and the saved heads are reloaded.
+def test_train_exit_heads_post_hoc(mock_config, mock_loader):
+    with pytest.warns(UserWarning, match="Exit heads not found"):
+        model = load_early_exit_model(mock_config, 'cpu')
+    assert model.threshold == float('inf')
+    backbone_before = model.model.classifier.weight.clone()
+    optimizer = torch.optim.AdamW(model.exit_heads.parameters(), lr=1e-2)
+
+    loss = train_exit_heads(model, mock_loader, optimizer, 'cpu')
+
+    assert isinstance(loss, float)
+    assert torch.equal(model.model.classifier.weight, backbone_before)
+    save_exit_heads(model, mock_config['exit_heads_path'])
+    reloaded = load_early_exit_model(mock_config, 'cpu')
+    assert torch.equal(reloaded.exit_heads['1'].weight, model.exit_heads['1'].weight)
+    assert reloaded.threshold == 0.9
+
+# Test 5: The threshold report contains one entry per threshold.
+def test_evaluate_early_exit(mock_config, mock_loader):
+    model = load_early_exit_model(mock_config, 'cpu')
+    results = evaluate_early_exit(model, mock_loader, 'cpu', thresholds=[0.0, 1.1])
+
+    assert len(results) == 2
+    assert results[0]['avg_layers'] == 1
+    assert results[1]['avg_layers'] == 4
+    for result in results:
+        assert 0 <= result['accuracy'] <= 1
+        assert result['latency_ms'] > 0
+
+# Test 6: Joint training also updates the backbone.
+def test_train_exit_heads_joint(mock_config, mock_loader):
+    model = load_early_exit_model(mock_config, 'cpu')
+    backbone_before = model.model.distilbert.transformer.layer[0].attention.q_lin.weight.clone()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-2)
+
+    train_exit_heads(model, mock_loader, optimizer, 'cpu', joint=True)
+
+    assert not torch.equal(model.model.distilbert.transformer.layer[0].attention.q_lin.weight, backbone_before)
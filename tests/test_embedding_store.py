@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+import torch
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+from src.embedding_store import Embedder, EmbeddingStore, add_corpus, embed_texts, nearest_labeled
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'the', 'climate', 'is', 'changing', 'not', 'warming', 'sun']
+TEXTS = ["the climate is changing", "not the sun", "warming", "the sun is not warming the climate",
+         "climate climate climate", "is it the sun"]
+
+
+def random_unit_vectors(num_vectors, dim, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(num_vectors, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def embedder(tmpdir):
+    vocab_path = str(tmpdir.join('vocab.txt'))
+    with open(vocab_path, 'w') as file:
+        file.write('\n'.join(VOCAB))
+    torch.manual_seed(0)
+    model_config = DistilBertConfig(vocab_size=len(VOCAB), dim=16, hidden_dim=32, n_layers=2, n_heads=2, num_labels=3)
+    model = DistilBertForSequenceClassification(model_config).eval()
+    return Embedder(model, DistilBertTokenizer(vocab_path), max_length=16, token_budget=24)
+
+
+# Test 1: Batched embeddings match one text at a time, and known quotes are read back instead of encoded
+def test_embedder_and_known_texts(embedder, tmpdir):
+    embeddings = embedder.embed(TEXTS)
+    assert embeddings.shape == (len(TEXTS), 16)
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1, atol=1e-5)
+    for text, embedding in zip(TEXTS, embeddings):
+        np.testing.assert_allclose(embedder.embed([text])[0], embedding, atol=1e-5)
+
+    store = EmbeddingStore(str(tmpdir.join('store')), dim=16)
+    assert add_corpus(store, embedder, TEXTS[:4], ids=range(4), labels=[0, 1, 2, 1]) == 4
+    assert add_corpus(store, embedder, TEXTS, ids=range(6)) == 2
+    calls, embed = [], embedder.embed
+    embedder.embed = lambda texts: calls.append(list(texts)) or embed(texts)
+    vectors, known = embed_texts(store, embedder, ["  The Climate is CHANGING ", "the sun"])
+    assert known.tolist() == [True, False] and calls == [["the sun"]]
+    np.testing.assert_allclose(vectors[0], embeddings[0], atol=1e-2)
+
+    neighbours = nearest_labeled(store, embedder, ["not the sun"], k=3)[0]
+    _, rows = store.search(embed_texts(store, embedder, ["not the sun"])[0], k=3)
+    assert [neighbour['id'] for neighbour in neighbours] == store.ids(rows[0])
+    labels = {'0': 0, '1': 1, '2': 2, '3': 1, '4': None, '5': None}
+    assert all(neighbour['label'] == labels[neighbour['id']] for neighbour in neighbours)
+
+
+# Test 2: Exact blockwise search returns the true top-k, the store survives reopening and rejects mismatches
+def test_exact_search_and_persistence(tmpdir):
+    path = str(tmpdir.join('store'))
+    vectors = random_unit_vectors(500, 8)
+    store = EmbeddingStore(path, dim=8, fingerprint='model-a')
+    store.add([f"q{i}" for i in range(300)], [f"text {i}" for i in range(300)], vectors[:300])
+    store.add([f"q{i}" for i in range(300, 500)], [f"text {i}" for i in range(300, 500)], vectors[300:],
+              labels=[i % 3 for i in range(300, 500)])
+    with pytest.raises(ValueError):
+        store.add(['q0'], ['duplicate'], vectors[:1])
+    store.close()
+    # An add interrupted before the row count was committed is rolled back
+    with open(tmpdir.join('store', 'embeddings.f16'), 'ab') as file:
+        file.write(b'\0' * 100)
+
+    store = EmbeddingStore(path)
+    assert len(store) == 500 and store.vectors.dtype == np.float16
+    assert tmpdir.join('store', 'embeddings.f16').size() == 500 * 8 * 2
+    queries = random_unit_vectors(5, 8, seed=1)
+    scores, rows = store.search(queries, k=7, block_size=64)
+    expected = np.argsort(-(queries @ store.vectors.astype(np.float32).T), axis=1)[:, :7]
+    np.testing.assert_array_equal(rows, expected)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+    assert store.ids([0, 499]) == ['q0', 'q499'] and store.labels([0, 499]) == [None, 1]
+    assert store.rows_for_ids(['q7', 'missing']).tolist() == [7, -1]
+    assert store.rows_for_texts(['TEXT 3']).tolist() == [3]
+
+    scores, rows = EmbeddingStore(str(tmpdir.join('empty')), dim=8).search(queries, k=3)
+    assert np.all(rows == -1) and np.all(np.isneginf(scores))
+    with pytest.raises(ValueError):
+        EmbeddingStore(path, dim=4)
+    with pytest.raises(ValueError):
+        EmbeddingStore(path, fingerprint='model-b')
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmpdir.join('missing')))
+
+
+# Test 3: The approximate index finds most true neighbours, also of rows added after it was built
+def test_ivf_search(tmpdir):
+    centers = random_unit_vectors(20, 16, seed=2)
+    noise = np.random.default_rng(3).normal(scale=0.1, size=(2000, 16)).astype(np.float32)
+    vectors = centers[np.arange(2000) % 20] + noise
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    store = EmbeddingStore(str(tmpdir.join('store')), dim=16)
+    store.add(range(1900), [f"text {i}" for i in range(1900)], vectors[:1900])
+    store.build_ivf(num_lists=20)
+    store.add(range(1900, 2000), [f"text {i}" for i in range(1900, 2000)], vectors[1900:])
+
+    queries = vectors[[3, 1950]] + np.random.default_rng(4).normal(scale=0.01, size=(2, 16)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    _, exact = store.search(queries, k=10)
+    _, approximate = store.search(queries, k=10, nprobe=3)
+    recall = np.mean([len(set(a) & set(e)) / 10 for a, e in zip(approximate, exact)])
+    assert recall >= 0.8
+    assert 1950 in approximate[1]
+    assert EmbeddingStore(str(tmpdir.join('store'))).ivf is not None
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import torch
+from unittest.mock import MagicMock
+from src.energy import EnergyMeter, rapl_packages
+from src.quantize import evaluate_onnx_model
+from src.train import test_model as evaluate_test_model
+
+
+def write_counter(root, name, microjoules, max_range=10**9):
+    domain = root.join(name)
+    domain.ensure(dir=True)
+    domain.join('energy_uj').write(str(microjoules))
+    domain.join('max_energy_range_uj').write(str(max_range))
+    return domain
+
+
+# Test 1: The package counters are read and summed, and wraparounds are handled
+def test_energy_meter_rapl(tmpdir):
+    write_counter(tmpdir, 'intel-rapl:0', 5 * 10**6)
+    write_counter(tmpdir, 'intel-rapl:0:0', 0)
+    write_counter(tmpdir, 'intel-rapl:1', 10**9 - 10**6)
+    meter = EnergyMeter(rapl_root=str(tmpdir))
+    assert meter.source == 'rapl'
+    assert rapl_packages(str(tmpdir)) == [str(tmpdir.join('intel-rapl:0')), str(tmpdir.join('intel-rapl:1'))]
+
+    reading = meter.start()
+    tmpdir.join('intel-rapl:0', 'energy_uj').write(str(8 * 10**6))
+    tmpdir.join('intel-rapl:1', 'energy_uj').write(str(10**6))
+    report = meter.stop(reading, samples=100, label='inference')
+
+    assert report['joules'] == pytest.approx(3 + 2)
+    assert report['joules_per_sample'] == pytest.approx(0.05)
+    assert report['co2_g_per_1k_samples'] == pytest.approx(5 / 3.6e6 * 475 * 10)
+    assert meter.reports == [report]
+    assert EnergyMeter(rapl_root=str(tmpdir.join('missing'))).source == 'estimate'
+
+
+# Test 2: Without RAPL the energy is estimated from the elapsed and CPU time
+def test_energy_meter_estimate():
+    meter = EnergyMeter(idle_watts=2.0, watts_per_core=10.0, carbon_intensity=100.0, use_rapl=False)
+    reading = meter.start()
+    matrix = torch.randn(256, 256)
+    for _ in range(50):
+        matrix = torch.tanh(matrix @ matrix)
+    report = meter.stop(reading)
+
+    assert report['source'] == 'estimate'
+    assert report['cpu_seconds'] > 0
+    assert report['joules'] == pytest.approx(2.0 * report['seconds'] + 10.0 * report['cpu_seconds'])
+    assert report['co2_g'] == pytest.approx(report['joules'] / 3.6e6 * 100.0)
+    assert report['joules_per_sample'] is None
+    assert 'run:' in meter.summary()
+
+
+# Test 3: The evaluation loops record one report per call with the number of samples
+def test_energy_meter_evaluation_loops():
+    meter = EnergyMeter(use_rapl=False)
+    model = MagicMock()
+    model.return_value.logits = torch.tensor([[0.9, 0.1], [0.2, 0.8], [0.6, 0.4]])
+    batch = {'input_ids': torch.ones(3, 4, dtype=torch.long), 'attention_mask': torch.ones(3, 4, dtype=torch.long),
+             'labels': torch.tensor([0, 1, 1])}
+    evaluate_test_model(model, [batch, batch], 'cpu', energy_meter=meter)
+
+    session = MagicMock()
+    session.run.return_value = [np.array([[0.9, 0.1], [0.2, 0.8], [0.6, 0.4]], dtype=np.float32)]
+    evaluate_onnx_model(session, [batch], verbose=0, energy_meter=meter)
+
+    assert [(report['label'], report['samples']) for report in meter.reports] == \
+        [('test_model', 6), ('evaluate_onnx_model', 3)]
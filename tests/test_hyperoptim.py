@@ -1,6 +1,11 @@
 import pytest
+import optuna
+import torch
+import pandas as pd
+from transformers import DistilBertConfig, DistilBertForSequenceClassification
 from unittest.mock import patch, MagicMock
-from hyperoptim import objective
+from hyperoptim import objective, create_pruner, run_study, StudyContext, fidelity_schedule, compute_savings
+from utils import partition_cores
 
 # This fixture will mock the Trial object from Optuna.
 @pytest.fixture
@@ -9,6 +14,7 @@ def mock_trial():
         mock_trial.suggest_float.side_effect = [0.001, 0.1, 0.9]
         mock_trial.suggest_int.side_effect = [2, 10, 5]
         mock_trial.suggest_categorical.side_effect = [32]
+        mock_trial.should_prune.return_value = False
         yield mock_trial
 
 # This fixture will mock the data loaders.
@@ -23,8 +29,9 @@ def mock_data_loaders():
 # This fixture will mock the model.
 @pytest.fixture
 def mock_model():
-    with patch('hyperoptim.load_model') as mock_load_model:
+    with patch('hyperoptim.load_model_for_finetuning') as mock_load_model:
         mock_model = MagicMock()
+        mock_model.parameters.return_value = [torch.nn.Parameter(torch.zeros(1))]
         mock_load_model.return_value = mock_model
         yield mock_model
 
@@ -33,8 +40,8 @@ def mock_model():
 def mock_train_validate():
     with patch('hyperoptim.train_one_epoch') as mock_train_one_epoch, \
          patch('hyperoptim.validate_model') as mock_validate_model:
-        mock_train_one_epoch.return_value = (0.5, 0.8, 0.7)
-        mock_validate_model.return_value = (0.4, 0.85, 0.75)
+        mock_train_one_epoch.return_value = (0.5, 0.8, 0.7, [], [])
+        mock_validate_model.return_value = (0.4, 0.85, 0.75, [], [])
         yield mock_train_one_epoch, mock_validate_model
 
 # This test will check if the objective function returns the best validation accuracy.
@@ -59,7 +66,7 @@ def test_objective(mock_trial, mock_data_loaders, mock_model, mock_train_validat
         'learning_rate': {'range': (1e-5, 1e-3), 'log': True},
         'num_trainable_layers': {'range': (1, 12)},
         'dropout_rate': {'range': (0.1, 0.5)},
-        'batch_size': {'range': [16, 32, 64]},
+        'batch_size': {'values': [16, 32, 64]},
         'epochs': {'range': (1, 10)},
         'step_size': {'range': (1, 10)},
         'gamma': {'range': (0.1, 0.9)}
@@ -70,4 +77,182 @@ def test_objective(mock_trial, mock_data_loaders, mock_model, mock_train_validat
     assert best_val_accuracy == 0.85
     mock_train_one_epoch.assert_called()
     mock_validate_model.assert_called()
-    mock_model.to.assert_called()
\ No newline at end of file
+    mock_model.to.assert_called()
+
+
+# Common configs for the pruning tests
+CONFIG = {
+    "trainpath": "train.csv",
+    "train_label_col": "label",
+    "valpath": "val.csv",
+    "val_label_col": "label",
+    "tokenizer_model": "distilbert-base-uncased",
+    "max_length": 128,
+    "batch_size": 16,
+}
+
+HYPEROPTIM_CONFIG = {
+    'learning_rate': {'range': (1e-5, 1e-3), 'log': True},
+    'num_trainable_layers': {'range': (1, 12)},
+    'dropout_rate': {'range': (0.1, 0.5)},
+    'batch_size': {'values': [16, 32, 64]},
+    'epochs': {'range': (1, 10)},
+    'step_size': {'range': (1, 10)},
+    'gamma': {'range': (0.1, 0.9)}
+}
+
+# This test will check that the suggested hyperparameters are used instead of the ones in config.
+def test_objective_uses_suggestions(mock_trial, mock_data_loaders, mock_model, mock_train_validate):
+    with patch('hyperoptim.create_data_loader') as mock_create_data_loader, \
+         patch('hyperoptim.load_model_for_finetuning', return_value=mock_model) as mock_load_model, \
+         patch('hyperoptim.AdamW') as mock_adamw, \
+         patch('hyperoptim.lr_scheduler.StepLR') as mock_step_lr:
+        objective(CONFIG, HYPEROPTIM_CONFIG, mock_trial)
+
+    assert mock_create_data_loader.call_args_list[0].args[4] == 32
+    assert mock_load_model.call_args.args[0]['num_trainable_layers'] == 2
+    assert mock_load_model.call_args.args[0]['dropout_rate'] == 0.1
+    assert mock_adamw.call_args.kwargs['lr'] == 0.001
+    assert mock_step_lr.call_args.kwargs == {'step_size': 5, 'gamma': 0.9}
+
+# This test will check that the validation accuracy is reported every epoch and pruned trials stop early.
+def test_objective_pruned(mock_trial, mock_data_loaders, mock_model, mock_train_validate):
+    mock_train_one_epoch, _ = mock_train_validate
+    mock_trial.should_prune.return_value = True
+
+    with pytest.raises(optuna.TrialPruned):
+        objective(CONFIG, HYPEROPTIM_CONFIG, mock_trial)
+
+    mock_trial.report.assert_called_once_with(0.85, 0)
+    assert mock_train_one_epoch.call_count == 1
+
+# This test will check that the pruners declared in the config are created.
+@pytest.mark.parametrize('pruner_config, pruner_class', [
+    (None, optuna.pruners.MedianPruner),
+    ({'type': 'median', 'n_warmup_steps': 1}, optuna.pruners.MedianPruner),
+    ({'type': 'successive_halving', 'min_resource': 1}, optuna.pruners.SuccessiveHalvingPruner),
+    ({'type': 'hyperband', 'min_resource': 1, 'max_resource': 5}, optuna.pruners.HyperbandPruner),
+    ({'type': 'none'}, optuna.pruners.NopPruner),
+])
+def test_create_pruner(pruner_config, pruner_class):
+    assert isinstance(create_pruner({'pruner': pruner_config}), pruner_class)
+
+# This test will check that an unknown pruner type raises a ValueError.
+def test_create_pruner_invalid_type():
+    with pytest.raises(ValueError):
+        create_pruner({'pruner': {'type': 'unknown'}})
+
+# This test will check that a persisted study resumes without rerunning finished trials.
+@pytest.mark.parametrize('storage_file', ['study.db', 'study.log'])
+def test_run_study_resumes(tmpdir, storage_file):
+    hyperoptim_config = dict(HYPEROPTIM_CONFIG,
+                             num_trials=3,
+                             study_name='test',
+                             storage_path=str(tmpdir.join(storage_file)),
+                             pruner={'type': 'none'})
+
+    with patch('hyperoptim.StudyContext'), \
+         patch('hyperoptim.objective', side_effect=lambda config, hyperoptim_config, trial, context: trial.suggest_float('x', 0, 1)) as mock_objective:
+        study = run_study(CONFIG, hyperoptim_config)
+        assert len(study.trials) == 3
+
+        run_study(CONFIG, dict(hyperoptim_config, num_trials=5))
+        assert mock_objective.call_count == 5
+
+# This test will check that a study whose trials were all pruned still returns.
+def test_run_study_all_trials_pruned(capsys):
+    hyperoptim_config = dict(HYPEROPTIM_CONFIG, num_trials=2, pruner={'type': 'none'})
+
+    with patch('hyperoptim.StudyContext'), patch('hyperoptim.objective', side_effect=optuna.TrialPruned):
+        study = run_study(CONFIG, hyperoptim_config)
+
+    assert len(study.trials) == 2
+    assert "no trial completed" in capsys.readouterr().out
+
+# This test will check that parallel search without a persistent store is rejected.
+def test_run_study_parallel_needs_storage():
+    with pytest.raises(ValueError):
+        run_study(CONFIG, dict(HYPEROPTIM_CONFIG, num_trials=2, n_workers=2))
+
+# This test will check that workers get disjoint core sets.
+def test_partition_cores(mocker):
+    mocker.patch('os.sched_getaffinity', return_value={0, 1, 2, 3, 4, 5, 6, 7})
+    assert partition_cores(2) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert partition_cores(4, threads_per_worker=1) == [[0], [1], [2], [3]]
+
+# This fixture will create small local data, tokenizer and pretrained model files so no download is needed.
+@pytest.fixture
+def local_config(tmpdir):
+    tokenizer_dir = tmpdir.mkdir('tokenizer')
+    tokenizer_dir.join('vocab.txt').write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'climate', 'is', 'real']) + '\n')
+    model_config = DistilBertConfig(vocab_size=8, dim=16, hidden_dim=32, n_layers=2, n_heads=2, max_position_embeddings=32)
+    DistilBertForSequenceClassification(model_config).save_pretrained(str(tmpdir.join('pretrained')))
+    data = pd.DataFrame({'quote': ['climate is real', 'climate', 'is real', 'real'], 'label': [0, 1, 0, 1]})
+    data.to_csv(str(tmpdir.join('train.csv')), index=False)
+    data.to_csv(str(tmpdir.join('val.csv')), index=False)
+    return dict(CONFIG,
+                trainpath=str(tmpdir.join('train.csv')),
+                valpath=str(tmpdir.join('val.csv')),
+                tokenizer_model=str(tokenizer_dir),
+                model_name=str(tmpdir.join('pretrained')),
+                max_length=8,
+                num_labels=2,
+                total_layers=2)
+
+# This test will check that the study context tokenizes once and keeps its tensors in shared memory.
+def test_study_context(local_config):
+    context = StudyContext(local_config)
+
+    assert len(context.train_dataset) == 4
+    assert len(context.val_dataset) == 4
+    assert all(tensor.is_shared() for tensor in context.train_dataset.encodings.values())
+    assert all(param.is_shared() for param in context.pretrained_model.parameters())
+
+# This test will check that trials with a context copy the pretrained model instead of loading data and weights.
+def test_objective_with_context(local_config, mock_trial):
+    mock_trial.suggest_int.side_effect = [1, 1, 5]
+    context = StudyContext(local_config)
+
+    with patch('hyperoptim.create_data_loader') as mock_create_data_loader, \
+         patch('hyperoptim.DistilBertForSequenceClassification.from_pretrained') as mock_from_pretrained:
+        best_val_accuracy = objective(local_config, HYPEROPTIM_CONFIG, mock_trial, context)
+
+    assert 0 <= best_val_accuracy <= 1
+    mock_create_data_loader.assert_not_called()
+    mock_from_pretrained.assert_not_called()
+
+# This test will check the per-epoch fidelity schedule.
+def test_fidelity_schedule():
+    hyperoptim_config = {'fidelity': {'enabled': True, 'rungs': [{'data_fraction': 0.25, 'max_length': 64},
+                                                                 {'data_fraction': 0.5}]}}
+    full = {'data_fraction': 1.0, 'max_length': 128}
+
+    assert fidelity_schedule(hyperoptim_config, 4, 128) == [{'data_fraction': 0.25, 'max_length': 64},
+                                                            {'data_fraction': 0.5, 'max_length': 128}, full, full]
+    # Shorter trials still run every rung, so each step has the same fidelity in every trial
+    assert fidelity_schedule(hyperoptim_config, 2, 128) == [{'data_fraction': 0.25, 'max_length': 64},
+                                                            {'data_fraction': 0.5, 'max_length': 128}, full]
+    assert fidelity_schedule({}, 2, 128) == [full, full]
+
+# This test will check that multi-fidelity trials record less compute than full-fidelity training.
+def test_objective_multi_fidelity(local_config, mock_trial):
+    mock_trial.suggest_int.side_effect = [1, 3, 5]
+    hyperoptim_config = dict(HYPEROPTIM_CONFIG, fidelity={'enabled': True, 'rungs': [{'data_fraction': 0.5, 'max_length': 4}]})
+
+    best_val_accuracy = objective(local_config, hyperoptim_config, mock_trial)
+
+    assert 0 <= best_val_accuracy <= 1
+    assert mock_trial.report.call_count == 3
+    mock_trial.set_user_attr.assert_any_call('compute_cost', 0.25 + 1 + 1)
+
+# This test will check the compute savings report.
+def test_compute_savings():
+    study = optuna.create_study(direction='maximize')
+    study.add_trial(optuna.trial.create_trial(params={'epochs': 4}, distributions={'epochs': optuna.distributions.IntDistribution(1, 5)},
+                                              value=0.5, user_attrs={'compute_cost': 1.0}))
+    study.add_trial(optuna.trial.create_trial(params={'epochs': 4}, distributions={'epochs': optuna.distributions.IntDistribution(1, 5)},
+                                              state=optuna.trial.TrialState.PRUNED, user_attrs={'compute_cost': 1.0}))
+
+    savings = compute_savings(study)
+
+    assert savings == {'compute_cost': 2.0, 'full_fidelity_cost': 8, 'saved_fraction': 0.75}
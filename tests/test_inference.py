@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import pytest
+import torch
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+from src.artifact import save_model_artifact
+from src.cold_start import measure_cold_start
+from src.inference import load_inference_predictor
+from src.predict import WordPieceTokenizer
+from src.vocab_prune import PrunedTokenizer
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'the', 'climate', 'is', 'chang', '##ing', 'not', 'warm', 'sun',
+         '.', ',', "'", 'cafe', 'co', '##2']
+TEXTS = ["The Climate is CHANGING!", "Café, CO2 isn't warming.", "  the   sun\t中 ", "", "the " * 40]
+
+
+@pytest.fixture
+def tokenizer(tmpdir):
+    vocab_path = str(tmpdir.join('vocab.txt'))
+    with open(vocab_path, 'w') as file:
+        file.write('\n'.join(VOCAB))
+    return DistilBertTokenizer(vocab_path, do_lower_case=True)
+
+
+# Test 1: Importing the serving modules does not import PyTorch, transformers, ONNX Runtime, sklearn or matplotlib
+def test_inference_imports_are_lazy():
+    code = "import inference, predict, cache, serve; print(','.join(inference.loaded_heavy_modules()))"
+    completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                               env={**os.environ, 'PYTHONPATH': SRC})
+    assert completed.stdout.strip() == ''
+
+
+# Test 2: The WordPiece tokenizer produces the ids of the transformers tokenizer, also for pruned vocabularies
+def test_wordpiece_tokenizer_matches_transformers(tokenizer, tmpdir):
+    tokenizer.save_pretrained(str(tmpdir.join('saved')))
+    saved_files = [name for name in ('tokenizer.json', 'vocab.txt') if os.path.exists(tmpdir.join('saved', name))]
+    expected = tokenizer(TEXTS, truncation=True, max_length=12)['input_ids']
+    for path in [str(tmpdir.join('vocab.txt'))] + [str(tmpdir.join('saved', name)) for name in saved_files]:
+        fast_tokenizer = WordPieceTokenizer(path)
+        assert fast_tokenizer(TEXTS, truncation=True, max_length=12)['input_ids'] == expected
+        assert fast_tokenizer.pad_token_id == tokenizer.pad_token_id
+
+    kept_ids = [0, 1, 2, 3, 5, 6, 7, 8, 9, 12]
+    pruned = PrunedTokenizer(tokenizer, kept_ids)
+    fast_pruned = WordPieceTokenizer(str(tmpdir.join('vocab.txt')), kept_ids)
+    assert fast_pruned(TEXTS, max_length=12)['input_ids'] == pruned(TEXTS, truncation=True, max_length=12)['input_ids']
+    assert fast_pruned.pad_token_id == pruned.pad_token_id
+
+
+# Test 3: The cold start benchmark reports every phase from fresh processes
+def test_cold_start_benchmark(tokenizer, tmpdir):
+    model_config = DistilBertConfig(vocab_size=len(VOCAB), dim=16, hidden_dim=32, n_layers=2, n_heads=2, num_labels=2)
+    save_model_artifact(DistilBertForSequenceClassification(model_config), tokenizer, str(tmpdir.join('artifact')))
+    config_path = str(tmpdir.join('config.yaml'))
+    with open(config_path, 'w') as file:
+        file.write(f"model_artifact_path: {tmpdir.join('artifact')}\ntokenizer_model: unused\nmax_length: 16\n")
+
+    report = measure_cold_start(config_path, runs=1, text="the climate is changing")
+
+    assert set(report['median']) == {'import_s', 'load_s', 'first_prediction_s', 'total_s'}
+    assert report['runs'][0]['modules_after_import'] == []
+    assert 'torch' in report['runs'][0]['modules_after_load']
+    assert report['median']['total_s'] > report['median']['load_s'] > 0
+    with pytest.raises(ValueError):
+        load_inference_predictor({'max_length': 16}, backend='onnx')
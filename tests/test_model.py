@@ -157,4 +157,83 @@ def test_load_model_for_inference_invalid_device(mock_config, mock_model_for_inf
     invalid_device = 'invalid_device'
 
     with pytest.raises(RuntimeError):
-        load_model_for_inference(mock_config, invalid_device)
\ No newline at end of file
+        load_model_for_inference(mock_config, invalid_device)
+
+# Test 3: Finetuning from a pretrained model held in memory copies it and applies the dropout rate
+def test_load_model_for_finetuning_from_pretrained_model(mock_config):
+    model_config = DistilBertConfig(vocab_size=50, dim=16, hidden_dim=32, n_layers=6, n_heads=2,
+                                    num_labels=mock_config['num_labels'])
+    pretrained_model = DistilBertForSequenceClassification(model_config)
+    mock_config['dropout_rate'] = 0.3
+
+    model = load_model_for_finetuning(mock_config, pretrained_model=pretrained_model)
+
+    assert model is not pretrained_model
+    assert model.distilbert.transformer.layer[0].ffn.dropout.p == 0.3
+    assert model.distilbert.transformer.layer[0].attention.dropout.p == 0.3
+    assert pretrained_model.distilbert.transformer.layer[0].ffn.dropout.p == model_config.dropout
+    assert torch.equal(model.classifier.weight, pretrained_model.classifier.weight)
+    assert model.classifier.weight.data_ptr() != pretrained_model.classifier.weight.data_ptr()
+    for layer_idx in range(4, 6):
+        for param in model.distilbert.transformer.layer[layer_idx].parameters():
+            assert param.requires_grad
+    for param in model.distilbert.transformer.layer[0].parameters():
+        assert not param.requires_grad
+
+# Fixture for a tiny trained model saved locally, so that quantization tests do not download the checkpoint
+@pytest.fixture
+def tiny_inference_config(tmpdir):
+    model_config = DistilBertConfig(vocab_size=50, dim=16, hidden_dim=32, n_layers=2, n_heads=2, num_labels=2)
+    model = DistilBertForSequenceClassification(model_config)
+    model.save_pretrained(str(tmpdir.join('tiny')))
+    torch.save(model.state_dict(), str(tmpdir.join('trained_model.pth')))
+    return {
+        'model_name': str(tmpdir.join('tiny')),
+        'num_labels': 2,
+        'trained_model_path': str(tmpdir.join('trained_model.pth')),
+        'quantized_model_path': str(tmpdir.join('quantized', 'model.pth'))
+    }
+
+# Test 4a: Quantized models keep the predictions of the fp32 model
+@pytest.mark.parametrize("quantization, atol", [('dynamic_int8', 0.05), ('bf16', 0.05)])
+def test_load_model_for_inference_quantized(tiny_inference_config, quantization, atol):
+    input_ids = torch.randint(0, 50, (4, 12))
+    attention_mask = torch.ones_like(input_ids)
+    reference = load_model_for_inference(tiny_inference_config, 'cpu')(input_ids, attention_mask=attention_mask)
+
+    model = load_model_for_inference(tiny_inference_config, 'cpu', quantization=quantization)
+    logits = model(input_ids, attention_mask=attention_mask).logits
+
+    if quantization == 'dynamic_int8':
+        assert isinstance(model.classifier, torch.ao.nn.quantized.dynamic.Linear)
+    else:
+        assert logits.dtype == torch.bfloat16
+    assert torch.allclose(logits.float(), reference.logits, atol=atol)
+    assert not model.training
+
+# Test 4b: The quantized weights are cached and reused until the trained weights change
+def test_load_model_for_inference_quantized_cache(tiny_inference_config, mocker):
+    model = load_model_for_inference(tiny_inference_config, 'cpu', quantization='dynamic_int8')
+    quantize = mocker.patch('src.model.torch.ao.quantization.quantize_dynamic',
+                            wraps=torch.ao.quantization.quantize_dynamic)
+    from_pretrained = mocker.spy(DistilBertForSequenceClassification, 'from_pretrained')
+
+    cached = load_model_for_inference(tiny_inference_config, 'cpu', quantization='dynamic_int8')
+
+    from_pretrained.assert_not_called()
+    input_ids = torch.randint(0, 50, (2, 8))
+    assert torch.equal(model(input_ids).logits, cached(input_ids).logits)
+
+    # Another quantization or new trained weights invalidate the cache
+    assert load_model_for_inference(tiny_inference_config, 'cpu', quantization='bf16').classifier.weight.dtype \
+        == torch.bfloat16
+    torch.save(torch.load(tiny_inference_config['trained_model_path']), tiny_inference_config['trained_model_path'])
+    load_model_for_inference(tiny_inference_config, 'cpu', quantization='dynamic_int8')
+    assert from_pretrained.call_count == 2
+    assert quantize.call_count == 2
+
+# Test 4c: Unsupported quantization options are rejected
+@pytest.mark.parametrize("quantization, device", [('int4', 'cpu'), ('dynamic_int8', 'cuda')])
+def test_load_model_for_inference_invalid_quantization(tiny_inference_config, quantization, device):
+    with pytest.raises(ValueError):
+        load_model_for_inference(tiny_inference_config, device, quantization=quantization)
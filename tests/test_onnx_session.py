@@ -0,0 +1,78 @@
+import os
+import threading
+import pytest
+import numpy as np
+import onnxruntime
+import torch
+from transformers import DistilBertConfig, DistilBertForSequenceClassification
+from src.quantize import convert_to_onnx
+from src.onnx_session import create_session_options, load_session, SessionPool, load_session_pool
+
+class FixedTokenizer:
+    def __call__(self, text, **kwargs):
+        return {"input_ids": torch.tensor([[2, 7, 8, 9, 3]]), "attention_mask": torch.ones(1, 5, dtype=torch.long)}
+
+INPUTS = {"input_ids": np.random.randint(5, 50, (2, 9)).astype(np.int64),
+          "attention_mask": np.ones((2, 9), dtype=np.int64)}
+
+# Fixture for a small randomly initialized model exported locally, so no download is needed
+@pytest.fixture
+def onnx_path(tmpdir):
+    model_config = DistilBertConfig(vocab_size=50, dim=32, hidden_dim=64, n_layers=2, n_heads=2,
+                                    max_position_embeddings=64, num_labels=2)
+    model = DistilBertForSequenceClassification(model_config).eval()
+    path = str(tmpdir.join('model.onnx'))
+    convert_to_onnx(model, {'max_length': 64}, {'onnx_path': path}, tokenizer=FixedTokenizer())
+    return path
+
+# Test 1: Session options are taken from the configuration.
+def test_create_session_options():
+    options = create_session_options({'session_intra_op_threads': 2, 'session_inter_op_threads': 1,
+                                      'session_execution_mode': 'parallel',
+                                      'session_graph_optimization_level': 'extended',
+                                      'session_enable_cpu_mem_arena': False})
+
+    assert options.intra_op_num_threads == 2
+    assert options.inter_op_num_threads == 1
+    assert options.execution_mode == onnxruntime.ExecutionMode.ORT_PARALLEL
+    assert options.graph_optimization_level == onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    assert not options.enable_cpu_mem_arena
+    with pytest.raises(ValueError):
+        create_session_options({'session_graph_optimization_level': 'maximum'})
+
+# Test 2: The optimized graph is persisted on the first load and reused afterwards.
+def test_optimized_graph_is_persisted(onnx_path, tmpdir):
+    config = {'session_optimized_model_dir': str(tmpdir.join('optimized'))}
+    expected = onnxruntime.InferenceSession(onnx_path).run(["logits"], INPUTS)[0]
+
+    first = load_session(onnx_path, config)
+    cached_files = os.listdir(config['session_optimized_model_dir'])
+    assert len(cached_files) == 1 and cached_files[0].endswith('.onnx')
+    cached_path = os.path.join(config['session_optimized_model_dir'], cached_files[0])
+    modified = os.path.getmtime(cached_path)
+
+    second = load_session(onnx_path, config)
+    assert os.path.getmtime(cached_path) == modified
+    assert os.listdir(config['session_optimized_model_dir']) == cached_files
+    for session in (first, second):
+        assert np.allclose(session.run(["logits"], INPUTS)[0], expected, atol=1e-5)
+
+# Test 3: The pool serves concurrent callers with distinct sessions and behaves like a session.
+def test_session_pool(onnx_path):
+    pool = load_session_pool(onnx_path, {'session_pool_size': 2, 'session_intra_op_threads': 1})
+    expected = pool.run(["logits"], INPUTS)[0]
+    assert pool.get_inputs()[0].name == 'input_ids'
+
+    with pool.session() as first, pool.session() as second:
+        assert first is not second
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.run(["logits"], INPUTS)[0])) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 8
+    assert all(np.allclose(result, expected) for result in results)
+    with pytest.raises(ValueError):
+        SessionPool(onnx_path, {}, size=0)
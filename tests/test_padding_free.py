@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import torch
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+from src.artifact import save_model_artifact
+from src.padding_free import PaddingFreeBackend, measure_speedup, pack, padding_free_forward
+from src.predict import load_predictor
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'the', 'climate', 'is', 'changing', 'not', 'warming', 'sun']
+TEXTS = ["the climate is changing", "", "sun", "the sun is not warming the climate " * 4, "not warming"] * 3
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    model_config = DistilBertConfig(vocab_size=len(VOCAB), dim=16, hidden_dim=32, n_layers=2, n_heads=2, num_labels=3)
+    return DistilBertForSequenceClassification(model_config).eval()
+
+
+@pytest.fixture
+def tokenizer(tmpdir):
+    vocab_path = str(tmpdir.join('vocab.txt'))
+    with open(vocab_path, 'w') as file:
+        file.write('\n'.join(VOCAB))
+    return DistilBertTokenizer(vocab_path)
+
+
+# Test 1: Both attention modes give the logits of the padded forward pass, also for a quantized model
+def test_padding_free_forward_matches_padded(model, tokenizer):
+    batch = tokenizer(TEXTS, padding=True, return_tensors='pt')
+    packing = pack(batch['input_ids'], batch['attention_mask'])
+    assert packing['input_ids'].numel() == batch['attention_mask'].sum()
+    assert packing['offsets'][-1] == batch['attention_mask'].sum()
+
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    with torch.inference_mode():
+        # Dynamic quantization scales the activations by their range, which includes the padding in the padded pass
+        for candidate, atol in ((model, 1e-5), (quantized, 1e-3)):
+            expected = candidate(batch['input_ids'], attention_mask=batch['attention_mask']).logits
+            for mode in ('sdpa', 'nested'):
+                logits = padding_free_forward(candidate, batch['input_ids'], batch['attention_mask'], mode)
+                torch.testing.assert_close(logits, expected, atol=atol, rtol=1e-4)
+    with pytest.raises(ValueError):
+        PaddingFreeBackend(model, mode='flash')
+
+
+# Test 2: The predictor uses the padding-free backend when configured and returns the same probabilities
+def test_load_predictor_padding_free(model, tokenizer, tmpdir):
+    save_model_artifact(model, tokenizer, str(tmpdir.join('artifact')))
+    config = {'model_artifact_path': str(tmpdir.join('artifact')), 'tokenizer_model': 'unused', 'max_length': 32,
+              'token_budget': 40}
+    expected = load_predictor(config).predict_proba(TEXTS)
+
+    predictor = load_predictor({**config, 'inference_padding_free': True, 'padding_free_attention': 'nested'})
+    assert type(predictor.backend).__name__ == 'PaddingFreeBackend' and predictor.backend.mode == 'nested'
+    np.testing.assert_allclose(predictor.predict_proba(TEXTS), expected, atol=1e-5)
+
+
+# Test 3: The speedup report compares both modes with the padded path on the same texts
+def test_measure_speedup(model, tokenizer, tmpdir):
+    save_model_artifact(model, tokenizer, str(tmpdir.join('artifact')))
+    predictor = load_predictor({'model_artifact_path': str(tmpdir.join('artifact')), 'tokenizer_model': 'unused',
+                                'max_length': 32, 'max_inference_batch_size': 8})
+    report = measure_speedup(predictor, TEXTS, repeats=1)
+
+    assert 0 < report['padding_fraction'] < 1
+    assert report['padded']['texts_per_second'] > 0
+    for mode in ('sdpa', 'nested'):
+        assert report[mode]['max_abs_diff'] < 1e-5
+        assert report[mode]['speedup'] > 0
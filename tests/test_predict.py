@@ -0,0 +1,84 @@
+import pytest
+import numpy as np
+import torch
+from unittest.mock import MagicMock
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+from src.predict import TorchBackend, OnnxBackend, BatchPredictor, make_batches, load_predictor
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'climate', 'change', 'is', 'real', 'the', 'sun',
+         'warming', 'ice', 'melting', 'hoax', 'carbon', 'we', 'need', 'to', 'act', 'now']
+
+TEXTS = ['climate change is real and we need to act now', 'hoax', 'the sun is warming the ice',
+         'carbon', 'ice melting is real']
+
+# Fixture for a small tokenizer and randomly initialized model saved locally, so no download is needed
+@pytest.fixture
+def mock_config(tmpdir):
+    tokenizer_dir = tmpdir.mkdir('tokenizer')
+    tokenizer_dir.join('vocab.txt').write('\n'.join(VOCAB) + '\n')
+    model_config = DistilBertConfig(vocab_size=len(VOCAB), dim=32, hidden_dim=64, n_layers=2, n_heads=2,
+                                    max_position_embeddings=64, num_labels=3)
+    model = DistilBertForSequenceClassification(model_config)
+    model.save_pretrained(str(tmpdir.join('base')))
+    torch.save(model.state_dict(), str(tmpdir.join('trained_model.pth')))
+    return {
+        'model_name': str(tmpdir.join('base')),
+        'tokenizer_model': str(tokenizer_dir),
+        'num_labels': 3,
+        'max_length': 16,
+        'token_budget': 24,
+        'max_inference_batch_size': 4,
+        'trained_model_path': str(tmpdir.join('trained_model.pth'))
+    }
+
+# Test 1: Batches respect the token budget and the maximum batch size.
+def test_make_batches():
+    lengths = [2, 3, 3, 4, 8, 8, 16]
+    batches = make_batches(lengths, token_budget=16, max_batch_size=3)
+
+    assert batches[0][0] == 0 and batches[-1][1] == len(lengths)
+    for start, end in batches:
+        assert end - start <= 3
+        assert end - start == 1 or (end - start) * lengths[end - 1] <= 16
+
+# Test 2: Probabilities match the model run on each text on its own and come back in the original order.
+def test_predict_proba_matches_unbatched(mock_config):
+    predictor = load_predictor(mock_config)
+    model = predictor.backend.model
+    tokenizer = DistilBertTokenizer.from_pretrained(mock_config['tokenizer_model'])
+
+    probabilities = predictor.predict_proba(TEXTS)
+
+    for text, row in zip(TEXTS, probabilities):
+        inputs = tokenizer(text, return_tensors='pt')
+        with torch.no_grad():
+            expected = torch.softmax(model(**inputs).logits, dim=-1)[0].numpy()
+        assert np.allclose(row, expected, atol=1e-5)
+    assert np.array_equal(predictor.predict(TEXTS), probabilities.argmax(axis=1))
+
+# Test 3: An empty input returns empty results.
+def test_predict_empty(mock_config):
+    predictor = load_predictor(mock_config)
+    assert predictor.predict_proba([]).shape == (0, 3)
+    assert predictor.predict([]).shape == (0,)
+
+# Test 4: The ONNX backend pads to the fixed sequence length of the exported model.
+def test_onnx_backend_fixed_length():
+    session = MagicMock()
+    session.get_inputs.return_value = [MagicMock(shape=['batch_size', 8])]
+    session.get_outputs.return_value = [MagicMock(shape=['batch_size', 3])]
+    session.run.return_value = [np.zeros((2, 3), dtype=np.float32)]
+    backend = OnnxBackend(session)
+
+    backend(np.ones((2, 5), dtype=np.int64), np.ones((2, 5), dtype=np.int64))
+
+    inputs = session.run.call_args.args[1]
+    assert inputs['input_ids'].shape == (2, 8)
+    assert inputs['attention_mask'][:, 5:].sum() == 0
+
+# Test 5: Unsupported backends raise a ValueError.
+def test_load_predictor_invalid_backend(mock_config):
+    with pytest.raises(ValueError):
+        load_predictor(mock_config, backend='tensorflow')
+    with pytest.raises(ValueError):
+        load_predictor(mock_config, backend='onnx')
@@ -1,10 +1,15 @@
+import os
+import onnx
 import pytest
 import torch
 import numpy as np
 from unittest.mock import MagicMock, patch
 from transformers import DistilBertForSequenceClassification, DistilBertTokenizer
+from torch.utils.data import DataLoader, Dataset
 from onnxruntime import InferenceSession
-from src.quantize import convert_to_onnx, dynamic_quantize, evaluate_onnx_model
+from onnxruntime.quantization import QuantType
+from src.quantize import convert_to_onnx, dynamic_quantize, static_quantize, evaluate_onnx_model, validate_onnx_export, \
+    quantization_input
 from utils import calculate_f1_score
 
 # Mock data for testing
@@ -127,4 +132,137 @@ def test_evaluate_onnx_model_invalid_inputs(mocker):
 
     # Call the function and check for exceptions
     with pytest.raises(Exception):
-        evaluate_onnx_model(mock_session, invalid_loader)
\ No newline at end of file
+        evaluate_onnx_model(mock_session, invalid_loader)
+
+# Fixture for a small randomly initialized model and tokenizer saved locally, so no download is needed
+@pytest.fixture
+def small_model(tmpdir):
+    from transformers import DistilBertConfig
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'this', 'is', 'a', 'dummy', 'input', 'for', 'onnx', '.']
+    tmpdir.join('vocab.txt').write('\n'.join(vocab) + '\n')
+    model_config = DistilBertConfig(vocab_size=len(vocab), dim=32, hidden_dim=64, n_layers=2, n_heads=2,
+                                    max_position_embeddings=64, num_labels=2)
+    model = DistilBertForSequenceClassification(model_config).eval()
+    quantize_config = {
+        'onnx_path': str(tmpdir.join('model.onnx')),
+        'optimized_onnx_path': str(tmpdir.join('model_optimized.onnx')),
+        'quantized_onnx_path': str(tmpdir.join('model_quantized.onnx')),
+        'validation_lengths': [3, 17, 64]
+    }
+    return model, DistilBertTokenizer.from_pretrained(str(tmpdir)), quantize_config
+
+# Test the export has a dynamic sequence length and the optimized model matches PyTorch
+def test_convert_to_onnx_dynamic_sequence_length(small_model):
+    """
+    Test that the exported and optimized models accept any sequence length and are quantized from the optimized model.
+    """
+    model, tokenizer, quantize_config = small_model
+
+    convert_to_onnx(model, {'max_length': 64}, quantize_config, tokenizer=tokenizer)
+    dynamic_quantize(quantize_config)
+
+    for path in [quantize_config['onnx_path'], quantize_config['optimized_onnx_path']]:
+        session = InferenceSession(path)
+        assert isinstance(session.get_inputs()[0].shape[1], str)
+    session = InferenceSession(quantize_config['quantized_onnx_path'])
+    logits = session.run(["logits"], {"input_ids": np.ones((3, 11), dtype=np.int64),
+                                      "attention_mask": np.ones((3, 11), dtype=np.int64)})[0]
+    assert logits.shape == (3, 2)
+
+# Test validate_onnx_export rejects a model that does not match
+def test_validate_onnx_export_mismatch(small_model):
+    """
+    Test that validate_onnx_export raises a ValueError when the ONNX logits differ from PyTorch.
+    """
+    model, tokenizer, quantize_config = small_model
+    convert_to_onnx(model, {'max_length': 64}, {'onnx_path': quantize_config['onnx_path']}, tokenizer=tokenizer)
+
+    with torch.no_grad():
+        model.classifier.bias += 1.0
+    with pytest.raises(ValueError):
+        validate_onnx_export(model, quantize_config['onnx_path'], [5])
+
+# Test static_quantize with each calibration method
+@pytest.mark.parametrize("method", ["minmax", "entropy", "percentile"])
+def test_static_quantize(small_model, method):
+    """
+    Test that static_quantize produces a QDQ model calibrated on loader batches that evaluate_onnx_model can run.
+    """
+    model, tokenizer, quantize_config = small_model
+    convert_to_onnx(model, {'max_length': 64}, {'onnx_path': quantize_config['onnx_path']}, tokenizer=tokenizer)
+    input_ids = torch.randint(5, model.config.vocab_size, (8, 16))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[::2, 10:] = 0
+    loader = DataLoader([{"input_ids": input_ids[i], "attention_mask": attention_mask[i], "labels": i % 2}
+                         for i in range(8)], batch_size=4)
+    quantize_config.update({'static_quantized_onnx_path': quantize_config['quantized_onnx_path'],
+                            'calibration_batches': 1, 'calibration_method': method, 'per_channel': True})
+
+    static_quantize(quantize_config, loader)
+
+    session = InferenceSession(quantize_config['quantized_onnx_path'])
+    assert any(node.op_type == 'QuantizeLinear' for node in onnx.load(quantize_config['quantized_onnx_path']).graph.node)
+    accuracy, f1, all_val_labels, all_val_preds = evaluate_onnx_model(session, loader)
+    assert 0 <= accuracy <= 1
+    assert len(all_val_preds) == 8
+
+# Test static_quantize with an unsupported calibration method
+def test_static_quantize_invalid_method():
+    """
+    Test that static_quantize raises a ValueError for an unknown calibration method.
+    """
+    with pytest.raises(ValueError):
+        static_quantize({'onnx_path': 'model.onnx', 'static_quantized_onnx_path': 'out.onnx',
+                         'calibration_method': 'mse'}, MOCK_VAL_LOADER)
+
+# Test dynamic_quantize with a configured weight type and excluded scopes
+def test_dynamic_quantize_options(small_model):
+    """
+    Test that dynamic_quantize keeps excluded scopes in float and honours the weight type.
+    """
+    model, tokenizer, quantize_config = small_model
+    quantize_config = {'onnx_path': quantize_config['onnx_path'],
+                       'quantized_onnx_path': quantize_config['quantized_onnx_path'],
+                       'weight_type': 'quint8', 'exclude_scopes': ['classifier']}
+    convert_to_onnx(model, {'max_length': 64}, quantize_config, tokenizer=tokenizer)
+
+    dynamic_quantize(quantize_config)
+
+    nodes = onnx.load(quantize_config['quantized_onnx_path']).graph.node
+    assert any(node.op_type == 'MatMulInteger' for node in nodes)
+    assert not any(node.op_type == 'MatMulInteger' and 'classifier' in node.name for node in nodes)
+
+# Test evaluate_onnx_model gives the same results with IO binding, plain runs and prefetching
+def test_evaluate_onnx_model_io_binding(small_model, capsys):
+    """
+    Test that the IO binding and prefetch paths match plain session runs and that verbose=0 prints nothing.
+    """
+    model, tokenizer, quantize_config = small_model
+    convert_to_onnx(model, {'max_length': 64}, {'onnx_path': quantize_config['onnx_path']}, tokenizer=tokenizer)
+    session = InferenceSession(quantize_config['onnx_path'])
+    input_ids = torch.randint(5, model.config.vocab_size, (7, 12))
+    loader = DataLoader([{"input_ids": input_ids[i], "attention_mask": torch.ones(12, dtype=torch.long),
+                          "labels": i % 2} for i in range(7)], batch_size=3)
+
+    expected = evaluate_onnx_model(session, loader, use_io_binding=False)
+    capsys.readouterr()
+    for kwargs in [{'use_io_binding': True}, {'use_io_binding': True, 'prefetch': 2}]:
+        accuracy, f1, labels, preds = evaluate_onnx_model(session, loader, verbose=0, **kwargs)
+        assert accuracy == expected[0] and f1 == expected[1]
+        assert np.array_equal(labels, expected[2]) and np.array_equal(preds, expected[3])
+    assert capsys.readouterr().out == ''
+
+# Test an optimized model older than the export is not quantized
+def test_quantization_input_ignores_stale_optimized_model(small_model):
+    """
+    Test that quantization_input only picks the optimized model if it is not older than the exported model.
+    """
+    model, tokenizer, quantize_config = small_model
+    convert_to_onnx(model, {'max_length': 64}, quantize_config, tokenizer=tokenizer)
+    assert quantization_input(quantize_config) == quantize_config['optimized_onnx_path']
+
+    # Re-exporting without optimizing leaves the optimized model of the previous export behind
+    convert_to_onnx(model, {'max_length': 64}, {'onnx_path': quantize_config['onnx_path']}, tokenizer=tokenizer)
+    optimized_mtime = os.path.getmtime(quantize_config['optimized_onnx_path'])
+    os.utime(quantize_config['onnx_path'], (optimized_mtime + 1, optimized_mtime + 1))
+    assert quantization_input(quantize_config) == quantize_config['onnx_path']
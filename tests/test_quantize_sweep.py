@@ -0,0 +1,64 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader
+from transformers import DistilBertConfig, DistilBertForSequenceClassification
+from src.quantize import convert_to_onnx
+from src.quantize_sweep import pareto_front, sweep, write_report
+
+class FixedTokenizer:
+    def __call__(self, text, **kwargs):
+        return {"input_ids": torch.tensor([[2, 7, 8, 9, 3]]), "attention_mask": torch.ones(1, 5, dtype=torch.long)}
+
+# Fixture for a small randomly initialized model exported locally, so no download is needed
+@pytest.fixture
+def exported_model(tmpdir):
+    model_config = DistilBertConfig(vocab_size=50, dim=32, hidden_dim=64, n_layers=2, n_heads=2,
+                                    max_position_embeddings=64, num_labels=2)
+    model = DistilBertForSequenceClassification(model_config).eval()
+    quantize_config = {'onnx_path': str(tmpdir.join('model.onnx'))}
+    convert_to_onnx(model, {'max_length': 64}, quantize_config, tokenizer=FixedTokenizer())
+
+    input_ids = torch.randint(5, 50, (8, 12))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[::2, 6:] = 0
+    val_loader = DataLoader([{"input_ids": input_ids[i], "attention_mask": attention_mask[i], "labels": i % 2}
+                             for i in range(8)], batch_size=4)
+    return quantize_config, val_loader, str(tmpdir.join('sweep'))
+
+# Test 1: Only variants that no other variant beats on every objective are Pareto-optimal.
+def test_pareto_front():
+    results = [
+        {'name': 'fp32', 'f1': 0.90, 'size_mb': 4.0, 'latency': {1: {'p95_ms': 10.0}}},
+        {'name': 'int8', 'f1': 0.89, 'size_mb': 1.0, 'latency': {1: {'p95_ms': 4.0}}},
+        {'name': 'bad', 'f1': 0.85, 'size_mb': 1.2, 'latency': {1: {'p95_ms': 5.0}}}
+    ]
+    marked = {result['name']: result['pareto'] for result in pareto_front(results)}
+    assert marked == {'fp32': True, 'int8': True, 'bad': False}
+
+# Test 2: The sweep builds, evaluates and benchmarks each variant and writes the report.
+def test_sweep_and_report(exported_model):
+    quantize_config, val_loader, output_dir = exported_model
+    variants = [
+        {'name': 'fp32', 'method': 'fp32'},
+        {'name': 'dynamic_qint8', 'method': 'dynamic', 'weight_type': 'qint8', 'exclude_scopes': ['classifier']},
+        {'name': 'static_minmax', 'method': 'static', 'calibration_method': 'minmax', 'calibration_batches': 1}
+    ]
+
+    results = sweep(quantize_config, val_loader, variants, batch_sizes=[1, 4], output_dir=output_dir,
+                    iterations=2)
+    report = write_report(results, output_dir)
+
+    assert [result['name'] for result in results] == ['fp32', 'dynamic_qint8', 'static_minmax']
+    for result in results:
+        assert 0 <= result['f1'] <= 1
+        assert result['size_mb'] > 0
+        assert set(result['latency']) == {1, 4}
+        assert result['latency'][4]['p95_ms'] >= result['latency'][4]['p50_ms']
+    assert any(result['pareto'] for result in results)
+    assert 'static_minmax' in report
+
+# Test 3: An unknown method is rejected.
+def test_sweep_invalid_method(exported_model):
+    quantize_config, val_loader, output_dir = exported_model
+    with pytest.raises(ValueError):
+        sweep(quantize_config, val_loader, [{'name': 'fp16', 'method': 'fp16'}], output_dir=output_dir)
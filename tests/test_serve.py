@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+import numpy as np
+from src.serve import MicroBatcher, start_server, InferenceClient
+
+class FakePredictor:
+    """Returns one-hot probabilities on the text length and records the size of every batch it runs."""
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batch_sizes = []
+        self.thread_ids = set()
+
+    def predict_proba(self, texts):
+        self.batch_sizes.append(len(texts))
+        self.thread_ids.add(threading.get_ident())
+        time.sleep(self.delay)
+        probabilities = np.zeros((len(texts), 3), dtype=np.float32)
+        probabilities[np.arange(len(texts)), [len(text) % 3 for text in texts]] = 1.0
+        return probabilities
+
+async def _with_server(predictor, scenario, **batcher_kwargs):
+    batcher = MicroBatcher(predictor, **batcher_kwargs)
+    server = await start_server(batcher, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        return await scenario(batcher, port)
+    finally:
+        server.close()
+        await server.wait_closed()
+        await batcher.stop()
+
+# Test 1: Concurrent requests are coalesced into micro-batches and each gets its own results back.
+def test_concurrent_requests_are_batched():
+    predictor = FakePredictor(delay=0.01)
+
+    async def scenario(batcher, port):
+        texts = ['a' * i for i in range(20)]
+        results = await asyncio.gather(*(batcher.submit([text]) for text in texts))
+        return texts, results
+
+    texts, results = asyncio.run(_with_server(predictor, scenario, max_batch_size=8, max_wait_ms=50))
+
+    for text, probabilities in zip(texts, results):
+        assert probabilities.shape == (1, 3)
+        assert probabilities[0].argmax() == len(text) % 3
+    assert max(predictor.batch_sizes) <= 8
+    assert len(predictor.batch_sizes) < len(texts)
+    assert threading.get_ident() not in predictor.thread_ids
+
+# Test 2: Multi-text requests never push a batch past the maximum size, and are kept whole.
+def test_multi_text_requests_respect_max_batch_size():
+    predictor = FakePredictor(delay=0.01)
+
+    async def scenario(batcher, port):
+        requests = [['a' * i for i in range(start, start + 5)] for start in range(0, 20, 5)]
+        requests.append(['b'] * 12)
+        results = await asyncio.gather(*(batcher.submit(texts) for texts in requests))
+        return requests, results
+
+    requests, results = asyncio.run(_with_server(predictor, scenario, max_batch_size=8, max_wait_ms=50))
+
+    for texts, probabilities in zip(requests, results):
+        assert probabilities.shape == (len(texts), 3)
+        assert list(probabilities.argmax(axis=1)) == [len(text) % 3 for text in texts]
+    # Only the request larger than the maximum on its own runs as an oversized batch
+    assert sorted(predictor.batch_sizes) == [5, 5, 5, 5, 12]
+
+# Test 3: A lone request is not held longer than the maximum wait.
+def test_max_wait_bounds_latency():
+    predictor = FakePredictor()
+
+    async def scenario(batcher, port):
+        start = time.perf_counter()
+        await batcher.submit(['hello'])
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(_with_server(predictor, scenario, max_batch_size=64, max_wait_ms=20))
+    assert elapsed < 1.0
+    assert predictor.batch_sizes == [1]
+
+# Test 4: The HTTP API serves predictions in request order through the in-process client.
+def test_http_predict_and_health():
+    predictor = FakePredictor()
+
+    async def scenario(batcher, port):
+        client = InferenceClient('127.0.0.1', port)
+        health = await client.request('GET', '/health')
+        predictions = await client.predict(['a', 'ab', 'abc'])
+        single = await client.request('POST', '/predict', {'text': 'ab'})
+        await client.close()
+        return health, predictions, single
+
+    health, predictions, single = asyncio.run(_with_server(predictor, scenario))
+
+    assert health == (200, {'status': 'ok'})
+    assert [prediction['label'] for prediction in predictions] == [1, 2, 0]
+    assert len(predictions[0]['probabilities']) == 3
+    assert single[0] == 200 and single[1]['predictions'][0]['label'] == 2
+
+# Test 5: Malformed requests, unknown routes and predictor failures return error statuses.
+def test_http_errors():
+    class FailingPredictor:
+        def predict_proba(self, texts):
+            raise RuntimeError('model failed')
+
+    async def scenario(batcher, port):
+        client = InferenceClient('127.0.0.1', port)
+        bad_body = await client.request('POST', '/predict', {'quotes': ['a']})
+        not_found = await client.request('GET', '/missing')
+        failed = await client.request('POST', '/predict', {'texts': ['a']})
+        await client.close()
+        return bad_body, not_found, failed
+
+    bad_body, not_found, failed = asyncio.run(_with_server(FailingPredictor(), scenario))
+
+    assert bad_body[0] == 400
+    assert not_found[0] == 404
+    assert failed == (500, {'error': 'model failed'})
@@ -291,4 +291,22 @@ def test_test_model_missing_labels(mocker):
     # Call the function and check for ValueError
     device = 'cpu'
     with pytest.raises(ValueError):
-        test_model(model, test_loader, device)
\ No newline at end of file
+        test_model(model, test_loader, device)
+
+# Test 13: Test the test_model function with dictionary batches from create_data_loader.
+def test_test_model_dict_batches(mocker):
+    model = mocker.MagicMock()
+    model.return_value.logits = torch.tensor([[0.9, 0.1], [0.2, 0.8]])
+    batch = {
+        'input_ids': torch.tensor([[1, 2], [3, 4]]),
+        'attention_mask': torch.tensor([[1, 1], [1, 1]]),
+        'labels': torch.tensor([0, 0])
+    }
+    test_loader = mocker.MagicMock()
+    test_loader.__iter__.return_value = [batch]
+
+    accuracy, f1, y_true, y_pred = test_model(model, test_loader, 'cpu')
+
+    assert accuracy == 0.5
+    assert list(y_true) == [0, 0]
+    assert list(y_pred) == [0, 1]
@@ -8,6 +8,7 @@ from src.utils import (
     plot_precision_recall, 
     plot_roc_curve, 
     calculate_f1_score, 
+    partition_cores, 
     plot_loss, 
     plot_accuracy, 
     plot_confusion_matrix
@@ -196,4 +197,11 @@ def test_calculate_f1_score_invalid_inputs():
 
     # Test invalid labels
     with pytest.raises(ValueError):
-        calculate_f1_score([0, 1], [2, 3])  # pred_labels not in true_labels
\ No newline at end of file
+        calculate_f1_score([0, 1], [2, 3])  # pred_labels not in true_labels
+
+# Test 13: Test partition_cores with and without a fixed number of threads per worker.
+def test_partition_cores():
+    cores = [0, 1, 2, 3, 4, 5, 6]
+    assert partition_cores(3, cores=cores) == [[0, 1, 2], [3, 4], [5, 6]]
+    assert partition_cores(3, threads_per_worker=3, cores=cores) == [[0, 1, 2], [3, 4, 5], [6, 0, 1]]
+    assert partition_cores(2, threads_per_worker=10, cores=[2, 3]) == [[2, 3], [2, 3]]
@@ -0,0 +1,91 @@
+import pytest
+import torch
+import pandas as pd
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+from src.vocab_prune import read_texts, build_reduced_vocab, PrunedTokenizer, prune_embeddings, prune_model_vocabulary
+from src.model import load_model_for_inference
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'climate', 'change', 'is', 'real', 'the', 'sun',
+         'warming', 'ice', 'melting', 'hoax', 'carbon', 'we', 'need', 'to', 'act', 'now']
+
+# Fixture for a small tokenizer and randomly initialized model saved locally, so no download is needed
+@pytest.fixture
+def mock_config(tmpdir):
+    tokenizer_dir = tmpdir.mkdir('tokenizer')
+    tokenizer_dir.join('vocab.txt').write('\n'.join(VOCAB) + '\n')
+
+    model_config = DistilBertConfig(vocab_size=len(VOCAB), dim=32, hidden_dim=64, n_layers=2, n_heads=2,
+                                    max_position_embeddings=64, num_labels=3)
+    model = DistilBertForSequenceClassification(model_config)
+    model.save_pretrained(str(tmpdir.join('base')))
+    torch.save(model.state_dict(), str(tmpdir.join('trained_model.pth')))
+
+    corpus_path = str(tmpdir.join('train.csv'))
+    pd.DataFrame({'quote': ['Climate change is real', 'We need to act now'],
+                  'label': [0, 1]}).to_csv(corpus_path, index=False)
+
+    return {
+        'model_name': str(tmpdir.join('base')),
+        'tokenizer_model': str(tokenizer_dir),
+        'num_labels': 3,
+        'max_length': 16,
+        'trained_model_path': str(tmpdir.join('trained_model.pth')),
+        'prune_corpus_paths': [corpus_path],
+        'pruned_vocab_path': str(tmpdir.join('pruned_vocab')),
+        'pruned_model_path': str(tmpdir.join('pruned_model.pth'))
+    }
+
+# Test 1: The reduced vocabulary keeps the corpus tokens and the special tokens.
+def test_build_reduced_vocab(mock_config):
+    tokenizer = DistilBertTokenizer.from_pretrained(mock_config['tokenizer_model'])
+    kept_ids = build_reduced_vocab(tokenizer, ['climate change is real'])
+
+    assert kept_ids == sorted(kept_ids)
+    assert set(tokenizer.all_special_ids) <= set(kept_ids)
+    assert tokenizer.convert_tokens_to_ids('climate') in kept_ids
+    assert tokenizer.convert_tokens_to_ids('hoax') not in kept_ids
+
+# Test 2: Pruned tokens are mapped to the unknown token.
+def test_pruned_tokenizer_maps_out_of_vocabulary_to_unk(mock_config):
+    tokenizer = DistilBertTokenizer.from_pretrained(mock_config['tokenizer_model'])
+    kept_ids = build_reduced_vocab(tokenizer, ['climate change is real'])
+    pruned_tokenizer = PrunedTokenizer(tokenizer, kept_ids)
+
+    encodings = pruned_tokenizer(['climate hoax'], return_tensors='pt')
+    assert encodings['input_ids'].max() < len(pruned_tokenizer)
+    assert encodings['input_ids'][0, 2] == pruned_tokenizer.unk_token_id
+
+# Test 3: The embedding matrix is shrunk to the kept ids.
+def test_prune_embeddings(mock_config):
+    model = DistilBertForSequenceClassification.from_pretrained(mock_config['model_name'])
+    original = model.distilbert.embeddings.word_embeddings.weight.clone()
+    kept_ids = [0, 1, 2, 3, 4, 5, 6]
+
+    prune_embeddings(model, kept_ids)
+
+    assert model.config.vocab_size == len(kept_ids)
+    assert torch.equal(model.distilbert.embeddings.word_embeddings.weight, original[kept_ids])
+
+# Test 4: The pruned model loads with load_model_for_inference and predicts the same on in-vocabulary text.
+def test_prune_model_vocabulary_identical_predictions(mock_config):
+    texts = ['climate change is real', 'we need to act now']
+    original_model = load_model_for_inference(mock_config, 'cpu')
+    tokenizer = DistilBertTokenizer.from_pretrained(mock_config['tokenizer_model'])
+    original_inputs = tokenizer(texts, padding=True, return_tensors='pt')
+
+    prune_model_vocabulary(mock_config)
+    pruned_tokenizer = PrunedTokenizer.from_pretrained(mock_config['pruned_vocab_path'])
+    pruned_model = load_model_for_inference(dict(mock_config, trained_model_path=mock_config['pruned_model_path']), 'cpu')
+    pruned_inputs = pruned_tokenizer(texts, padding=True, return_tensors='pt')
+
+    with torch.no_grad():
+        expected = original_model(**original_inputs).logits
+        actual = pruned_model(**pruned_inputs).logits
+
+    assert pruned_model.config.vocab_size == len(pruned_tokenizer) < len(VOCAB)
+    assert torch.allclose(actual, expected, atol=1e-5)
+
+# Test 5: Unsupported corpus file types raise a ValueError.
+def test_read_texts_invalid_file_type():
+    with pytest.raises(ValueError):
+        read_texts('/tmp/corpus.txt')
@@ -0,0 +1,70 @@
+import os
+import signal
+import numpy as np
+import pytest
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+from src.predict import BatchPredictor, TorchBackend
+from src.utils import partition_cores
+from src.worker_pool import InferencePool
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'the', 'climate', 'is', 'changing', 'not', 'warming', 'sun']
+
+
+class FailingPredictor:
+    def predict_proba(self, texts):
+        raise ValueError("broken model")
+
+
+@pytest.fixture
+def predictor(tmpdir):
+    vocab_path = str(tmpdir.join('vocab.txt'))
+    with open(vocab_path, 'w') as file:
+        file.write('\n'.join(VOCAB))
+    model_config = DistilBertConfig(vocab_size=len(VOCAB), dim=16, hidden_dim=32, n_layers=2, n_heads=2, num_labels=3)
+    model = DistilBertForSequenceClassification(model_config).eval()
+    return BatchPredictor(TorchBackend(model), DistilBertTokenizer(vocab_path), max_length=16)
+
+
+# Test 1: Cores are split into disjoint sets, and shared round-robin when there are more workers than cores
+def test_partition_cores():
+    assert partition_cores(3, cores=[0, 1, 2, 3, 4, 5, 6]) == [[0, 1, 2], [3, 4], [5, 6]]
+    assert partition_cores(3, cores=[4, 5]) == [[4], [5], [4]]
+
+
+# Test 2: The workers return the predictions of the predictor in order and report their memory usage
+def test_inference_pool_matches_predictor(predictor):
+    texts = ["the climate is changing", "not the sun", "warming", "the sun is not warming the climate"] * 5
+    expected = predictor.predict_proba(texts)
+
+    with InferencePool(predictor, num_workers=2, chunk_size=3) as pool:
+        probabilities = pool.predict_proba(texts)
+        report = pool.memory_report()
+        assert pool.predict([]).shape == (0,)
+
+    np.testing.assert_allclose(probabilities, expected, atol=1e-6)
+    assert len(report['workers']) == 2
+    if report['parent']:
+        assert all(usage['rss_mb'] > 0 for usage in report['workers'])
+
+
+# Test 3: Worker errors are raised in the caller, and the pool must be started
+def test_inference_pool_errors():
+    pool = InferencePool(FailingPredictor(), num_workers=1)
+    with pytest.raises(RuntimeError):
+        pool.predict_proba(["the sun"])
+    with pool:
+        with pytest.raises(RuntimeError, match="broken model"):
+            pool.predict_proba(["the sun"])
+    with pytest.raises(ValueError):
+        InferencePool(FailingPredictor(), num_workers=0)
+
+
+# Test 4: After a worker is killed, every later call raises instead of waiting for a result
+def test_inference_pool_dead_worker(predictor):
+    with InferencePool(predictor, num_workers=1) as pool:
+        process = pool._processes[0]
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match="exited unexpectedly"):
+                pool.predict_proba(["the sun"])